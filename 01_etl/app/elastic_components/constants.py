@@ -0,0 +1,10 @@
+from enum import Enum
+
+
+class BulkModeEnum(Enum):
+    """Способы отправки bulk запросов в Elastic"""
+
+    BULK = 'bulk'  # один блокирующий helpers.bulk
+    STREAMING = 'streaming'  # helpers.streaming_bulk: чанки по очереди, без накопления ответов
+    PARALLEL = 'parallel'  # helpers.parallel_bulk: несколько чанков одновременно из пула потоков
+    NDJSON = 'ndjson'  # тело запроса собирается из заранее сериализованных документов и уходит в client.bulk как есть
@@ -0,0 +1,59 @@
+"""
+Здесь описано, какие ошибки Elastic имеет смысл повторять.
+
+Повторяются перегрузка (429), недоступность узлов и таймауты: через некоторое время тот же запрос пройдет.
+Остальные ошибки документа (например несовпадение с mapping) при повторе не исчезнут.
+"""
+from elasticsearch import ApiError, ConnectionError, ConnectionTimeout
+
+RETRYABLE_STATUSES = frozenset({429, 502, 503, 504})
+
+RETRYABLE_ERROR_TYPES = frozenset({
+    'es_rejected_execution_exception',
+    'timeout_exception',
+    'process_cluster_event_timeout_exception',
+    'unavailable_shards_exception',
+})
+
+
+class ElasticsearchUnavailableError(Exception):
+    """Elastic так и не принял документы за отведенное число повторов"""
+
+
+# ошибки, после которых воркер пайплайна перезапускается с backoff и продолжает с сохраненных чекпоинтов
+ELASTICSEARCH_UNAVAILABLE_ERRORS = (ConnectionError, ConnectionTimeout, ElasticsearchUnavailableError)
+
+
+def get_item_result(item: dict) -> dict:
+    """Результат одного документа из ответа _bulk: {'index': {...}} -> {...}"""
+    return next(iter(item.values()))
+
+
+def is_retryable_item(item: dict) -> bool:
+    """Документ не проиндексирован из-за временной проблемы Elastic и его можно отправить повторно"""
+    result = get_item_result(item)
+    if result.get('status') in RETRYABLE_STATUSES:
+        return True
+
+    error = result.get('error')
+    return isinstance(error, dict) and error.get('type') in RETRYABLE_ERROR_TYPES
+
+
+def is_retryable_failure(failure: dict) -> bool:
+    """
+    Ошибка из failures ответа update_by_query временная. Ошибки поиска по шардам (без id документа)
+    тоже считаются временными: шард был недоступен или перегружен
+    """
+    if failure.get('id') is None or failure.get('status') in RETRYABLE_STATUSES:
+        return True
+
+    cause = failure.get('cause')
+    return isinstance(cause, dict) and cause.get('type') in RETRYABLE_ERROR_TYPES
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Запрос целиком не прошел из-за временной проблемы: обрыв соединения, таймаут или перегрузка"""
+    if isinstance(error, (ConnectionError, ConnectionTimeout)):
+        return True
+
+    return isinstance(error, ApiError) and error.meta.status in RETRYABLE_STATUSES
@@ -0,0 +1,90 @@
+"""
+Здесь описаны операции с индексами Elastic, нужные для полной переиндексации:
+создание версионного индекса по образцу текущего, настройки на время загрузки и атомарное переключение alias.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from elasticsearch import Elasticsearch, NotFoundError
+
+from lib.logger import logger
+
+# служебные настройки, которые Elastic выставляет сам и не принимает при создании индекса
+NOT_COPYABLE_SETTINGS = {'creation_date', 'uuid', 'version', 'provided_name', 'routing', 'resize', 'blocks'}
+
+# настройки на время загрузки: без refresh и без реплик индексация идет заметно быстрее
+BULK_LOAD_SETTINGS = {'refresh_interval': '-1', 'number_of_replicas': 0}
+
+
+def versioned_index_name(alias: str) -> str:
+    return f'{alias}_{datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")}'
+
+
+def get_index_definition(client: Elasticsearch, alias: str) -> Optional[dict]:
+    """
+    Настройки и mapping индекса, на который сейчас указывает alias (или индекса с таким именем).
+    Возвращает None, если такого индекса нет
+    """
+    try:
+        indices = client.indices.get(index=alias)
+    except NotFoundError:
+        return None
+
+    if not indices:
+        return None
+
+    # при нескольких индексах под alias образцом берется самый новый
+    definition = indices[max(indices, key=lambda name: int(indices[name]['settings']['index']['creation_date']))]
+    index_settings = {
+        key: value
+        for key, value in definition['settings']['index'].items()
+        if key not in NOT_COPYABLE_SETTINGS
+    }
+    return {'settings': {'index': index_settings}, 'mappings': definition['mappings']}
+
+
+def create_bulk_load_index(client: Elasticsearch, index_name: str, definition: dict) -> Dict[str, str]:
+    """
+    Создает индекс по definition с настройками для загрузки (BULK_LOAD_SETTINGS).
+    Возвращает исходные значения этих настроек, чтобы потом восстановить их через restore_index_settings
+    """
+    index_settings = dict(definition.get('settings', {}).get('index', definition.get('settings', {})))
+    original_settings = {
+        'refresh_interval': index_settings.get('refresh_interval', '1s'),
+        'number_of_replicas': index_settings.get('number_of_replicas', 1),
+    }
+    index_settings.update(BULK_LOAD_SETTINGS)
+
+    client.indices.create(index=index_name, settings={'index': index_settings}, mappings=definition.get('mappings'))
+    logger.info(f'Created index {index_name} for bulk load')
+
+    return original_settings
+
+
+def restore_index_settings(client: Elasticsearch, index_name: str, original_settings: Dict[str, str]):
+    """Возвращает настройки после загрузки и делает refresh, чтобы документы стали видны поиску"""
+    client.indices.put_settings(index=index_name, settings={'index': original_settings})
+    client.indices.refresh(index=index_name)
+
+
+def swap_alias(client: Elasticsearch, alias: str, new_index: str) -> List[str]:
+    """
+    Атомарно переключает alias на new_index одним запросом _aliases.
+    Если alias раньше был обычным индексом с тем же именем, этот индекс удаляется в том же запросе
+    (remove_index), иначе создать alias с таким именем невозможно.
+    Возвращает индексы, с которых alias был снят
+    """
+    actions = []
+    previous_indices = []
+
+    if client.indices.exists_alias(name=alias):
+        previous_indices = list(client.indices.get_alias(name=alias))
+        actions.extend({'remove': {'index': index, 'alias': alias}} for index in previous_indices)
+    elif client.indices.exists(index=alias):
+        actions.append({'remove_index': {'index': alias}})
+
+    actions.append({'add': {'index': new_index, 'alias': alias}})
+    client.indices.update_aliases(actions=actions)
+    logger.info(f'Alias {alias} now points to {new_index}')
+
+    return previous_indices
@@ -0,0 +1,191 @@
+"""
+Здесь описан долгоживущий загрузчик данных в Elastic.
+Клиент с пулом соединений создается один раз на процесс, а не на каждый батч.
+"""
+import json
+import threading
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Union
+
+from elasticsearch import Elasticsearch, helpers
+from settings import settings
+
+from elastic_components.constants import BulkModeEnum
+from elastic_components.errors import get_item_result
+from elastic_components.ndjson import BulkBodyBuilder, SerializedDocument, get_dumps, serialize_documents
+from lib.logger import logger
+
+
+class BulkResult(NamedTuple):
+    """Итог отправки: число проиндексированных документов и ответы Elastic по непроиндексированным"""
+
+    success: int
+    # элементы items ответа _bulk, например {'index': {'_id': ..., 'status': 400, 'error': {...}}}
+    failed: List[dict]
+
+
+def get_action_id(action: Union[dict, SerializedDocument]) -> str:
+    """id документа из результата prepare_actions"""
+    if isinstance(action, SerializedDocument):
+        return action.doc_id
+    return str(action['_id'])
+
+
+def get_action_source(action: Union[dict, SerializedDocument]) -> dict:
+    """Сам документ из результата prepare_actions"""
+    if isinstance(action, SerializedDocument):
+        return json.loads(action.source)
+    return action['_source']
+
+
+class ElasticsearchLoader:
+    """Загрузчик, владеющий клиентом Elastic и отправляющий actions через bulk API"""
+
+    def __init__(
+        self,
+        hosts: Union[str, list],
+        bulk_mode: Union[BulkModeEnum, str] = BulkModeEnum.STREAMING,
+        thread_count: int = 4,
+        chunk_size: int = 500,
+        max_chunk_bytes: int = 10 * 1024 * 1024,
+        max_in_flight: int = 4,
+        connections_per_node: int = 10,
+        request_timeout: float = 30,
+        json_encoder: str = 'auto',
+    ):
+        """
+        :param hosts: адрес или список адресов Elastic
+        :param bulk_mode: способ отправки (см. BulkModeEnum)
+        :param thread_count: число потоков для parallel_bulk
+        :param chunk_size: максимальное число документов в одном bulk запросе
+        :param max_chunk_bytes: максимальный размер одного bulk запроса в байтах
+        :param max_in_flight: сколько подготовленных чанков может ожидать отправки в parallel_bulk
+        :param connections_per_node: размер пула HTTP соединений к каждому узлу
+        :param request_timeout: таймаут одного запроса в секундах
+        :param json_encoder: сериализатор документов в режиме ndjson: auto | orjson | json
+        """
+        self.bulk_mode = BulkModeEnum(bulk_mode)
+        self.thread_count = thread_count
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_in_flight = max_in_flight
+        self.dumps = get_dumps(json_encoder)
+        # у каждого потока загрузки свой буфер для тела запроса
+        self._local = threading.local()
+        self.client = Elasticsearch(
+            hosts,
+            connections_per_node=connections_per_node,
+            request_timeout=request_timeout,
+        )
+
+    def prepare_actions(self, documents: Iterable[dict], index_name: str) -> List[Union[dict, SerializedDocument]]:
+        """
+        Готовит документы к отправке в index_name в форме, которую ожидает текущий bulk_mode:
+        SerializedDocument для ndjson, иначе actions для helpers.bulk
+        """
+        if self.bulk_mode is BulkModeEnum.NDJSON:
+            return serialize_documents(documents, index_name, self.dumps)
+
+        return [
+            {
+                "_index": index_name,
+                "_id": item['id'],
+                "_source": item
+            }
+            for item in documents
+        ]
+
+    def load(self, actions: Iterable[Union[dict, SerializedDocument]], chunk_size: Optional[int] = None) -> BulkResult:
+        """
+        Отправляет actions в Elastic и возвращает результат по документам.
+        Ошибки отдельных документов не пробрасываются, а возвращаются в BulkResult.failed.
+        Если не прошел запрос целиком (нет соединения, таймаут, 429 на весь запрос), пробрасывается исключение клиента
+        :param actions: результат prepare_actions
+        :param chunk_size: число документов в одном bulk запросе, по умолчанию self.chunk_size
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if self.bulk_mode is BulkModeEnum.NDJSON:
+            return self._load_ndjson(list(actions), chunk_size)
+
+        if self.bulk_mode is BulkModeEnum.BULK:
+            success, failed = helpers.bulk(
+                self.client,
+                actions,
+                chunk_size=chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+            )
+            return BulkResult(success, failed)
+
+        if self.bulk_mode is BulkModeEnum.PARALLEL:
+            results = helpers.parallel_bulk(
+                self.client,
+                actions,
+                thread_count=self.thread_count,
+                chunk_size=chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                queue_size=self.max_in_flight,
+                raise_on_error=False,
+            )
+        else:
+            results = helpers.streaming_bulk(
+                self.client,
+                actions,
+                chunk_size=chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+            )
+
+        success = 0
+        failed = []
+        for ok, item in results:
+            if ok:
+                success += 1
+            else:
+                failed.append(item)
+        return BulkResult(success, failed)
+
+    def _load_ndjson(self, documents: Sequence[SerializedDocument], chunk_size: int) -> BulkResult:
+        """Отправляет заранее сериализованные документы запросами _bulk, тело которых собрано в буфере потока"""
+        builder = getattr(self._local, 'builder', None)
+        if builder is None:
+            builder = self._local.builder = BulkBodyBuilder(chunk_size, self.max_chunk_bytes)
+        builder.chunk_size = chunk_size
+
+        success = 0
+        failed = []
+        for body, chunk in builder.iter_bodies(documents):
+            # bytes клиент отправляет без повторной сериализации
+            response = self.client.bulk(operations=body)
+            if not response['errors']:
+                success += len(chunk)
+                continue
+
+            for item in response['items']:
+                if 200 <= get_item_result(item).get('status', 500) < 300:
+                    success += 1
+                else:
+                    failed.append(item)
+
+        return BulkResult(success, failed)
+
+    def close(self):
+        """Закрывает пул соединений клиента"""
+        self.client.close()
+
+
+@lru_cache(maxsize=None)
+def get_elasticsearch_loader() -> ElasticsearchLoader:
+    """Возвращает единственный на процесс загрузчик, настроенный из settings"""
+    logger.info(f'Create elasticsearch loader in {settings.ES_BULK_MODE} mode')
+
+    return ElasticsearchLoader(
+        f'http://{settings.ES_HOST}:{settings.ES_PORT}',
+        bulk_mode=settings.ES_BULK_MODE,
+        thread_count=settings.ES_BULK_THREAD_COUNT,
+        chunk_size=settings.ES_BULK_CHUNK_SIZE,
+        max_chunk_bytes=settings.ES_BULK_MAX_CHUNK_BYTES,
+        max_in_flight=settings.ES_BULK_MAX_IN_FLIGHT,
+        connections_per_node=settings.ES_CONNECTIONS_PER_NODE,
+        json_encoder=settings.ES_JSON_ENCODER,
+    )
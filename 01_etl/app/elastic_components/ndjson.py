@@ -0,0 +1,107 @@
+"""
+Здесь описана подготовка тела _bulk запроса (NDJSON) без промежуточных action dict'ов.
+
+Каждый документ сериализуется один раз в SerializedDocument: строка действия и строка _source в байтах.
+Эти же байты используются для отпечатков документов и оценки размера запроса,
+а в Elastic уходят склеенными в переиспользуемом буфере, минуя сериализатор клиента.
+
+Если установлен orjson, он используется для сериализации (UUID и datetime он понимает сам),
+иначе стандартный json.
+"""
+import json
+import uuid
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson необязательная зависимость
+    orjson = None
+
+
+class SerializedDocument(NamedTuple):
+    """Документ, готовый к отправке в _bulk: обе строки NDJSON уже сериализованы и заканчиваются переводом строки"""
+
+    doc_id: str
+    action: bytes
+    source: bytes
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'Unable to serialize {value!r}')
+
+
+def _stdlib_dumps(value) -> bytes:
+    return json.dumps(
+        value, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=_json_default,
+    ).encode()
+
+
+def _orjson_dumps(value) -> bytes:
+    return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+
+
+def get_dumps(encoder: str = 'auto'):
+    """
+    Функция сериализации в канонический json (ключи отсортированы, без пробелов)
+    :param encoder: auto | orjson | json, auto - orjson если он установлен
+    """
+    if encoder == 'json' or (encoder == 'auto' and orjson is None):
+        return _stdlib_dumps
+    if orjson is None:
+        raise ImportError('orjson is not installed, use ES_JSON_ENCODER=json or auto')
+    return _orjson_dumps
+
+
+def serialize_documents(documents: Iterable[dict], index_name: str, dumps=_stdlib_dumps) -> List[SerializedDocument]:
+    """Сериализует документы (у каждого есть поле id) для индексации в index_name"""
+    action_prefix = b'{"index":{"_index":' + dumps(index_name) + b',"_id":'
+    return [
+        SerializedDocument(
+            doc_id=str(document['id']),
+            action=action_prefix + dumps(str(document['id'])) + b'}}\n',
+            source=dumps(document) + b'\n',
+        )
+        for document in documents
+    ]
+
+
+class BulkBodyBuilder:
+    """
+    Собирает тела _bulk запросов из SerializedDocument в переиспользуемом буфере.
+    Объект не потокобезопасен: у каждого потока загрузки должен быть свой
+    """
+
+    def __init__(self, chunk_size: int, max_chunk_bytes: int):
+        """
+        :param chunk_size: максимальное число документов в одном запросе
+        :param max_chunk_bytes: максимальный размер одного запроса в байтах
+        """
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self._buffer = bytearray()
+
+    def iter_bodies(self, documents: Sequence[SerializedDocument]) -> Iterator[Tuple[bytes, Sequence[SerializedDocument]]]:
+        """Отдает пары (тело запроса, документы в нем)"""
+        start = 0
+        buffer = self._buffer
+
+        for position, document in enumerate(documents):
+            size = len(document.action) + len(document.source)
+            if position > start and (
+                position - start >= self.chunk_size or len(buffer) + size > self.max_chunk_bytes
+            ):
+                yield bytes(buffer), documents[start:position]
+                buffer.clear()
+                start = position
+
+            buffer += document.action
+            buffer += document.source
+
+        if buffer:
+            yield bytes(buffer), documents[start:]
+            buffer.clear()
@@ -0,0 +1,140 @@
+"""
+Здесь описан адаптивный подбор размеров батчей.
+
+Для каждой пары (пайплайн, таблица) и каждой стадии размер батча подбирается по схеме AIMD:
+если стадия укладывается в целевое время с запасом, батч растет в grow_factor раз,
+если не укладывается, превышает лимит по байтам или Elastic отвечает 429, батч уменьшается в shrink_factor раз.
+Размер всегда остается в границах [min_size, max_size].
+"""
+import json
+import threading
+from functools import lru_cache
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+from elasticsearch import ApiError
+from settings import settings
+
+from elastic_components.ndjson import SerializedDocument
+from etl_components.constants import BatchStageEnum
+
+# Ключ, под которым учитываются батчи, не относящиеся к одной таблице (например в режиме coalesced)
+ALL_TABLES = '*'
+
+
+def is_rejected_by_elasticsearch(error: Exception) -> bool:
+    """Elastic отклонил запрос из-за перегрузки (429 / es_rejected_execution_exception)"""
+    return isinstance(error, ApiError) and error.meta.status == 429
+
+
+def estimate_payload_bytes(actions: Sequence[Union[dict, SerializedDocument]], sample_size: int = 10) -> int:
+    """Оценивает размер bulk запроса по нескольким первым документам, не сериализуя весь батч"""
+    if not actions:
+        return 0
+
+    if isinstance(actions[0], SerializedDocument):
+        # документы уже сериализованы, размер известен точно
+        return sum(len(action.action) + len(action.source) for action in actions)
+
+    sample = actions[:sample_size]
+    sample_bytes = sum(len(json.dumps(action.get('_source', action), default=str)) for action in sample)
+    return sample_bytes * len(actions) // len(sample)
+
+
+class AdaptiveBatchController:
+    """Хранит текущие размеры батчей и корректирует их по результатам измерений"""
+
+    def __init__(
+        self,
+        default_size: int,
+        min_size: int,
+        max_size: int,
+        target_latency: Dict[str, float],
+        max_payload_bytes: int,
+        grow_factor: float = 1.25,
+        shrink_factor: float = 0.5,
+        enabled: bool = True,
+    ):
+        """
+        :param default_size: начальный размер батча (и постоянный, если enabled=False)
+        :param min_size: минимальный размер батча
+        :param max_size: максимальный размер батча
+        :param target_latency: целевое время обработки одного батча по стадиям (ключи - BatchStageEnum.value)
+        :param max_payload_bytes: максимальный размер bulk запроса в байтах
+        :param grow_factor: во сколько раз увеличивать батч
+        :param shrink_factor: во сколько раз уменьшать батч
+        :param enabled: если False, всегда возвращается default_size
+        """
+        self.default_size = default_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_payload_bytes = max_payload_bytes
+        self.grow_factor = grow_factor
+        self.shrink_factor = shrink_factor
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._sizes: Dict[Tuple[str, str, BatchStageEnum], int] = {}
+
+    def size(self, pipeline_name: str, table_name: str, stage: BatchStageEnum) -> int:
+        """Текущий размер батча для стадии"""
+        if not self.enabled:
+            return self.default_size
+
+        with self._lock:
+            return self._sizes.get((pipeline_name, table_name, stage), self.default_size)
+
+    def observe(
+        self,
+        pipeline_name: str,
+        table_name: str,
+        stage: BatchStageEnum,
+        seconds: float,
+        items: int,
+        payload_bytes: Optional[int] = None,
+    ):
+        """
+        Учитывает время обработки одного батча стадии.
+        Расти можно только по полным батчам: неполный батч ничего не говорит о запасе по времени
+        """
+        if not self.enabled:
+            return
+
+        key = (pipeline_name, table_name, stage)
+        target = self.target_latency.get(stage.value)
+
+        with self._lock:
+            current = self._sizes.get(key, self.default_size)
+            too_slow = target is not None and seconds > target
+            too_big = payload_bytes is not None and payload_bytes > self.max_payload_bytes
+
+            if too_slow or too_big:
+                self._sizes[key] = self._clamp(current * self.shrink_factor)
+            elif items >= current and (target is None or seconds < target / 2):
+                self._sizes[key] = self._clamp(current * self.grow_factor)
+
+    def reject(self, pipeline_name: str, table_name: str):
+        """Elastic отклонил запрос: уменьшаем и bulk запросы, и число документов, которые мержатся за раз"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            for stage in (BatchStageEnum.LOADER, BatchStageEnum.ENRICHER):
+                key = (pipeline_name, table_name, stage)
+                self._sizes[key] = self._clamp(self._sizes.get(key, self.default_size) * self.shrink_factor)
+
+    def _clamp(self, size: float) -> int:
+        return max(self.min_size, min(self.max_size, int(size)))
+
+
+@lru_cache(maxsize=None)
+def get_batch_size_controller() -> AdaptiveBatchController:
+    """Возвращает единственный на процесс контроллер размеров батчей, настроенный из settings"""
+    return AdaptiveBatchController(
+        default_size=settings.BATCH_SIZE,
+        min_size=settings.BATCH_SIZE_MIN,
+        max_size=settings.BATCH_SIZE_MAX,
+        target_latency=settings.BATCH_TARGET_LATENCY,
+        max_payload_bytes=settings.ES_BULK_MAX_CHUNK_BYTES,
+        enabled=settings.ADAPTIVE_BATCHING,
+    )
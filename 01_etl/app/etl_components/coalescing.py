@@ -0,0 +1,160 @@
+"""
+Здесь описан режим выполнения пайплайна со склейкой изменений (coalesced).
+
+Сначала со всех таблиц пайплайна собираются идентификаторы документов, которые надо обновить,
+в одно множество без дубликатов. Затем каждый документ мержится и отправляется в Elastic ровно один раз за цикл,
+сколько бы таблиц и страниц его ни затронули. Изменения справочников, которые применяются частичным обновлением,
+копятся отдельно и применяются после загрузки документов. Чекпоинты всех таблиц применяются только после загрузки.
+"""
+import os
+import sqlite3
+import tempfile
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Set, Tuple
+
+from etl_components.batching import ALL_TABLES
+from etl_components.constants import BatchStageEnum, ChangeSourceEnum
+from etl_components.types import PipeLineType
+from etl_components.use_cases import current_batch_size, iter_pipeline_batches, load_batch
+from lib.logger import logger
+from postgres_components.pool import get_connection_pool
+from postgres_components.table_spec import AbstractPostgresTableSpec
+from storage.state import State
+from storage.use_cases import update_storage_data_in_pipeline_table
+
+
+class TargetIdSet:
+    """
+    Множество идентификаторов без дубликатов.
+    Пока идентификаторов меньше max_in_memory они живут в set, дальше переносятся во временную SQLite базу на диске
+    """
+
+    def __init__(self, max_in_memory: int):
+        self.max_in_memory = max_in_memory
+        self._ids = set()
+        self._spill_path = None
+        self._spill_conn = None
+        self._spilled_count = 0
+
+    def update(self, ids: Iterable[str]):
+        self._ids.update(ids)
+
+        if len(self._ids) > self.max_in_memory:
+            self._spill()
+
+    def __len__(self):
+        if self._spill_conn is None:
+            return len(self._ids)
+
+        self._spill()
+        return self._spilled_count
+
+    def iter_batches(self, batch_size: int) -> Iterator[Tuple[str]]:
+        """Отдает идентификаторы батчами по возрастанию"""
+        if self._spill_conn is None:
+            ids = sorted(self._ids)
+            for i in range(0, len(ids), batch_size):
+                yield tuple(ids[i:i + batch_size])
+            return
+
+        self._spill()
+        cur = self._spill_conn.execute('SELECT id FROM target_ids ORDER BY id')
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            yield tuple(i[0] for i in rows)
+
+    def close(self):
+        self._ids = set()
+        if self._spill_conn is not None:
+            self._spill_conn.close()
+            os.unlink(self._spill_path)
+            self._spill_conn = None
+
+    def _spill(self):
+        """Переносит накопленные в памяти идентификаторы на диск"""
+        if self._spill_conn is None:
+            fd, self._spill_path = tempfile.mkstemp(prefix='etl-target-ids-', suffix='.sqlite3')
+            os.close(fd)
+            self._spill_conn = sqlite3.connect(self._spill_path)
+            self._spill_conn.execute('PRAGMA journal_mode=OFF')
+            self._spill_conn.execute('PRAGMA synchronous=OFF')
+            self._spill_conn.execute('CREATE TABLE target_ids (id TEXT PRIMARY KEY) WITHOUT ROWID')
+            logger.info(f'Target ids exceeded {self.max_in_memory}, spill them to {self._spill_path}')
+
+        with self._spill_conn:
+            cur = self._spill_conn.executemany('INSERT OR IGNORE INTO target_ids VALUES (?)', ((i,) for i in self._ids))
+            self._spilled_count += cur.rowcount
+        self._ids = set()
+
+
+def process_pipeline_coalesced(
+    pipeline: PipeLineType,
+    dsl: dict,
+    state: State,
+    batch_size: int,
+    max_ids_in_memory: int,
+    max_ids_per_cycle: int = 0,
+    change_source: ChangeSourceEnum = ChangeSourceEnum.SCAN,
+    table_specs: Optional[Sequence[AbstractPostgresTableSpec]] = None,
+) -> Dict[str, int]:
+    """
+    Аналог process_pipeline, в котором каждый затронутый документ загружается один раз за цикл.
+    max_ids_per_cycle ограничивает размер цикла (0 - без ограничения): сбор останавливается
+    после батча, на котором множество достигло лимита, остальное подхватит следующий цикл.
+    Возвращает число собранных батчей по каждой таблице
+    """
+    pipeline_name = pipeline.PIPELINE_NAME
+    table_specs = table_specs or pipeline.TARGET_TABLE_SPECS
+    target_ids = TargetIdSet(max_ids_in_memory)
+    dimension_ids: Dict[str, Set[str]] = {}
+    checkpoints = {}
+    collected_batches = {table_spec.table_name: 0 for table_spec in table_specs}
+
+    # с DB_SNAPSHOT_BATCHES весь цикл, от сбора идентификаторов до мержа, читает один снимок БД
+    with get_connection_pool(dsl).connection() as pg_conn:
+        try:
+            for table_spec in table_specs:
+                batches = iter_pipeline_batches(
+                    pipeline,
+                    pg_conn,
+                    table_spec,
+                    table_state=state[pipeline_name][table_spec.table_name],
+                    batch_size=batch_size,
+                    change_source=change_source,
+                )
+                for batch in batches:
+                    if batch.partial:
+                        dimension_ids.setdefault(batch.table_name, set()).update(batch.target_ids)
+                    else:
+                        target_ids.update(batch.target_ids)
+                    checkpoints.setdefault(batch.table_name, {}).update(batch.checkpoint)
+                    collected_batches[batch.table_name] += 1
+
+                    if max_ids_per_cycle and len(target_ids) >= max_ids_per_cycle:
+                        break
+
+                if max_ids_per_cycle and len(target_ids) >= max_ids_per_cycle:
+                    break
+
+            logger.info(f'Coalesced {sum(collected_batches.values())} batches of {pipeline_name} into {len(target_ids)} documents')
+
+            for ids in target_ids.iter_batches(current_batch_size(pipeline, ALL_TABLES, BatchStageEnum.ENRICHER, batch_size)):
+                load_batch(pipeline, pg_conn, ALL_TABLES, ids)
+
+            for table_name, row_ids in dimension_ids.items():
+                row_ids = sorted(row_ids)
+                for i in range(0, len(row_ids), batch_size):
+                    load_batch(pipeline, pg_conn, table_name, tuple(row_ids[i:i + batch_size]), partial=True)
+        finally:
+            target_ids.close()
+
+    for table_name, checkpoint in checkpoints.items():
+        update_storage_data_in_pipeline_table(
+            state,
+            pipline_name=pipeline_name,
+            table_name=table_name,
+            data=checkpoint
+        )
+
+    return collected_batches
@@ -0,0 +1,46 @@
+from enum import Enum
+
+
+class ExecutionModeEnum(Enum):
+    """Режимы выполнения пайплайна"""
+
+    SEQUENTIAL = 'sequential'  # батч целиком проходит все стадии, потом начинается следующий
+    STAGED = 'staged'  # стадии работают в своих потоках и связаны ограниченными очередями
+    COALESCED = 'coalesced'  # изменения всех таблиц склеиваются, каждый документ загружается один раз за цикл
+
+
+class MergerStrategyEnum(Enum):
+    """Где собираются документы для Elastic"""
+
+    PYTHON = 'python'  # плоский join, документы собираются в python
+    SQL = 'sql'  # документы целиком собираются в postgres через json_agg, одна строка на документ
+    STREAMING = 'streaming'  # плоский join через серверный курсор, документы собираются и отдаются по одному
+
+
+class EnricherStrategyEnum(Enum):
+    """Как enricher находит документы, затронутые страницей producer'а"""
+
+    KEYSET = 'keyset'  # каждая страница enricher'а повторяет join с идентификаторами страницы producer'а
+    TEMP_TABLE = 'temp_table'  # один join через временную таблицу, дальше страницы читаются из результата
+
+
+class DimensionUpdateEnum(Enum):
+    """Как пайплайн обрабатывает изменения строк справочников, на которые ссылаются документы"""
+
+    FULL = 'full'  # связанные документы находятся enricher'ом и пересобираются целиком
+    PARTIAL = 'partial'  # один update_by_query меняет только имена во вложенных объектах, см. partial_updates
+
+
+class ChangeSourceEnum(Enum):
+    """Откуда producer берет изменившиеся записи"""
+
+    SCAN = 'scan'  # сканирование таблицы по (modified, id)
+    CHANGELOG = 'changelog'  # журнал etl_changelog, который пишут триггеры (см. migrations)
+
+
+class BatchStageEnum(Enum):
+    """Стадии, размер батча которых подбирается адаптивно"""
+
+    PRODUCER = 'producer'  # число изменившихся строк на страницу producer'а
+    ENRICHER = 'enricher'  # число документов, которые мержатся за раз
+    LOADER = 'loader'  # число документов в одном bulk запросе
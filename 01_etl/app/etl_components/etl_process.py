@@ -2,43 +2,71 @@
 Здесь описан главный класс EtlProcess, реализующий весь ETL процесс.
 """
 from abc import abstractmethod
-from collections import defaultdict
 from datetime import datetime
-from typing import Iterable, List, Tuple, Union
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
-from elasticsearch import Elasticsearch, helpers
-from psycopg2.extensions import connection
-from pydantic import ValidationError
+from psycopg2.extensions import connection, cursor
 from settings import settings
 
-from etl_components.models import FilmWorkMergedData, GenreMergedData, PersonMergedData
-from etl_components.utils import (merged_fw_data_template_factory, merged_genre_data_template_factory,
-                                  merged_person_data_template_factory)
+from elastic_components.loader import BulkResult, get_elasticsearch_loader
+from elastic_components.ndjson import SerializedDocument
+from etl_components.constants import DimensionUpdateEnum, EnricherStrategyEnum, MergerStrategyEnum
+from etl_components.mergers import (iter_film_work_documents, iter_genre_documents, iter_person_documents,
+                                    merge_film_work_rows, merge_genre_rows, merge_person_rows)
+from etl_components.partial_updates import GENRE_PATCH, PERSON_PATCH, DimensionPatch
 from lib.logger import logger
-from postgres_components.constants import PersonRoleEnum
-from postgres_components.table_spec import (AbstractPostgresTableSpec, FilmWorkSpec, GenreSpec, PersonFilmWorkSpec,
-                                            PersonSpec)
+from postgres_components.statements import execute
+from postgres_components.table_spec import (AbstractPostgresTableSpec, FilmWorkSpec, GenreSpec, KeysetCursor,
+                                            PersonFilmWorkSpec, PersonSpec)
+from postgres_components.temp_ids import get_affected_ids, has_temp_id_tables, resolve_affected_ids
 
 
 class EtlProcess:
     """Общий класс реализующий ETL процесс"""
 
+    # таблицы справочников, изменения которых можно применить частичным обновлением документов
+    DIMENSION_PATCHES: Dict[str, DimensionPatch] = {}
+    # плоский join для сборки документов в python: строки документов с id из массива %(ids)s
+    FLAT_MERGER_QUERY: str
+    # колонка FLAT_MERGER_QUERY с id документа, по ней упорядочивается выборка потокового merger'а
+    FLAT_MERGER_ID_COLUMN: str
+
+    @classmethod
+    def get_dimension_patch(cls, table_name: str) -> Optional[DimensionPatch]:
+        """
+        Частичное обновление для изменений таблицы или None, если документы нужно пересобрать целиком.
+        Стратегия выбирается для каждого пайплайна в settings.DIMENSION_UPDATE_STRATEGY
+        """
+        strategy = DimensionUpdateEnum(
+            settings.DIMENSION_UPDATE_STRATEGY.get(cls.PIPELINE_NAME, DimensionUpdateEnum.FULL.value)
+        )
+        if strategy is DimensionUpdateEnum.FULL:
+            return None
+
+        return cls.DIMENSION_PATCHES.get(table_name)
+
     @staticmethod
     def postgres_producer(
         pg_conn: connection,
         table_spec: AbstractPostgresTableSpec,
         last_modified_dt: Union[datetime, str],  # либо дата, либо строка с датой в формате iso
+        last_row_id: str,
         batch_limit: int,
-        batch_offset: int,
-    ):
-        """Возвращает идентификаторы кинопроизведений связанных с изменившимися сущностями"""
-        logger.info(f'RUN postgres_producer for {table_spec.table_name}')
+        until: Optional[KeysetCursor] = None,
+    ) -> Tuple[Tuple[str], Optional[KeysetCursor]]:
+        """
+        Возвращает идентификаторы изменившихся записей, идущих после курсора (last_modified_dt, last_row_id),
+        и курсор для запроса следующей страницы. С until перечитывается уже начатая страница, см. get_modified_row_ids
+        """
+        logger.debug(f'RUN postgres_producer for {table_spec.table_name}')
 
         return table_spec.get_modified_row_ids(
             pg_conn,
             last_modified_dt=last_modified_dt,
+            last_row_id=last_row_id,
             limit=batch_limit,
-            offset=batch_offset
+            until=until,
         )
 
     @staticmethod
@@ -48,42 +76,159 @@ class EtlProcess:
         table_spec: AbstractPostgresTableSpec,
         modified_row_ids: Tuple[str],
         batch_limit: int,
-        batch_offset: int,
+        last_id: str,
     ):
         """
-        Обогащает записи данными из many-to-many таблиц при необходимости
+        Обогащает записи данными из many-to-many таблиц при необходимости.
+        Возвращает не больше batch_limit идентификаторов, больших last_id, упорядоченных по возрастанию.
         Для каждого ETL процесса этот метод уникальный
         """
 
+    @classmethod
+    def postgres_resolve_affected_ids(
+        cls,
+        pg_conn: connection,
+        table_spec: AbstractPostgresTableSpec,
+        modified_row_ids: Tuple[str],
+    ) -> bool:
+        """
+        Стратегия enricher'а temp_table (settings.ENRICHER_STRATEGY): один раз находит все документы,
+        затронутые страницей producer'а, после чего их отдает postgres_resolved_enricher.
+        Возвращает False, если стратегия не включена, соединение без временных таблиц или таблице не нужно обогащение:
+        тогда страница обогащается через postgres_enricher
+        """
+        strategy = EnricherStrategyEnum(
+            settings.ENRICHER_STRATEGY.get(cls.PIPELINE_NAME, EnricherStrategyEnum.KEYSET.value)
+        )
+        if strategy is EnricherStrategyEnum.KEYSET or not has_temp_id_tables(pg_conn):
+            return False
+
+        affected_ids_sql = cls.get_affected_ids_sql(table_spec)
+        if affected_ids_sql is None:
+            return False
+
+        affected = resolve_affected_ids(pg_conn, modified_row_ids, affected_ids_sql)
+        logger.debug(f'RUN postgres_resolve_affected_ids for {table_spec.table_name}: {affected} documents affected')
+        return True
+
+    @staticmethod
+    def postgres_resolved_enricher(pg_conn: connection, batch_limit: int, last_id: str) -> Tuple[str]:
+        """Аналог postgres_enricher для страницы, обработанной postgres_resolve_affected_ids"""
+        return get_affected_ids(pg_conn, last_id=last_id, limit=batch_limit)
+
     @staticmethod
     @abstractmethod
-    def postgres_merger(pg_conn: connection, film_work_ids: Tuple[str]):
+    def get_affected_ids_sql(table_spec: AbstractPostgresTableSpec) -> Optional[str]:
         """
-        Собирает и мержит данные для последующей трансформации и отправки в Elastic
+        Запрос затронутых документов через временную таблицу (см. postgres_components.temp_ids)
+        или None, если таблице не нужно обогащение.
         Для каждого ETL процесса этот метод уникальный
         """
 
+    @classmethod
+    def postgres_merger(cls, pg_conn: connection, target_ids: Tuple[str]) -> Iterable[dict]:
+        """
+        Собирает и мержит данные для последующей трансформации и отправки в Elastic.
+        Стратегия сборки выбирается для каждого пайплайна в settings.MERGER_STRATEGY
+        """
+        strategy = MergerStrategyEnum(settings.MERGER_STRATEGY.get(cls.PIPELINE_NAME, MergerStrategyEnum.PYTHON.value))
+        logger.debug(f'RUN postgres_merger ({strategy.value}): {len(target_ids)} will be merged')
+
+        if strategy is MergerStrategyEnum.SQL:
+            return cls.postgres_sql_merger(pg_conn, target_ids)
+        if strategy is MergerStrategyEnum.STREAMING:
+            return cls.postgres_streaming_merger(pg_conn, target_ids)
+
+        return cls.postgres_python_merger(pg_conn, target_ids)
+
+    @classmethod
+    def postgres_python_merger(cls, pg_conn: connection, target_ids: Tuple[str]) -> List[dict]:
+        """
+        Выбирает все плоские строки FLAT_MERGER_QUERY и собирает из них документы в python.
+        С MERGER_COMPACT_ROWS строки читаются кортежами и проверяются без pydantic (см. etl_components.rows)
+        """
+        if settings.MERGER_COMPACT_ROWS:
+            with pg_conn.cursor(cursor_factory=cursor) as cur:
+                execute(cur, cls.FLAT_MERGER_QUERY, {'ids': list(target_ids)})
+                return cls.merge_rows(cur.fetchall(), [column.name for column in cur.description])
+
+        with pg_conn.cursor() as cur:
+            execute(cur, cls.FLAT_MERGER_QUERY, {'ids': list(target_ids)})
+            raw_data = tuple(dict(i) for i in cur.fetchall())
+
+        return cls.merge_rows(raw_data)
+
+    @classmethod
+    def postgres_streaming_merger(cls, pg_conn: connection, target_ids: Tuple[str]) -> Iterator[dict]:
+        """
+        Читает FLAT_MERGER_QUERY, упорядоченный по id документа, серверным курсором порциями по MERGER_STREAM_ITERSIZE
+        строк и отдает документы по одному. В merger'е держится порция строк и один собираемый документ,
+        а не все строки батча (число документов, умноженное на число персон и жанров у каждого).
+        Загрузка забирает документы порциями (см. use_cases.iter_merged_chunks), так что и дальше в памяти
+        одна порция документов, а не весь батч.
+        Серверному курсору нужна открытая транзакция, поэтому генератор нужно дочитать до commit соединения
+        """
+        compact_rows = settings.MERGER_COMPACT_ROWS
+        # у серверного курсора нет PREPARE, запрос выполняется напрямую
+        with pg_conn.cursor(name=f'{cls.PIPELINE_NAME}_merger', cursor_factory=cursor if compact_rows else None) as cur:
+            cur.itersize = settings.MERGER_STREAM_ITERSIZE
+            cur.execute(
+                f'{cls.FLAT_MERGER_QUERY} ORDER BY {cls.FLAT_MERGER_ID_COLUMN}',
+                {'ids': list(target_ids)},
+            )
+            if not compact_rows:
+                yield from cls.iter_documents(cur)
+                return
+
+            # описание колонок серверного курсора появляется после первого чтения
+            rows = iter(cur)
+            first_row = next(rows, None)
+            if first_row is not None:
+                yield from cls.iter_documents(chain((first_row,), rows), [column.name for column in cur.description])
+
     @staticmethod
-    def transform(merged_data: Iterable[dict], index_name: str) -> List[dict]:
-        """Преобразует входящие из postgres данные в вид подходящий для запроса в Elastic"""
-        logger.info(f'RUN transform: {len(merged_data)} will be transformed')
-        actions = [
-            {
-                "_index": index_name,
-                "_id": item['id'],
-                "_source": item
-            }
-            for item in merged_data
-        ]
+    @abstractmethod
+    def merge_rows(rows: Iterable, columns: Optional[Sequence[str]] = None) -> List[dict]:
+        """
+        Собирает документы из строк FLAT_MERGER_QUERY в любом порядке.
+        Строки - словари или, если передан columns, кортежи с этими колонками.
+        Для каждого ETL процесса этот метод уникальный
+        """
+
+    @staticmethod
+    @abstractmethod
+    def iter_documents(rows: Iterable, columns: Optional[Sequence[str]] = None) -> Iterator[dict]:
+        """
+        Собирает документы из строк FLAT_MERGER_QUERY, упорядоченных по FLAT_MERGER_ID_COLUMN, и отдает их по одному.
+        Строки - словари или, если передан columns, кортежи с этими колонками.
+        Для каждого ETL процесса этот метод уникальный
+        """
+
+    @staticmethod
+    @abstractmethod
+    def postgres_sql_merger(pg_conn: connection, target_ids: Tuple[str]) -> List[dict]:
+        """
+        Собирает готовые документы на стороне postgres (по одной строке на документ).
+        Форма документов совпадает с postgres_python_merger.
+        Для каждого ETL процесса этот метод уникальный
+        """
+
+    @staticmethod
+    def transform(merged_data: Iterable[dict], index_name: str) -> List[Union[dict, SerializedDocument]]:
+        """Преобразует входящие из postgres данные (список или поток документов) в вид подходящий для запроса в Elastic"""
+        actions = get_elasticsearch_loader().prepare_actions(merged_data, index_name)
+        logger.debug(f'RUN transform: {len(actions)} transformed')
         return actions
 
     @staticmethod
-    def elasticsearch_loader(actions: List[dict]):
-        """Отправляет запрос в Elastic"""
-        logger.info(f'RUN elasticsearch_loader: {len(actions)} will be send')
+    def elasticsearch_loader(
+        actions: List[Union[dict, SerializedDocument]],
+        chunk_size: Optional[int] = None,
+    ) -> BulkResult:
+        """Отправляет запрос в Elastic через общий для процесса загрузчик"""
+        logger.debug(f'RUN elasticsearch_loader: {len(actions)} will be send')
 
-        es_client = Elasticsearch(f'http://{settings.ES_HOST}:{settings.ES_PORT}')
-        helpers.bulk(es_client, actions)
+        return get_elasticsearch_loader().load(actions, chunk_size=chunk_size)
 
 
 class EtlFilmWorkProcess(EtlProcess):
@@ -92,6 +237,32 @@ class EtlFilmWorkProcess(EtlProcess):
     PIPELINE_NAME = 'film_work_pipeline'
     INDEX_NAME = 'movies'
     TARGET_TABLE_SPECS = (FilmWorkSpec, PersonFilmWorkSpec, PersonSpec, GenreSpec)
+    # таблица, по идентификаторам которой строятся документы индекса (см. etl_components.reindex)
+    ROOT_TABLE_SPEC = FilmWorkSpec
+    DIMENSION_PATCHES = {
+        GenreSpec.table_name: GENRE_PATCH,
+        PersonSpec.table_name: PERSON_PATCH,
+    }
+    FLAT_MERGER_QUERY = """
+        SELECT
+            fw.id as fw_id,
+            fw.title,
+            fw.description,
+            fw.rating,
+            fw.type,
+            pfw.role,
+            p.id,
+            p.full_name,
+            g.id as genre_id,
+            g.name as genre_name
+        FROM film_work fw
+        LEFT JOIN person_film_work pfw ON pfw.film_work_id = fw.id
+        LEFT JOIN person p ON p.id = pfw.person_id
+        LEFT JOIN genre_film_work gfw ON gfw.film_work_id = fw.id
+        LEFT JOIN genre g ON g.id = gfw.genre_id
+        WHERE fw.id = ANY(%(ids)s::uuid[])
+    """
+    FLAT_MERGER_ID_COLUMN = 'fw.id'
 
     @staticmethod
     def postgres_enricher(
@@ -99,94 +270,88 @@ class EtlFilmWorkProcess(EtlProcess):
         table_spec: AbstractPostgresTableSpec,
         modified_row_ids: Tuple[str],
         batch_limit: int,
-        batch_offset: int,
+        last_id: str,
     ):
         """Возвращает film_work.id для измененных записей из таблиц genre и person"""
-        logger.info(f'RUN postgres_enricher for {table_spec.table_name}: {len(modified_row_ids)} will be enriched')
+        logger.debug(f'RUN postgres_enricher for {table_spec.table_name}: {len(modified_row_ids)} will be enriched')
 
         return table_spec.get_film_work_ids_by_modified_row_ids(
             pg_conn,
             modified_row_ids=modified_row_ids,
+            last_id=last_id,
             limit=batch_limit,
-            offset=batch_offset
         )
 
     @staticmethod
-    def postgres_merger(pg_conn: connection, film_work_ids: Tuple[str]):
-        """Собирает и мержит данные для последующей трансформации и отправки в Elastic"""
-        logger.info(f'RUN postgres_merger: {len(film_work_ids)} will be merged')
+    def get_affected_ids_sql(table_spec: AbstractPostgresTableSpec) -> Optional[str]:
+        return table_spec.get_affected_film_work_ids_sql()
+
+    @staticmethod
+    def merge_rows(rows: Iterable, columns: Optional[Sequence[str]] = None) -> List[dict]:
+        return merge_film_work_rows(rows, columns)
+
+    @staticmethod
+    def iter_documents(rows: Iterable, columns: Optional[Sequence[str]] = None) -> Iterator[dict]:
+        return iter_film_work_documents(rows, columns)
+
+    @staticmethod
+    def postgres_sql_merger(pg_conn: connection, film_work_ids: Tuple[str]) -> List[dict]:
+        """
+        Собирает документы фильмов в postgres: персоны и жанры агрегируются в lateral подзапросах,
+        поэтому вместо произведения персон на жанры возвращается одна строка на фильм.
+        Жанры и персоны упорядочены по id, как в mergers.sort_film_work_document
+        """
         with pg_conn.cursor() as cur:
-            query = cur.mogrify(
+            execute(
+                cur,
                 """
-                SELECT
-                    fw.id as fw_id,
-                    fw.title,
-                    fw.description,
-                    fw.rating,
-                    fw.type,
-                    pfw.role,
-                    p.id,
-                    p.full_name,
-                    g.id as genre_id,
-                    g.name as genre_name
+                SELECT json_build_object(
+                    'id', fw.id,
+                    'imdb_rating', fw.rating,
+                    'genres', COALESCE(genres.items, '[]'::json),
+                    'title', fw.title,
+                    'description', fw.description,
+                    'director', COALESCE(persons.director, '{}'),
+                    'actors_names', COALESCE(persons.actors_names, '{}'),
+                    'writers_names', COALESCE(persons.writers_names, '{}'),
+                    'actors', COALESCE(persons.actors, '[]'::json),
+                    'writers', COALESCE(persons.writers, '[]'::json),
+                    'directors', COALESCE(persons.directors, '[]'::json)
+                )
                 FROM film_work fw
-                LEFT JOIN person_film_work pfw ON pfw.film_work_id = fw.id
-                LEFT JOIN person p ON p.id = pfw.person_id
-                LEFT JOIN genre_film_work gfw ON gfw.film_work_id = fw.id
-                LEFT JOIN genre g ON g.id = gfw.genre_id
-                WHERE fw.id IN %(film_work_ids)s;
+                LEFT JOIN LATERAL (
+                    SELECT json_agg(json_build_object('id', g.id, 'name', g.name) ORDER BY g.id) AS items
+                    FROM (
+                        SELECT DISTINCT g.id, g.name
+                        FROM genre_film_work gfw
+                        JOIN genre g ON g.id = gfw.genre_id
+                        WHERE gfw.film_work_id = fw.id
+                    ) g
+                ) genres ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT
+                        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.id)
+                            FILTER (WHERE p.role = 'actor') AS actors,
+                        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.id)
+                            FILTER (WHERE p.role = 'writer') AS writers,
+                        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.id)
+                            FILTER (WHERE p.role = 'director') AS directors,
+                        array_agg(p.full_name ORDER BY p.id) FILTER (WHERE p.role = 'actor') AS actors_names,
+                        array_agg(p.full_name ORDER BY p.id) FILTER (WHERE p.role = 'writer') AS writers_names,
+                        array_agg(p.full_name ORDER BY p.id) FILTER (WHERE p.role = 'director') AS director
+                    FROM (
+                        SELECT DISTINCT pfw.role, p.id, p.full_name
+                        FROM person_film_work pfw
+                        JOIN person p ON p.id = pfw.person_id
+                        WHERE pfw.film_work_id = fw.id
+                    ) p
+                ) persons ON TRUE
+                WHERE fw.id = ANY(%(film_work_ids)s::uuid[]) AND fw.title IS NOT NULL;
                 """,
-                {'film_work_ids': film_work_ids, }
+                {'film_work_ids': list(film_work_ids)}
             )
-            cur.execute(query)
 
-            raw_data = tuple(dict(i) for i in cur.fetchall())
-            merged_data = defaultdict(merged_fw_data_template_factory)
-
-            for item in raw_data:
-                fw_id = item['fw_id']
-                try:
-                    valid_item = FilmWorkMergedData(**item)
-                except ValidationError:
-                    logger.exception(f'ValidationError for film {fw_id}')
-                    continue
-
-                merged_data[fw_id]['id'] = fw_id
-                merged_data[fw_id]['imdb_rating'] = valid_item.rating
-                merged_data[fw_id]['title'] = valid_item.title
-                merged_data[fw_id]['description'] = valid_item.description
-
-                if valid_item.genre_id not in [i['id'] for i in merged_data[fw_id]['genres']]:
-                    merged_data[fw_id]['genres'].append({
-                        'id': valid_item.genre_id,
-                        'name': valid_item.genre_name,
-                    })
-
-                if valid_item.role == PersonRoleEnum.ACTOR.value \
-                    and valid_item.id not in [i['id'] for i in merged_data[fw_id]['actors']]:
-                    merged_data[fw_id]['actors'].append({
-                        'id': valid_item.id,
-                        'name': valid_item.full_name
-                    })
-                    merged_data[fw_id]['actors_names'].append(valid_item.full_name)
-
-                if valid_item.role == PersonRoleEnum.WRITER.value \
-                    and valid_item.id not in [i['id'] for i in merged_data[fw_id]['writers']]:
-                    merged_data[fw_id]['writers'].append({
-                        'id': valid_item.id,
-                        'name': valid_item.full_name
-                    })
-                    merged_data[fw_id]['writers_names'].append(valid_item.full_name)
-
-                if valid_item.role == PersonRoleEnum.DIRECTOR.value \
-                    and valid_item.id not in [i['id'] for i in merged_data[fw_id]['directors']]:
-                    merged_data[fw_id]['directors'].append({
-                        'id': valid_item.id,
-                        'name': valid_item.full_name
-                    })
-                    merged_data[fw_id]['director'].append(valid_item.full_name)
-
-            return merged_data.values()
+            return [i[0] for i in cur.fetchall()]
 
 
 class EtlPersonProcess(EtlProcess):
@@ -195,6 +360,19 @@ class EtlPersonProcess(EtlProcess):
     PIPELINE_NAME = 'person_pipeline'
     INDEX_NAME = 'persons'
     TARGET_TABLE_SPECS = (PersonFilmWorkSpec, PersonSpec)
+    ROOT_TABLE_SPEC = PersonSpec
+    FLAT_MERGER_QUERY = """
+        SELECT
+            p.id,
+            pfw.role,
+            p.full_name,
+            fw.id as film_id
+        FROM person p
+        LEFT JOIN person_film_work pfw ON pfw.person_id = p.id
+        LEFT JOIN film_work fw ON fw.id = pfw.film_work_id
+        WHERE p.id = ANY(%(ids)s::uuid[])
+    """
+    FLAT_MERGER_ID_COLUMN = 'p.id'
 
     @staticmethod
     def postgres_enricher(
@@ -202,61 +380,60 @@ class EtlPersonProcess(EtlProcess):
         table_spec: Union[PersonFilmWorkSpec, PersonSpec],
         modified_row_ids: Tuple[str],
         batch_limit: int,
-        batch_offset: int,
+        last_id: str,
     ):
         """Возвращает film_work.id для измененных записей из таблиц genre и person"""
-        logger.info(f'RUN postgres_enricher for {table_spec.table_name}: {len(modified_row_ids)} will be enriched')
+        logger.debug(f'RUN postgres_enricher for {table_spec.table_name}: {len(modified_row_ids)} will be enriched')
 
         return table_spec.get_person_ids(
             pg_conn,
             modified_row_ids=modified_row_ids,
+            last_id=last_id,
             limit=batch_limit,
-            offset=batch_offset
         )
 
     @staticmethod
-    def postgres_merger(pg_conn: connection, person_ids: Tuple[str]):
-        """Собирает и мержит данные для последующей трансформации и отправки в Elastic"""
-        logger.info(f'RUN postgres_merger: {len(person_ids)} will be merged')
+    def get_affected_ids_sql(table_spec: Union[PersonFilmWorkSpec, PersonSpec]) -> Optional[str]:
+        return table_spec.get_affected_person_ids_sql()
+
+    @staticmethod
+    def merge_rows(rows: Iterable, columns: Optional[Sequence[str]] = None) -> List[dict]:
+        return merge_person_rows(rows, columns)
+
+    @staticmethod
+    def iter_documents(rows: Iterable, columns: Optional[Sequence[str]] = None) -> Iterator[dict]:
+        return iter_person_documents(rows, columns)
+
+    @staticmethod
+    def postgres_sql_merger(pg_conn: connection, person_ids: Tuple[str]) -> List[dict]:
+        """
+        Собирает документы персон в postgres, роли и фильмы агрегируются в lateral подзапросе.
+        array_agg(DISTINCT ...) отдает их упорядоченными, как mergers.sort_person_document
+        """
         with pg_conn.cursor() as cur:
-            query = cur.mogrify(
+            execute(
+                cur,
                 """
-                SELECT
-                    p.id,
-                    pfw.role,
-                    p.full_name,
-                    fw.id as film_id
+                SELECT json_build_object(
+                    'id', p.id,
+                    'full_name', p.full_name,
+                    'roles', COALESCE(films.roles, '{}'),
+                    'film_ids', COALESCE(films.film_ids, '{}')
+                )
                 FROM person p
-                LEFT JOIN person_film_work pfw ON pfw.person_id = p.id
-                LEFT JOIN film_work fw ON fw.id = pfw.film_work_id
-
-                WHERE p.id IN %(person_ids)s;
+                LEFT JOIN LATERAL (
+                    SELECT
+                        array_agg(DISTINCT pfw.role) AS roles,
+                        array_agg(DISTINCT pfw.film_work_id) AS film_ids
+                    FROM person_film_work pfw
+                    WHERE pfw.person_id = p.id
+                ) films ON TRUE
+                WHERE p.id = ANY(%(person_ids)s::uuid[]);
                 """,
-                {'person_ids': person_ids, }
+                {'person_ids': list(person_ids)}
             )
-            cur.execute(query)
-
-            raw_data = tuple(dict(i) for i in cur.fetchall())
-            merged_data = defaultdict(merged_person_data_template_factory)
-
-            for item in raw_data:
-                person_id = item['id']
-                try:
-                    valid_item = PersonMergedData(**item)
-                except ValidationError:
-                    logger.exception(f'ValidationError for film {person_id}')
-                    continue
-
-                merged_data[person_id]['id'] = person_id
-                merged_data[person_id]['full_name'] = valid_item.full_name
-
-                if valid_item.role not in merged_data[person_id]['roles']:
-                    merged_data[person_id]['roles'].append(valid_item.role)
 
-                if valid_item.film_id not in merged_data[person_id]['film_ids']:
-                    merged_data[person_id]['film_ids'].append(valid_item.film_id)
-
-            return merged_data.values()
+            return [i[0] for i in cur.fetchall()]
 
 
 class EtlGenreProcess(EtlProcess):
@@ -265,6 +442,13 @@ class EtlGenreProcess(EtlProcess):
     PIPELINE_NAME = 'genre_pipeline'
     INDEX_NAME = 'genres'
     TARGET_TABLE_SPECS = (GenreSpec,)
+    ROOT_TABLE_SPEC = GenreSpec
+    FLAT_MERGER_QUERY = """
+        SELECT id, name
+        FROM genre p
+        WHERE p.id = ANY(%(ids)s::uuid[])
+    """
+    FLAT_MERGER_ID_COLUMN = 'p.id'
 
     @staticmethod
     def postgres_enricher(
@@ -272,45 +456,43 @@ class EtlGenreProcess(EtlProcess):
         table_spec: GenreSpec,
         modified_row_ids: Tuple[str],
         batch_limit: int,
-        batch_offset: int,
+        last_id: str,
     ):
         """Возвращает film_work.id для измененных записей из таблиц genre и person"""
-        logger.info(f'RUN postgres_enricher for {table_spec.table_name}: {len(modified_row_ids)} will be enriched')
+        logger.debug(f'RUN postgres_enricher for {table_spec.table_name}: {len(modified_row_ids)} will be enriched')
 
         return table_spec.get_genre_ids(
             pg_conn,
             modified_row_ids=modified_row_ids,
+            last_id=last_id,
             limit=batch_limit,
-            offset=batch_offset
         )
 
     @staticmethod
-    def postgres_merger(pg_conn: connection, genres_id: Tuple[str]):
-        """Собирает и мержит данные для последующей трансформации и отправки в Elastic"""
-        logger.info(f'RUN postgres_merger: {len(genres_id)} will be merged')
+    def get_affected_ids_sql(table_spec: GenreSpec) -> Optional[str]:
+        # идентификаторы строк genre и есть идентификаторы документов
+        return None
+
+    @staticmethod
+    def merge_rows(rows: Iterable, columns: Optional[Sequence[str]] = None) -> List[dict]:
+        return merge_genre_rows(rows, columns)
+
+    @staticmethod
+    def iter_documents(rows: Iterable, columns: Optional[Sequence[str]] = None) -> Iterator[dict]:
+        return iter_genre_documents(rows, columns)
+
+    @staticmethod
+    def postgres_sql_merger(pg_conn: connection, genres_id: Tuple[str]) -> List[dict]:
+        """Собирает документы жанров в postgres"""
         with pg_conn.cursor() as cur:
-            query = cur.mogrify(
+            execute(
+                cur,
                 """
-                SELECT id, name
-                FROM genre p
-                WHERE p.id IN %(genres_id)s;
+                SELECT json_build_object('id', g.id, 'name', g.name)
+                FROM genre g
+                WHERE g.id = ANY(%(genres_id)s::uuid[]) AND g.name IS NOT NULL;
                 """,
-                {'genres_id': genres_id, }
+                {'genres_id': list(genres_id)}
             )
-            cur.execute(query)
-
-            raw_data = tuple(dict(i) for i in cur.fetchall())
-            merged_data = defaultdict(merged_genre_data_template_factory)
-
-            for item in raw_data:
-                genre_id = item['id']
-                try:
-                    valid_item = GenreMergedData(**item)
-                except ValidationError:
-                    logger.exception(f'ValidationError for film {genre_id}')
-                    continue
-
-                merged_data[genre_id]['id'] = genre_id
-                merged_data[genre_id]['name'] = valid_item.name
 
-            return merged_data.values()
+            return [i[0] for i in cur.fetchall()]
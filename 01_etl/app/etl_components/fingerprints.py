@@ -0,0 +1,143 @@
+"""
+Подавление повторной отправки неизменившихся документов.
+
+Перед загрузкой для каждого документа считается отпечаток канонического _source (json с сортировкой ключей,
+тот же сериализатор, что и в elastic_components.ndjson) и сравнивается с отпечатком последней успешной загрузки из storage.fingerprints.FingerprintStore.
+Совпавшие документы в Elastic не отправляются. Новые отпечатки сохраняются только после успешной загрузки.
+
+Если индекс в Elastic удалили или восстановили из бэкапа, отпечатки нужно проверить или пересобрать по Elastic.
+Пример запуска из папки app:
+    python -m etl_components.fingerprints --index movies --verify
+    python -m etl_components.fingerprints --index movies --verify --fix
+    python -m etl_components.fingerprints --index movies --rebuild
+"""
+import argparse
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple, Union
+
+from elasticsearch import Elasticsearch, helpers
+from settings import settings
+
+from elastic_components.loader import get_elasticsearch_loader
+from elastic_components.ndjson import SerializedDocument, get_dumps
+from lib.logger import logger
+from storage.fingerprints import FingerprintStore
+
+
+def fingerprint(source: Union[dict, bytes]) -> bytes:
+    """
+    Хеш канонического представления документа: не зависит от порядка ключей
+    :param source: документ или его уже сериализованное каноническое представление
+    """
+    if not isinstance(source, bytes):
+        source = get_dumps(settings.ES_JSON_ENCODER)(source)
+    return hashlib.blake2b(source, digest_size=16).digest()
+
+
+def _fingerprint_action(action: Union[dict, SerializedDocument]) -> Tuple[str, bytes]:
+    if isinstance(action, SerializedDocument):
+        # source уже сериализован тем же сериализатором, отбрасывается только перевод строки
+        return action.doc_id, fingerprint(action.source[:-1])
+    return str(action['_id']), fingerprint(action['_source'])
+
+
+@lru_cache(maxsize=None)
+def get_fingerprint_store() -> FingerprintStore:
+    """Возвращает единственное на процесс хранилище отпечатков, настроенное из settings"""
+    return FingerprintStore(settings.FINGERPRINTS_PATH)
+
+
+def drop_unchanged(
+    store: FingerprintStore,
+    index_name: str,
+    actions: Sequence[Union[dict, SerializedDocument]],
+    skip_unchanged: bool = True,
+) -> Tuple[List[Union[dict, SerializedDocument]], Dict[str, bytes]]:
+    """
+    Отбрасывает actions, _source которых совпадает с последним загруженным.
+    Возвращает actions для отправки и их отпечатки, которые нужно сохранить после успешной загрузки
+    :param skip_unchanged: False - ничего не отбрасывать, только посчитать отпечатки (например для нового индекса)
+    """
+    keyed = [(_fingerprint_action(action), action) for action in actions]
+    fingerprints = dict(key for key, _ in keyed)
+    if not skip_unchanged:
+        return list(actions), fingerprints
+
+    known = store.get_many(index_name, fingerprints)
+    changed = [action for (doc_id, value), action in keyed if known.get(doc_id) != value]
+    return changed, {doc_id: value for doc_id, value in fingerprints.items() if known.get(doc_id) != value}
+
+
+def rebuild_from_elasticsearch(client: Elasticsearch, store: FingerprintStore, index_name: str) -> int:
+    """Пересобирает отпечатки индекса по документам, которые сейчас лежат в Elastic"""
+    store.clear(index_name)
+    rebuilt = 0
+    page = {}
+
+    for hit in helpers.scan(client, index=index_name, query={'query': {'match_all': {}}}, size=1000):
+        page[hit['_id']] = fingerprint(hit['_source'])
+        if len(page) >= 1000:
+            store.put_many(index_name, page)
+            rebuilt += len(page)
+            page = {}
+
+    store.put_many(index_name, page)
+    return rebuilt + len(page)
+
+
+def verify_against_elasticsearch(
+    client: Elasticsearch,
+    store: FingerprintStore,
+    index_name: str,
+    fix: bool = False,
+) -> Dict[str, int]:
+    """
+    Сверяет отпечатки с документами в Elastic.
+    mismatched - документ в Elastic отличается от отпечатка, missing - отпечаток есть, а документа в Elastic нет,
+    unknown - документ есть только в Elastic. С fix=True расхождения исправляются по Elastic
+    """
+    stats = {'checked': 0, 'mismatched': 0, 'missing': 0, 'unknown': 0}
+    seen_ids = set()
+    hits = helpers.scan(client, index=index_name, query={'query': {'match_all': {}}}, size=1000)
+
+    while True:
+        page = {hit['_id']: fingerprint(hit['_source']) for _, hit in zip(range(1000), hits)}
+        if not page:
+            break
+
+        known = store.get_many(index_name, page)
+        wrong = {doc_id: value for doc_id, value in page.items() if known.get(doc_id) != value}
+        stats['checked'] += len(page)
+        stats['unknown'] += sum(1 for doc_id in wrong if doc_id not in known)
+        stats['mismatched'] += sum(1 for doc_id in wrong if doc_id in known)
+        seen_ids.update(page)
+
+        if fix:
+            store.put_many(index_name, wrong)
+
+    missing = [doc_id for doc_id, _ in store.iter_index(index_name) if doc_id not in seen_ids]
+    stats['missing'] = len(missing)
+    if fix:
+        # иначе документ, пропавший из Elastic, никогда не будет отправлен повторно
+        store.delete_many(index_name, missing)
+
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Проверка и пересборка отпечатков документов по данным Elastic')
+    parser.add_argument('--index', required=True, help='индекс или alias в Elastic')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--verify', action='store_true', help='сверить отпечатки с Elastic')
+    group.add_argument('--rebuild', action='store_true', help='пересобрать отпечатки по Elastic')
+    parser.add_argument('--fix', action='store_true', help='вместе с --verify исправить расхождения')
+    args = parser.parse_args()
+
+    es_client = get_elasticsearch_loader().client
+    fingerprint_store = get_fingerprint_store()
+
+    if args.rebuild:
+        logger.info(f'Rebuilt {rebuild_from_elasticsearch(es_client, fingerprint_store, args.index)} fingerprints')
+    else:
+        logger.info(f'Verified fingerprints: {verify_against_elasticsearch(es_client, fingerprint_store, args.index, args.fix)}')
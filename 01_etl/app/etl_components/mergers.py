@@ -0,0 +1,228 @@
+"""
+Здесь описана сборка документов для Elastic из строк join'ов postgres.
+
+Аккумуляторы держат для каждого документа индексы уже добавленных значений (set),
+поэтому проверка дубликатов стоит O(1), а сборка батча линейна по числу строк.
+Форма и порядок элементов документов совпадают с postgres_sql_merger: NULL из LEFT JOIN (фильм без жанров,
+персона без фильмов) дает пустой список, а не [None], списки упорядочены по id (см. sort_*_document),
+поэтому документ не зависит ни от стратегии merger'а, ни от порядка строк в выборке.
+
+Функции iter_*_documents рассчитаны на выборку, упорядоченную по id документа (потоковый merger):
+документ отдается, как только начались строки следующего, поэтому в памяти держатся строки только одного документа.
+
+Если передан columns, строки - кортежи обычного курсора с этими колонками, и они проверяются
+скомпилированными проверками из etl_components.rows вместо моделей pydantic.
+"""
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Set, Type
+
+from pydantic import BaseModel, ValidationError
+
+from etl_components.models import FilmWorkMergedData, GenreMergedData, PersonMergedData
+from etl_components.rows import CompactRowSchema
+from etl_components.utils import (merged_fw_data_template_factory, merged_genre_data_template_factory,
+                                  merged_person_data_template_factory)
+from lib.logger import logger
+from postgres_components.constants import PersonRoleEnum
+
+ROLE_CHOICES = {'role': frozenset(role.value for role in PersonRoleEnum)}
+
+ROW_SCHEMAS = {
+    FilmWorkMergedData: CompactRowSchema(FilmWorkMergedData, 'fw_id', choices=ROLE_CHOICES),
+    PersonMergedData: CompactRowSchema(PersonMergedData, 'id', choices=ROLE_CHOICES),
+    GenreMergedData: CompactRowSchema(GenreMergedData, 'id'),
+}
+
+
+def validate_rows(rows: Iterable[dict], model: Type[BaseModel], id_field: str) -> Iterator[tuple]:
+    """Валидирует строки выборки, пропуская невалидные. Отдает пары (id документа, валидная строка)"""
+    for item in rows:
+        doc_id = item[id_field]
+        try:
+            yield doc_id, model(**item)
+        except ValidationError:
+            logger.exception(f'ValidationError for {model.__name__} {doc_id}')
+
+
+def validate_any_rows(
+    rows: Iterable,
+    model: Type[BaseModel],
+    id_field: str,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[tuple]:
+    """validate_rows для словарей или, если передан columns, компактная проверка кортежей"""
+    if columns is None:
+        return validate_rows(rows, model, id_field)
+
+    return ROW_SCHEMAS[model].validate_rows(rows, columns)
+
+
+class FilmWorkDocumentAccumulator:
+    """Собирает документы индекса movies"""
+
+    # роль -> (поле со списком персон, поле со списком имен)
+    ROLE_FIELDS = {
+        PersonRoleEnum.ACTOR.value: ('actors', 'actors_names'),
+        PersonRoleEnum.WRITER.value: ('writers', 'writers_names'),
+        PersonRoleEnum.DIRECTOR.value: ('directors', 'director'),
+    }
+
+    def __init__(self):
+        self.documents: Dict[Hashable, dict] = {}
+        self._seen: Dict[Hashable, Dict[str, Set]] = {}
+
+    def add(self, fw_id: Hashable, item: FilmWorkMergedData):
+        document = self.documents.get(fw_id)
+        if document is None:
+            document = self.documents[fw_id] = merged_fw_data_template_factory()
+            self._seen[fw_id] = {'genres': set(), 'actors': set(), 'writers': set(), 'directors': set()}
+        seen = self._seen[fw_id]
+
+        document['id'] = fw_id
+        document['imdb_rating'] = item.rating
+        document['title'] = item.title
+        document['description'] = item.description
+
+        if item.genre_id is not None and item.genre_id not in seen['genres']:
+            seen['genres'].add(item.genre_id)
+            document['genres'].append({
+                'id': item.genre_id,
+                'name': item.genre_name,
+            })
+
+        role_fields = self.ROLE_FIELDS.get(item.role)
+        if role_fields is None:
+            return
+
+        persons_field, names_field = role_fields
+        if item.id not in seen[persons_field]:
+            seen[persons_field].add(item.id)
+            document[persons_field].append({
+                'id': item.id,
+                'name': item.full_name
+            })
+            document[names_field].append(item.full_name)
+
+    def values(self) -> List[dict]:
+        return [sort_film_work_document(document) for document in self.documents.values()]
+
+
+class PersonDocumentAccumulator:
+    """Собирает документы индекса persons"""
+
+    def __init__(self):
+        self.documents: Dict[Hashable, dict] = {}
+        self._seen: Dict[Hashable, Dict[str, Set]] = {}
+
+    def add(self, person_id: Hashable, item: PersonMergedData):
+        document = self.documents.get(person_id)
+        if document is None:
+            document = self.documents[person_id] = merged_person_data_template_factory()
+            self._seen[person_id] = {'roles': set(), 'film_ids': set()}
+        seen = self._seen[person_id]
+
+        document['id'] = person_id
+        document['full_name'] = item.full_name
+
+        if item.role is not None and item.role not in seen['roles']:
+            seen['roles'].add(item.role)
+            document['roles'].append(item.role)
+
+        if item.film_id is not None and item.film_id not in seen['film_ids']:
+            seen['film_ids'].add(item.film_id)
+            document['film_ids'].append(item.film_id)
+
+    def values(self) -> List[dict]:
+        return [sort_person_document(document) for document in self.documents.values()]
+
+
+class GenreDocumentAccumulator:
+    """Собирает документы индекса genres"""
+
+    def __init__(self):
+        self.documents: Dict[Hashable, dict] = {}
+
+    def add(self, genre_id: Hashable, item: GenreMergedData):
+        document = self.documents.get(genre_id)
+        if document is None:
+            document = self.documents[genre_id] = merged_genre_data_template_factory()
+
+        document['id'] = genre_id
+        document['name'] = item.name
+
+    def values(self) -> List[dict]:
+        return list(self.documents.values())
+
+
+def sort_film_work_document(document: dict) -> dict:
+    """
+    Упорядочивает жанры и персоны фильма по id, списки имен - в порядке персон.
+    Тот же порядок задает ORDER BY в агрегатах EtlFilmWorkProcess.postgres_sql_merger
+    """
+    document['genres'].sort(key=itemgetter('id'))
+    for persons_field, names_field in FilmWorkDocumentAccumulator.ROLE_FIELDS.values():
+        document[persons_field].sort(key=itemgetter('id'))
+        document[names_field] = [person['name'] for person in document[persons_field]]
+    return document
+
+
+def sort_person_document(document: dict) -> dict:
+    """Упорядочивает роли и фильмы персоны, как array_agg(DISTINCT ...) в EtlPersonProcess.postgres_sql_merger"""
+    document['roles'].sort()
+    document['film_ids'].sort()
+    return document
+
+
+def merge_film_work_rows(rows: Iterable, columns: Optional[Sequence[str]] = None) -> List[dict]:
+    """Собирает документы фильмов из строк join'а film_work с персонами и жанрами"""
+    accumulator = FilmWorkDocumentAccumulator()
+    for fw_id, item in validate_any_rows(rows, FilmWorkMergedData, 'fw_id', columns):
+        accumulator.add(fw_id, item)
+    return accumulator.values()
+
+
+def merge_person_rows(rows: Iterable, columns: Optional[Sequence[str]] = None) -> List[dict]:
+    """Собирает документы персон из строк join'а person с фильмами"""
+    accumulator = PersonDocumentAccumulator()
+    for person_id, item in validate_any_rows(rows, PersonMergedData, 'id', columns):
+        accumulator.add(person_id, item)
+    return accumulator.values()
+
+
+def merge_genre_rows(rows: Iterable, columns: Optional[Sequence[str]] = None) -> List[dict]:
+    """Собирает документы жанров"""
+    accumulator = GenreDocumentAccumulator()
+    for genre_id, item in validate_any_rows(rows, GenreMergedData, 'id', columns):
+        accumulator.add(genre_id, item)
+    return accumulator.values()
+
+
+def iter_grouped_documents(
+    rows: Iterable,
+    model: Type[BaseModel],
+    id_field: str,
+    accumulator_factory: Callable,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[dict]:
+    """Собирает документы из строк, идущих подряд для каждого документа, и отдает их по одному"""
+    for _, group in groupby(validate_any_rows(rows, model, id_field, columns), key=itemgetter(0)):
+        accumulator = accumulator_factory()
+        for doc_id, item in group:
+            accumulator.add(doc_id, item)
+        yield from accumulator.values()
+
+
+def iter_film_work_documents(rows: Iterable, columns: Optional[Sequence[str]] = None) -> Iterator[dict]:
+    """Потоковая сборка документов фильмов, строки упорядочены по fw_id"""
+    return iter_grouped_documents(rows, FilmWorkMergedData, 'fw_id', FilmWorkDocumentAccumulator, columns)
+
+
+def iter_person_documents(rows: Iterable, columns: Optional[Sequence[str]] = None) -> Iterator[dict]:
+    """Потоковая сборка документов персон, строки упорядочены по id персоны"""
+    return iter_grouped_documents(rows, PersonMergedData, 'id', PersonDocumentAccumulator, columns)
+
+
+def iter_genre_documents(rows: Iterable, columns: Optional[Sequence[str]] = None) -> Iterator[dict]:
+    """Потоковая сборка документов жанров, строки упорядочены по id жанра"""
+    return iter_grouped_documents(rows, GenreMergedData, 'id', GenreDocumentAccumulator, columns)
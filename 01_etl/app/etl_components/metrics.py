@@ -0,0 +1,163 @@
+"""
+Здесь описаны метрики ETL процесса и сэмплированные сводки в лог.
+
+Счетчики и гистограммы размечены пайплайном и таблицей, поэтому по ним видно,
+какая стадия какого пайплайна упирается во время (stage_seconds) или копит отставание (checkpoint_lag_seconds).
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, Mapping, Optional, Tuple
+
+from settings import settings
+
+from lib.logger import logger
+from lib.metrics import REGISTRY
+from storage.state import State
+
+ROWS_SCANNED = REGISTRY.counter(
+    'etl_rows_scanned_total', 'Changed rows found by the producer', ('pipeline', 'table'),
+)
+IDS_ENRICHED = REGISTRY.counter(
+    'etl_ids_enriched_total', 'Target document ids resolved by the enricher', ('pipeline', 'table'),
+)
+DOCUMENTS_MERGED = REGISTRY.counter(
+    'etl_documents_merged_total', 'Documents assembled by the merger', ('pipeline', 'table'),
+)
+DOCUMENTS_LOADED = REGISTRY.counter(
+    'etl_documents_loaded_total', 'Documents indexed into Elasticsearch', ('pipeline', 'table'),
+)
+DOCUMENTS_PATCHED = REGISTRY.counter(
+    'etl_documents_patched_total', 'Documents partially updated after a dimension change', ('pipeline', 'table'),
+)
+DOCUMENTS_FAILED = REGISTRY.counter(
+    'etl_documents_failed_total', 'Documents rejected by Elasticsearch and written to the dead-letter file',
+    ('pipeline', 'table'),
+)
+DOCUMENTS_UNCHANGED = REGISTRY.counter(
+    'etl_documents_unchanged_total', 'Documents not sent because their fingerprint did not change', ('pipeline', 'table'),
+)
+BYTES_SENT = REGISTRY.counter(
+    'etl_bulk_bytes_sent_total', 'Estimated size of bulk request bodies sent to Elasticsearch', ('pipeline', 'table'),
+)
+BULK_ERRORS = REGISTRY.counter(
+    'etl_bulk_errors_total', 'Failed bulk requests by reason', ('pipeline', 'table', 'reason'),
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    'etl_stage_seconds', 'Time spent on one batch by a pipeline stage', ('pipeline', 'table', 'stage'),
+)
+
+
+class CaughtUpTimes:
+    """
+    Когда сканирование таблицы пайплайна в последний раз не нашло изменений после чекпоинта.
+    Все изменения, сделанные до этого момента, уже загружены в Elastic
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._times: Dict[Tuple[str, str], datetime] = {}
+
+    def mark(self, pipeline_name: str, processed_batches: Mapping[str, int], scanned_at: datetime):
+        """Учитывает цикл пайплайна, начатый в scanned_at: таблицы без обработанных батчей догнали изменения"""
+        with self._lock:
+            for table_name, batches in processed_batches.items():
+                if not batches:
+                    self._times[(pipeline_name, table_name)] = scanned_at
+
+    def get(self, pipeline_name: str, table_name: str) -> Optional[datetime]:
+        with self._lock:
+            return self._times.get((pipeline_name, table_name))
+
+
+@lru_cache(maxsize=None)
+def get_caught_up_times() -> CaughtUpTimes:
+    """Возвращает единственный на процесс CaughtUpTimes"""
+    return CaughtUpTimes()
+
+
+def register_checkpoint_lag(state: State, pipeline_names: Iterable[str]):
+    """
+    Регистрирует gauge etl_checkpoint_lag_seconds: сколько секунд назад индекс гарантированно содержал все изменения таблицы.
+    Это now - max(last_modified_dt чекпоинта, время последнего сканирования без изменений, см. CaughtUpTimes).
+    У догнавшей изменения таблицы значение не превышает интервал опроса, а растет, только если загрузка отстает
+    или опрос остановился. Значение вычисляется в момент чтения метрик
+    """
+    pipeline_names = tuple(pipeline_names)
+    caught_up_times = get_caught_up_times()
+
+    def collect() -> Iterator[Tuple[dict, float]]:
+        now = datetime.now(timezone.utc)
+        with state.lock:
+            pipelines = {name: state.get_state(name) or {} for name in pipeline_names}
+
+        for pipeline_name, tables in pipelines.items():
+            for table_name, table_state in tables.items():
+                last_modified_dt = table_state.get('last_modified_dt')
+                if not last_modified_dt:
+                    continue
+
+                last_modified_dt = datetime.fromisoformat(last_modified_dt)
+                if last_modified_dt.tzinfo is None:
+                    last_modified_dt = last_modified_dt.replace(tzinfo=timezone.utc)
+                caught_up_at = caught_up_times.get(pipeline_name, table_name)
+                up_to_date_at = max(last_modified_dt, caught_up_at) if caught_up_at else last_modified_dt
+                yield {'pipeline': pipeline_name, 'table': table_name}, max((now - up_to_date_at).total_seconds(), 0)
+
+    REGISTRY.gauge(
+        'etl_checkpoint_lag_seconds',
+        'Seconds since the index was last known to contain every change of the table',
+        ('pipeline', 'table'),
+        collect=collect,
+    )
+
+
+class ProgressLog:
+    """
+    Сводки прогресса вместо логирования каждого батча:
+    не чаще раза в interval секунд для пары (пайплайн, таблица) пишет, сколько обработано с прошлой сводки
+    """
+
+    COUNTERS = (
+        ('scanned', ROWS_SCANNED),
+        ('enriched', IDS_ENRICHED),
+        ('merged', DOCUMENTS_MERGED),
+        ('loaded', DOCUMENTS_LOADED),
+        ('patched', DOCUMENTS_PATCHED),
+        ('failed', DOCUMENTS_FAILED),
+        ('unchanged', DOCUMENTS_UNCHANGED),
+    )
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_time: Dict[Tuple[str, str], float] = {}
+        self._last_values: Dict[Tuple[str, str], Tuple[float, ...]] = {}
+
+    def maybe_log(self, pipeline_name: str, table_name: str, force: bool = False):
+        key = (pipeline_name, table_name)
+        now = time.monotonic()
+
+        with self._lock:
+            last_time = self._last_time.setdefault(key, now)
+            if not force and now - last_time < self.interval:
+                return
+
+            values = tuple(counter.get(pipeline=pipeline_name, table=table_name) for _, counter in self.COUNTERS)
+            previous = self._last_values.get(key, (0,) * len(values))
+            self._last_time[key] = now
+            self._last_values[key] = values
+
+        deltas = [current - before for current, before in zip(values, previous)]
+        if not any(deltas):
+            return
+
+        summary = ', '.join(f'{name} {int(delta)}' for (name, _), delta in zip(self.COUNTERS, deltas))
+        logger.info(f'{pipeline_name}.{table_name} in last {now - last_time:.1f}s: {summary}')
+
+
+@lru_cache(maxsize=None)
+def get_progress_log() -> ProgressLog:
+    """Возвращает единственный на процесс ProgressLog, настроенный из settings"""
+    return ProgressLog(settings.LOG_SUMMARY_INTERVAL)
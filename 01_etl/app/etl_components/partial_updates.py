@@ -0,0 +1,165 @@
+"""
+Частичное обновление документов при изменении справочников (переименование жанра или персоны).
+
+Вместо поиска всех связанных документов и их полной пересборки новые имена читаются из справочника
+одним запросом, а в Elastic уходит один update_by_query: painless скрипт меняет name у вложенных объектов
+с нужными id и пересобирает соответствующие массивы имен (например actors_names).
+Изменения таблиц связей (например person_film_work) по-прежнему обрабатываются полной пересборкой документов.
+
+Временные ошибки (перегрузка, недоступность шардов, неразрешенные конфликты версий) поднимают
+ElasticsearchUnavailableError, и воркер повторяет обновление с чекпоинта: скрипт идемпотентен.
+Документы с постоянной ошибкой возвращаются вызывающему для dead letter, а остальные обновляются повторным запросом.
+
+Отпечатки документов (etl_components.fingerprints) затронутых документов перед обновлением удаляются:
+их _source в Elastic меняется в обход загрузчика, и следующая полная пересборка должна отправить их заново.
+"""
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from elasticsearch import ApiError, Elasticsearch, TransportError, helpers
+from psycopg2.extensions import connection
+
+from elastic_components.errors import ElasticsearchUnavailableError, is_retryable_error, is_retryable_failure
+from lib.logger import logger
+from postgres_components.statements import execute
+
+# update_by_query по популярному жанру может затронуть весь индекс
+UPDATE_BY_QUERY_TIMEOUT = 600
+
+# сколько раз повторять update_by_query, если документы одновременно переписал bulk
+# или запрос прервался на документах с постоянной ошибкой
+VERSION_CONFLICT_RETRIES = 3
+
+PATCH_SCRIPT = """
+boolean changed = false;
+for (field in params.fields) {
+    def items = ctx._source[field.nested];
+    if (items == null) {
+        continue;
+    }
+    boolean fieldChanged = false;
+    for (item in items) {
+        def name = params.names[item['id']];
+        if (name != null && name != item['name']) {
+            item['name'] = name;
+            fieldChanged = true;
+        }
+    }
+    if (fieldChanged && field.names != null) {
+        def names = new ArrayList();
+        for (item in items) {
+            names.add(item['name']);
+        }
+        ctx._source[field.names] = names;
+    }
+    changed = changed || fieldChanged;
+}
+if (!changed) {
+    ctx.op = 'noop';
+}
+"""
+
+
+class DimensionPatch(NamedTuple):
+    """Как применить изменение строк справочника к документам индекса"""
+
+    # запрос новых имен: строки (id, name) для массива %(ids)s
+    names_query: str
+    # пары (поле с вложенными объектами {id, name}, поле с массивом их имен или None)
+    fields: Tuple[Tuple[str, Optional[str]], ...]
+
+
+GENRE_PATCH = DimensionPatch(
+    names_query='SELECT id::text, name FROM genre WHERE id = ANY(%(ids)s::uuid[]);',
+    fields=(('genres', None),),
+)
+
+PERSON_PATCH = DimensionPatch(
+    names_query='SELECT id::text, full_name FROM person WHERE id = ANY(%(ids)s::uuid[]);',
+    fields=(('actors', 'actors_names'), ('writers', 'writers_names'), ('directors', 'director')),
+)
+
+
+def fetch_dimension_names(pg_conn: connection, patch: DimensionPatch, ids: Sequence[str]) -> Dict[str, str]:
+    """Актуальные имена изменившихся строк справочника"""
+    with pg_conn.cursor() as cur:
+        execute(cur, patch.names_query, {'ids': list(ids)})
+        return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def build_patch_query(patch: DimensionPatch, ids: Sequence[str], excluded_doc_ids: Sequence[str] = ()) -> dict:
+    """Запрос документов, в которых хотя бы одно из полей patch ссылается на ids, кроме excluded_doc_ids"""
+    query = {
+        'bool': {
+            'should': [
+                {'nested': {'path': nested, 'query': {'terms': {f'{nested}.id': list(ids)}}}}
+                for nested, _ in patch.fields
+            ],
+            'minimum_should_match': 1,
+        }
+    }
+    if excluded_doc_ids:
+        query['bool']['must_not'] = [{'ids': {'values': list(excluded_doc_ids)}}]
+    return query
+
+
+def iter_patched_doc_ids(client: Elasticsearch, index_name: str, patch: DimensionPatch, ids: Sequence[str]) -> Iterator[str]:
+    """Идентификаторы документов, которые затронет обновление строк справочника ids"""
+    for hit in helpers.scan(client, index=index_name, query={'query': build_patch_query(patch, ids)}, _source=False):
+        yield hit['_id']
+
+
+def apply_dimension_patch(
+    client: Elasticsearch,
+    index_name: str,
+    patch: DimensionPatch,
+    names: Dict[str, str],
+) -> Tuple[int, List[dict]]:
+    """
+    Проставляет новые имена во все документы индекса, которые на них ссылаются.
+    Возвращает число измененных документов и ошибки документов, которые обновить нельзя (из failures ответа)
+    """
+    if not names:
+        return 0, []
+
+    script = {
+        'source': PATCH_SCRIPT,
+        'lang': 'painless',
+        'params': {
+            'names': names,
+            'fields': [{'nested': nested, 'names': names_field} for nested, names_field in patch.fields],
+        },
+    }
+    client = client.options(request_timeout=UPDATE_BY_QUERY_TIMEOUT)
+    updated = 0
+    failed: List[dict] = []
+
+    for attempt in range(VERSION_CONFLICT_RETRIES + 1):
+        try:
+            response = client.update_by_query(
+                index=index_name,
+                query=build_patch_query(patch, list(names), [i['id'] for i in failed]),
+                script=script,
+                conflicts='proceed',
+                slices='auto',
+            )
+        except (ApiError, TransportError) as e:
+            if not is_retryable_error(e):
+                raise
+            raise ElasticsearchUnavailableError(f'update_by_query on {index_name} failed: {e!r}') from e
+
+        updated += response.get('updated', 0)
+        failures = response.get('failures') or []
+        if any(is_retryable_failure(i) for i in failures):
+            raise ElasticsearchUnavailableError(f'update_by_query on {index_name} failed: {failures[:3]}')
+
+        # скрипт идемпотентен: повтор затронет только документы, которые не удалось обновить из-за конфликта,
+        # и документы, до которых прерванный ошибкой запрос не дошел
+        if failures:
+            failed.extend(failures)
+            logger.warning(f'{len(failures)} documents of {index_name} cannot be patched, attempt {attempt + 1}')
+        elif response.get('version_conflicts'):
+            logger.warning(f'{response["version_conflicts"]} version conflicts on {index_name}, attempt {attempt + 1}')
+        else:
+            return updated, failed
+
+    raise ElasticsearchUnavailableError(f'update_by_query on {index_name} did not finish in {attempt + 1} attempts')
@@ -1,11 +1,29 @@
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Sequence, Tuple
+
 import psycopg2
 from settings import settings
 
+from elastic_components.errors import ELASTICSEARCH_UNAVAILABLE_ERRORS
+from etl_components.coalescing import process_pipeline_coalesced
+from etl_components.constants import ChangeSourceEnum, ExecutionModeEnum
 from etl_components.etl_process import EtlFilmWorkProcess, EtlGenreProcess, EtlPersonProcess
+from etl_components.metrics import get_caught_up_times, register_checkpoint_lag
+from etl_components.scheduler import PollScheduler
+from etl_components.shared_scan import get_table_subscribers, process_table_shared
+from etl_components.stages import process_pipeline_staged
+from etl_components.types import PipeLineType
 from etl_components.use_cases import process_pipeline
+from lib.logger import logger
+from lib.metrics import start_metrics_server
 from lib.utils import backoff
+from postgres_components.listener import ChangeListener
+from postgres_components.table_spec import AbstractPostgresTableSpec
 from storage.state import State
-from storage.storage import JsonFileStorage
+from storage.use_cases import get_storage
 
 PIPELINES = [
     EtlFilmWorkProcess,
@@ -14,14 +32,205 @@ PIPELINES = [
 ]
 
 
-@backoff(psycopg2.OperationalError)
-def run_etl():
+def run_pipeline_cycle(
+    pipeline: PipeLineType,
+    state: State,
+    change_source: ChangeSourceEnum,
+    table_specs: Optional[Sequence[AbstractPostgresTableSpec]] = None,
+) -> Dict[str, int]:
     """
-    Синхронно по очереди запускает все пайплайны для отправки данных в Elastic
+    Один проход пайплайна по его таблицам (по умолчанию по всем) в выбранном режиме выполнения.
+    Возвращает число обработанных батчей по каждой таблице
     """
-    storage = JsonFileStorage('./storage.json')
-    state = State(storage)
+    execution_mode = ExecutionModeEnum(settings.PIPELINE_EXECUTION_MODE)
+
+    if execution_mode is ExecutionModeEnum.STAGED:
+        processed_batches = process_pipeline_staged(
+            pipeline,
+            settings.dsl,
+            state,
+            settings.BATCH_SIZE,
+            settings.STAGE_QUEUE_SIZE,
+            change_source=change_source,
+            table_specs=table_specs,
+        )
+    elif execution_mode is ExecutionModeEnum.COALESCED:
+        processed_batches = process_pipeline_coalesced(
+            pipeline,
+            settings.dsl,
+            state,
+            settings.BATCH_SIZE,
+            settings.COALESCE_MAX_IDS_IN_MEMORY,
+            settings.COALESCE_MAX_IDS_PER_CYCLE,
+            change_source=change_source,
+            table_specs=table_specs,
+        )
+    else:
+        processed_batches = process_pipeline(
+            pipeline,
+            settings.dsl,
+            state,
+            settings.BATCH_SIZE,
+            settings.PIPELINE_CONCURRENCY.get(pipeline.PIPELINE_NAME, 1),
+            change_source=change_source,
+            table_specs=table_specs,
+        )
+
+    state.flush()
+    return processed_batches
+
+
+def run_polling_loop(pipeline: PipeLineType, state: State):
+    """
+    Пайплайн в режиме сканирования по modified. Таблицы опрашиваются по адаптивному расписанию (см. PollScheduler):
+    простаивающие все реже, вплоть до целевой свежести индекса, а таблицы с изменениями без пауз
+    """
+    scheduler = PollScheduler.for_pipeline(
+        pipeline,
+        min_interval=settings.POLL_MIN_INTERVAL,
+        idle_interval=settings.POLL_IDLE_INTERVAL,
+        max_interval=settings.POLL_MAX_INTERVAL,
+        backoff_factor=settings.POLL_BACKOFF_FACTOR,
+        freshness_slo=settings.FRESHNESS_SLO.get(pipeline.INDEX_NAME),
+    )
 
     while True:
-        for pipeline in PIPELINES:
-            process_pipeline(pipeline, settings.dsl, state, settings.BATCH_SIZE)
+        due_table_specs = scheduler.due_table_specs()
+        if due_table_specs:
+            started = datetime.now(timezone.utc)
+            processed_batches = run_pipeline_cycle(pipeline, state, ChangeSourceEnum.SCAN, due_table_specs)
+            get_caught_up_times().mark(pipeline.PIPELINE_NAME, processed_batches, started)
+            for table_name, batches in processed_batches.items():
+                scheduler.report(table_name, has_changes=bool(batches))
+
+        time.sleep(scheduler.seconds_until_next_poll())
+
+
+def run_change_capture_loop(pipeline: PipeLineType, state: State):
+    """
+    Пайплайн в режиме change capture: спит до уведомления от триггеров и вычитывает только журнал изменений.
+    Раз в CHANGE_CAPTURE_CATCHUP_INTERVAL секунд (и при старте) делается обычное сканирование по modified,
+    чтобы подхватить то, что не попало в журнал: изменения до установки триггеров, очищенный журнал и т.п.
+    Журнал вычитывается, пока очередной цикл не найдет изменений, и только потом ожидается уведомление.
+
+    Уведомление приходит при коммите, поэтому обычно изменение загружается следующим же циклом.
+    Запись транзакции, закоммиченной позже записей с большими id, читается из пропусков страницы журнала
+    (см. use_cases._iter_changelog_batches) тем же циклом, если журнал с ее id ушел вперед меньше чем
+    на CHANGE_CAPTURE_GAP_WINDOW записей. Худший случай для более долгих транзакций - CHANGE_CAPTURE_CATCHUP_INTERVAL
+    """
+    table_names = {table_spec.table_name for table_spec in pipeline.TARGET_TABLE_SPECS}
+    listener = ChangeListener(settings.dsl, settings.CHANGE_CAPTURE_CHANNEL)
+    next_catchup_time = 0
+
+    try:
+        while True:
+            if time.monotonic() >= next_catchup_time:
+                started = datetime.now(timezone.utc)
+                processed_batches = run_pipeline_cycle(pipeline, state, ChangeSourceEnum.SCAN)
+                get_caught_up_times().mark(pipeline.PIPELINE_NAME, processed_batches, started)
+                next_catchup_time = time.monotonic() + settings.CHANGE_CAPTURE_CATCHUP_INTERVAL
+
+            started = datetime.now(timezone.utc)
+            processed_batches = run_pipeline_cycle(pipeline, state, ChangeSourceEnum.CHANGELOG)
+            get_caught_up_times().mark(pipeline.PIPELINE_NAME, processed_batches, started)
+            if any(processed_batches.values()):
+                continue
+
+            while time.monotonic() < next_catchup_time:
+                changed_tables = listener.wait(timeout=next_catchup_time - time.monotonic())
+                if changed_tables & table_names:
+                    break
+    finally:
+        listener.close()
+
+
+@backoff((psycopg2.OperationalError, *ELASTICSEARCH_UNAVAILABLE_ERRORS))
+def run_pipeline_worker(pipeline: PipeLineType, state: State):
+    """
+    Бесконечно прогоняет один пайплайн. Каждый воркер открывает свои соединения с postgres
+    и пишет только в свой раздел состояния, поэтому большой бэклог одного индекса не задерживает остальные.
+    При потере связи с postgres или Elastic воркер перезапускается и продолжает с последнего чекпоинта в памяти
+    """
+    try:
+        if settings.CHANGE_CAPTURE_ENABLED:
+            run_change_capture_loop(pipeline, state)
+
+        run_polling_loop(pipeline, state)
+    finally:
+        # чекпоинты уже загруженных батчей не должны потеряться при ретрае или падении
+        state.flush()
+
+
+def run_shared_scan_loop(table_spec: AbstractPostgresTableSpec, subscribers: Tuple[PipeLineType, ...], state: State):
+    """
+    Общее сканирование одной таблицы для всех пайплайнов-подписчиков (см. etl_components.shared_scan)
+    по адаптивному расписанию. Интервал ограничен самой строгой целевой свежестью индексов подписчиков
+    """
+    freshness_slos = [settings.FRESHNESS_SLO[i.INDEX_NAME] for i in subscribers if i.INDEX_NAME in settings.FRESHNESS_SLO]
+    scheduler = PollScheduler(
+        (table_spec,),
+        min_interval=settings.POLL_MIN_INTERVAL,
+        idle_interval=settings.POLL_IDLE_INTERVAL,
+        max_interval=settings.POLL_MAX_INTERVAL,
+        backoff_factor=settings.POLL_BACKOFF_FACTOR,
+        freshness_slo=min(freshness_slos, default=None),
+    )
+
+    while True:
+        if scheduler.due_table_specs():
+            started = datetime.now(timezone.utc)
+            processed_pages = process_table_shared(table_spec, subscribers, settings.dsl, state, settings.BATCH_SIZE)
+            state.flush()
+            for pipeline in subscribers:
+                get_caught_up_times().mark(pipeline.PIPELINE_NAME, {table_spec.table_name: processed_pages}, started)
+            scheduler.report(table_spec.table_name, has_changes=bool(processed_pages))
+
+        time.sleep(scheduler.seconds_until_next_poll())
+
+
+@backoff((psycopg2.OperationalError, *ELASTICSEARCH_UNAVAILABLE_ERRORS))
+def run_shared_scan_worker(table_spec: AbstractPostgresTableSpec, subscribers: Tuple[PipeLineType, ...], state: State):
+    """Аналог run_pipeline_worker для общего сканирования таблицы"""
+    try:
+        run_shared_scan_loop(table_spec, subscribers, state)
+    finally:
+        state.flush()
+
+
+def run_etl():
+    """
+    Запускает все пайплайны одновременно, каждый в своем потоке.
+    С SHARED_SCAN_ENABLED потоки запускаются не по пайплайнам, а по таблицам: каждая таблица читается один раз
+    для всех пайплайнов, которые ее объявили.
+    Если какой-то из воркеров упал с неожидаемой ошибкой, исключение пробрасывается наружу
+    """
+    storage = get_storage()
+    state = State(storage, flush_interval=settings.STATE_FLUSH_INTERVAL, flush_every=settings.STATE_FLUSH_EVERY)
+    failures = queue.Queue()
+
+    register_checkpoint_lag(state, (pipeline.PIPELINE_NAME for pipeline in PIPELINES))
+    if settings.METRICS_PORT:
+        start_metrics_server(settings.METRICS_PORT, settings.METRICS_HOST)
+
+    def worker(name: str, target, *args):
+        try:
+            target(*args, state)
+        except Exception as e:  # ошибку пробросит главный поток
+            failures.put((name, e))
+
+    if settings.SHARED_SCAN_ENABLED:
+        if settings.CHANGE_CAPTURE_ENABLED:
+            logger.warning('CHANGE_CAPTURE_ENABLED is ignored: shared scan reads tables by modified only')
+        workers = [
+            (f'{table_spec.table_name}_scan', run_shared_scan_worker, table_spec, subscribers)
+            for table_spec, subscribers in get_table_subscribers(PIPELINES)
+        ]
+    else:
+        workers = [(pipeline.PIPELINE_NAME, run_pipeline_worker, pipeline) for pipeline in PIPELINES]
+
+    for name, target, *args in workers:
+        threading.Thread(target=worker, args=(name, target, *args), name=name, daemon=True).start()
+
+    name, error = failures.get()
+    logger.error(f'Worker {name} has stopped')
+    raise error
@@ -0,0 +1,194 @@
+"""
+Полная переиндексация пайплайна в новый индекс без простоя поиска.
+
+1. В одной транзакции REPEATABLE READ (один снимок БД) запоминаются водяные знаки таблиц пайплайна
+   и серверным курсором вычитываются все идентификаторы корневой таблицы (ROOT_TABLE_SPEC).
+2. Документы пишутся в новый версионный индекс, созданный по образцу текущего,
+   с refresh_interval=-1 и без реплик. После загрузки настройки возвращаются.
+3. Alias с именем INDEX_NAME атомарно переключается на новый индекс.
+4. Чекпоинты пайплайна сдвигаются на водяные знаки снимка, и инкрементальный режим продолжает с них.
+
+Во время переиндексации воркеры этого пайплайна (main.py) должны быть остановлены, иначе они перезапишут чекпоинты.
+
+Пример запуска из папки app:
+    python -m etl_components.reindex --pipeline film_work_pipeline
+    python -m etl_components.reindex --pipeline person_pipeline --definition ./persons_index.json --delete-old
+"""
+import argparse
+import json
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ, connection
+from psycopg2.extras import DictCursor
+from settings import settings
+
+from elastic_components.indices import (create_bulk_load_index, get_index_definition, restore_index_settings,
+                                        swap_alias, versioned_index_name)
+from elastic_components.loader import get_elasticsearch_loader
+from etl_components.fingerprints import get_fingerprint_store
+from etl_components.metrics import get_progress_log
+from etl_components.pipelines import PIPELINES
+from etl_components.types import PipeLineType
+from etl_components.use_cases import get_load_chunk_size, get_page_end_checkpoint, iter_merged_chunks, load_actions
+from lib.logger import logger
+from storage.state import State
+from storage.use_cases import get_storage, update_storage_data_in_pipeline_table
+
+
+def get_changelog_watermark(pg_conn: connection) -> Optional[int]:
+    """Последняя запись журнала etl_changelog в снимке или None, если журнал не установлен"""
+    with pg_conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('etl_changelog') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return None
+
+        cur.execute('SELECT COALESCE(max(id), 0) FROM etl_changelog;')
+        return cur.fetchone()[0]
+
+
+def get_changelog_gap_ids(pg_conn: connection, last_change_id: int, gap_window: int) -> List[int]:
+    """
+    id журнала из последних gap_window до last_change_id, которых нет в снимке: записи транзакций,
+    не закоммиченных к снимку. Они не попали в новый индекс и перепроверяются как пропуски страницы журнала
+    """
+    after_id = max(last_change_id - gap_window, 0)
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT prev_id + 1, id - 1
+            FROM (
+                SELECT id, lag(id, 1, %(after_id)s::bigint) OVER (ORDER BY id) AS prev_id
+                FROM etl_changelog
+                WHERE id > %(after_id)s AND id <= %(last_change_id)s
+            ) journal_ids
+            WHERE id - prev_id > 1;
+            """,
+            {'after_id': after_id, 'last_change_id': last_change_id}
+        )
+        return [gap_id for gap_start, gap_end in cur.fetchall() for gap_id in range(gap_start, gap_end + 1)]
+
+
+def get_watermark_checkpoints(pipeline: PipeLineType, pg_conn: connection, overlap: float) -> Dict[str, dict]:
+    """
+    Чекпоинты таблиц пайплайна, соответствующие текущему снимку.
+    modified выставляется приложением до коммита, поэтому транзакции, закоммиченные после снимка,
+    могут принести строки с modified чуть меньше водяного знака. Чтобы их не потерять,
+    курсор сканирования отодвигается на overlap секунд назад: повторная загрузка документов безопасна
+    """
+    changelog_last_id = get_changelog_watermark(pg_conn)
+    changelog_gap_ids = []
+    if changelog_last_id is not None:
+        changelog_gap_ids = get_changelog_gap_ids(pg_conn, changelog_last_id, settings.CHANGE_CAPTURE_GAP_WINDOW)
+    checkpoints = {}
+
+    for table_spec in pipeline.TARGET_TABLE_SPECS:
+        checkpoint = {
+            'enricher_last_id': None,
+            'changelog_enricher_last_id': None,
+            'changelog_page_end_id': None,
+            **get_page_end_checkpoint(None),
+        }
+        if changelog_last_id is not None:
+            checkpoint['changelog_last_id'] = changelog_last_id
+            checkpoint['changelog_gap_ids'] = list(changelog_gap_ids)
+
+        watermark = table_spec.get_watermark(pg_conn)
+        if watermark is not None:
+            if overlap:
+                checkpoint['last_modified_dt'] = (watermark.modified - timedelta(seconds=overlap)).isoformat()
+                checkpoint['last_row_id'] = None
+            else:
+                checkpoint['last_modified_dt'] = watermark.modified.isoformat()
+                checkpoint['last_row_id'] = watermark.id
+
+        checkpoints[table_spec.table_name] = checkpoint
+
+    return checkpoints
+
+
+def reindex_pipeline(
+    pipeline: PipeLineType,
+    dsl: dict,
+    state: State,
+    batch_size: int,
+    definition: Optional[dict] = None,
+    delete_old: bool = False,
+    overlap: float = 0,
+) -> int:
+    """
+    Перестраивает индекс пайплайна целиком и возвращает число загруженных документов
+    :param definition: settings и mappings нового индекса, по умолчанию копируются с текущего индекса
+    :param delete_old: удалить индексы, с которых снят alias
+    :param overlap: на сколько секунд отодвинуть назад курсоры сканирования относительно снимка
+    """
+    client = get_elasticsearch_loader().client
+    alias = pipeline.INDEX_NAME
+    root_table_name = pipeline.ROOT_TABLE_SPEC.table_name
+
+    definition = definition or get_index_definition(client, alias)
+    if definition is None:
+        raise ValueError(f'Index {alias} does not exist, pass its definition with --definition')
+
+    if settings.FINGERPRINTS_ENABLED:
+        # новый индекс пуст: документы отправляются все, а отпечатки собираются заново
+        get_fingerprint_store().clear(alias)
+
+    new_index = versioned_index_name(alias)
+    original_settings = create_bulk_load_index(client, new_index, definition)
+    loaded = 0
+
+    with psycopg2.connect(**dsl, cursor_factory=DictCursor) as pg_conn:
+        pg_conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+
+        # первый запрос транзакции фиксирует снимок, все дальнейшие чтения видят те же данные
+        checkpoints = get_watermark_checkpoints(pipeline, pg_conn, overlap)
+
+        for ids in pipeline.ROOT_TABLE_SPEC.iter_all_ids(pg_conn, batch_size):
+            chunks = iter_merged_chunks(pipeline, pg_conn, root_table_name, ids, get_load_chunk_size(), new_index)
+            for actions in chunks:
+                load_actions(pipeline, root_table_name, actions, skip_unchanged=False)
+                loaded += len(actions)
+            get_progress_log().maybe_log(pipeline.PIPELINE_NAME, root_table_name)
+
+    restore_index_settings(client, new_index, original_settings)
+    previous_indices = swap_alias(client, alias, new_index)
+    if delete_old and previous_indices:
+        client.indices.delete(index=','.join(previous_indices))
+        logger.info(f'Deleted old indices {previous_indices}')
+
+    for table_name, checkpoint in checkpoints.items():
+        update_storage_data_in_pipeline_table(
+            state,
+            pipline_name=pipeline.PIPELINE_NAME,
+            table_name=table_name,
+            data=checkpoint,
+        )
+    state.flush()
+
+    logger.info(f'Reindexed {loaded} documents of {pipeline.PIPELINE_NAME} into {new_index}')
+    return loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Полная переиндексация пайплайна в новый индекс с переключением alias')
+    parser.add_argument('--pipeline', required=True, choices=[pipeline.PIPELINE_NAME for pipeline in PIPELINES])
+    parser.add_argument('--definition', help='json с settings и mappings индекса, по умолчанию копируются с текущего')
+    parser.add_argument('--delete-old', action='store_true', help='удалить индексы, с которых снят alias')
+    args = parser.parse_args()
+
+    index_definition = None
+    if args.definition:
+        with open(args.definition) as definition_file:
+            index_definition = json.load(definition_file)
+
+    reindex_pipeline(
+        next(pipeline for pipeline in PIPELINES if pipeline.PIPELINE_NAME == args.pipeline),
+        settings.dsl,
+        State(get_storage()),
+        settings.BATCH_SIZE,
+        definition=index_definition,
+        delete_old=args.delete_old,
+        overlap=settings.REINDEX_WATERMARK_OVERLAP,
+    )
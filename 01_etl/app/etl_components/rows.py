@@ -0,0 +1,138 @@
+"""
+Здесь описано компактное представление строк join'ов для сборки документов (settings.MERGER_COMPACT_ROWS).
+
+Вместо DictRow -> dict -> модель pydantic на каждую строку выборка читается обычным курсором (кортежи),
+а каждая строка превращается в экземпляр namedtuple (__slots__ = (), без словаря атрибутов).
+Проверки и приведения типов берутся из полей модели pydantic и компилируются в одну функцию на запрос:
+для набора колонок выборки генерируется код, который обращается к колонкам по позиции.
+
+Приведение повторяет pydantic: UUID из строки, float из Decimal, необязательные поля пропускают NULL,
+а значение по умолчанию подставляется, если колонки нет в запросе. Дополнительно можно ограничить
+допустимые значения поля (например роль персоны). Невалидная строка пропускается с записью в лог, как в validate_rows.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, Optional, Sequence, Tuple, Type
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from lib.logger import logger
+
+
+def parse_uuid(value: Any) -> UUID:
+    if isinstance(value, UUID):
+        return value
+    if isinstance(value, str):
+        return UUID(value)
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return UUID(value.decode())
+        except ValueError:
+            return UUID(bytes=bytes(value))
+    raise TypeError(f'UUID expected, got {type(value).__name__}')
+
+
+def parse_str(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (float, int, Decimal)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    raise TypeError(f'str expected, got {type(value).__name__}')
+
+
+def parse_float(value: Any) -> float:
+    if isinstance(value, float):
+        return value
+    return float(value)
+
+
+# тип поля модели -> приведение значения колонки, невалидное значение поднимает ValueError или TypeError
+PARSERS: Dict[type, Callable[[Any], Any]] = {
+    UUID: parse_uuid,
+    str: parse_str,
+    float: parse_float,
+}
+
+
+class CompactRowSchema:
+    """Класс строк и скомпилированные проверки для одной модели pydantic"""
+
+    def __init__(
+        self,
+        model: Type[BaseModel],
+        id_field: str,
+        choices: Optional[Dict[str, FrozenSet[str]]] = None,
+    ):
+        """
+        :param model: модель, поля и приведения которой повторяются
+        :param id_field: колонка с id документа
+        :param choices: допустимые значения полей, например {'role': {'actor', 'writer', 'director'}}
+        """
+        self.model = model
+        self.id_field = id_field
+        self.choices = choices or {}
+        self.row_class = namedtuple(f'{model.__name__}Row', list(model.__fields__))
+
+        unsupported = [field.name for field in model.__fields__.values() if field.type_ not in PARSERS]
+        if unsupported:
+            raise TypeError(f'{model.__name__} fields {unsupported} have no compact parser')
+
+        self._validators: Dict[Tuple[str, ...], Callable[[tuple], tuple]] = {}
+
+    def validate_rows(self, rows: Iterable[tuple], columns: Sequence[str]) -> Iterator[tuple]:
+        """Аналог mergers.validate_rows для кортежей с колонками columns: пары (id документа, валидная строка)"""
+        validate = self.get_validator(columns)
+        id_position = list(columns).index(self.id_field)
+
+        for row in rows:
+            try:
+                yield row[id_position], validate(row)
+            except (ValueError, TypeError):
+                logger.exception(f'ValidationError for {self.model.__name__} {row[id_position]}')
+
+    def get_validator(self, columns: Sequence[str]) -> Callable[[tuple], tuple]:
+        """Проверка строк запроса с колонками columns, компилируется при первом обращении"""
+        columns = tuple(columns)
+        validator = self._validators.get(columns)
+        if validator is None:
+            validator = self._validators[columns] = self._compile(columns)
+        return validator
+
+    def _compile(self, columns: Tuple[str, ...]) -> Callable[[tuple], tuple]:
+        # как и collections.namedtuple, код функции собирается строкой: без вызова на каждое поле строки
+        positions = {name: position for position, name in enumerate(columns)}
+        namespace = {'_new': tuple.__new__, '_row_class': self.row_class}
+        values = []
+
+        for number, field in enumerate(self.model.__fields__.values()):
+            if field.name not in positions:
+                if field.required:
+                    raise ValueError(f'{self.model.__name__} requires column {field.name}, query has {columns}')
+                namespace[f'_default{number}'] = field.default
+                values.append(f'_default{number}')
+                continue
+
+            namespace[f'_parse{number}'] = PARSERS[field.type_]
+            value = f'_parse{number}(row[{positions[field.name]}])'
+            if field.name in self.choices:
+                namespace[f'_check{number}'] = _choice_checker(field.name, self.choices[field.name])
+                value = f'_check{number}({value})'
+            if field.allow_none:
+                value = f'(None if row[{positions[field.name]}] is None else {value})'
+            values.append(value)
+
+        source = f'def validate(row):\n    return _new(_row_class, ({", ".join(values)},))\n'
+        exec(source, namespace)
+        return namespace['validate']
+
+
+def _choice_checker(field_name: str, allowed: FrozenSet[str]) -> Callable[[Any], Any]:
+    def check(value):
+        if value not in allowed:
+            raise ValueError(f'{field_name} {value!r} is not one of {sorted(allowed)}')
+        return value
+
+    return check
@@ -0,0 +1,65 @@
+"""
+Здесь описан адаптивный планировщик опроса таблиц пайплайна.
+
+Если последнее сканирование таблицы ничего не нашло, следующий опрос откладывается
+с экспоненциальным ростом интервала. Как только изменения появились, интервал сбрасывается до минимального.
+Интервал никогда не превышает целевую свежесть (SLO) индекса, в который пишет пайплайн.
+"""
+import time
+from typing import Dict, List, Optional, Sequence
+
+from etl_components.types import PipeLineType
+from postgres_components.table_spec import AbstractPostgresTableSpec
+
+
+class PollScheduler:
+    """Ведет для каждой таблицы пайплайна интервал опроса и время следующего опроса"""
+
+    def __init__(
+        self,
+        table_specs: Sequence[AbstractPostgresTableSpec],
+        min_interval: float = 0,
+        idle_interval: float = 0.5,
+        max_interval: float = 30,
+        backoff_factor: float = 2,
+        freshness_slo: Optional[float] = None,
+    ):
+        """
+        :param table_specs: таблицы пайплайна
+        :param min_interval: интервал опроса таблицы, в которой есть изменения
+        :param idle_interval: первый интервал после пустого сканирования
+        :param max_interval: максимальный интервал опроса простаивающей таблицы
+        :param backoff_factor: во сколько раз растет интервал после каждого пустого сканирования
+        :param freshness_slo: целевая свежесть индекса в секундах, ограничивает max_interval сверху
+        """
+        self.table_specs = tuple(table_specs)
+        self.min_interval = min_interval
+        self.idle_interval = max(idle_interval, min_interval)
+        self.max_interval = min(max_interval, freshness_slo) if freshness_slo else max_interval
+        self.backoff_factor = backoff_factor
+
+        self._intervals: Dict[str, float] = {spec.table_name: min_interval for spec in self.table_specs}
+        self._next_poll_time: Dict[str, float] = {spec.table_name: 0 for spec in self.table_specs}
+
+    @classmethod
+    def for_pipeline(cls, pipeline: PipeLineType, **kwargs) -> 'PollScheduler':
+        return cls(pipeline.TARGET_TABLE_SPECS, **kwargs)
+
+    def due_table_specs(self) -> List[AbstractPostgresTableSpec]:
+        """Таблицы, которые пора опросить, самые просроченные первыми"""
+        now = time.monotonic()
+        due = [spec for spec in self.table_specs if self._next_poll_time[spec.table_name] <= now]
+        return sorted(due, key=lambda spec: self._next_poll_time[spec.table_name])
+
+    def report(self, table_name: str, has_changes: bool):
+        """Учитывает результат сканирования таблицы и планирует следующий опрос"""
+        if has_changes:
+            interval = self.min_interval
+        else:
+            interval = min(max(self._intervals[table_name] * self.backoff_factor, self.idle_interval), self.max_interval)
+
+        self._intervals[table_name] = interval
+        self._next_poll_time[table_name] = time.monotonic() + interval
+
+    def seconds_until_next_poll(self) -> float:
+        return max(min(self._next_poll_time.values()) - time.monotonic(), 0)
@@ -0,0 +1,189 @@
+"""
+Здесь описано общее сканирование таблиц для нескольких пайплайнов (settings.SHARED_SCAN_ENABLED).
+
+Одну таблицу, например person, объявляют в TARGET_TABLE_SPECS несколько пайплайнов. Вместо того чтобы каждый
+пайплайн читал ее изменения сам, одна страница producer'а читается один раз и раздается всем подписчикам.
+Каждый подписчик обогащает и загружает ее как обычно и подтверждает свой чекпоинт в своем разделе состояния,
+поэтому у каждого пайплайна остается своя позиция (watermark) в таблице.
+
+Сканирование начинается с самой отстающей позиции подписчиков. Страница отдается подписчику, если его позиция
+меньше конца страницы: при разошедшихся позициях подписчик может получить часть уже загруженных строк повторно,
+что безопасно, так как загрузка документа идемпотентна. Если Elastic одного подписчика недоступен, он пропускает
+остаток цикла, а остальные продолжают; в следующем цикле сканирование начнется с его позиции.
+
+Позиция enricher'а подписчика, прерванного на середине страницы, продолжается, только если первая страница
+сканирования совпала с его сохраненной страницей (см. iter_pipeline_batches). Иначе страница загружается ему заново.
+"""
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from psycopg2.extensions import connection
+
+from elastic_components.errors import ELASTICSEARCH_UNAVAILABLE_ERRORS
+from etl_components.metrics import ROWS_SCANNED, STAGE_SECONDS, get_progress_log
+from etl_components.types import PipeLineType
+from etl_components.use_cases import get_page_end_checkpoint, get_saved_page_end, iter_target_batches, load_batch
+from lib.logger import logger
+from postgres_components.constants import MIN_UUID
+from postgres_components.pool import get_connection_pool
+from postgres_components.table_spec import AbstractPostgresTableSpec, KeysetCursor, normalize_keyset_cursors
+from storage.state import State
+from storage.use_cases import update_storage_data_in_pipeline_table
+
+# имя в метриках producer'а, который читает таблицу для всех подписчиков
+SHARED_SCAN_NAME = 'shared_scan'
+
+
+def get_table_subscribers(
+    pipelines: Sequence[PipeLineType],
+) -> List[Tuple[AbstractPostgresTableSpec, Tuple[PipeLineType, ...]]]:
+    """Таблицы пайплайнов и пайплайны, объявившие каждую из них в TARGET_TABLE_SPECS"""
+    subscribers: Dict[AbstractPostgresTableSpec, List[PipeLineType]] = {}
+    for pipeline in pipelines:
+        for table_spec in pipeline.TARGET_TABLE_SPECS:
+            subscribers.setdefault(table_spec, []).append(pipeline)
+
+    return [(table_spec, tuple(table_pipelines)) for table_spec, table_pipelines in subscribers.items()]
+
+
+def process_table_shared(
+    table_spec: AbstractPostgresTableSpec,
+    subscribers: Sequence[PipeLineType],
+    dsl: dict,
+    state: State,
+    batch_size: int,
+) -> int:
+    """
+    Читает изменения таблицы один раз и загружает их во все пайплайны-подписчики.
+    Возвращает число прочитанных страниц producer'а, 0 означает что изменений не было
+    """
+    table_name = table_spec.table_name
+    processed_pages = 0
+
+    with get_connection_pool(dsl).connection() as pg_conn:
+        table_states = {pipeline.PIPELINE_NAME: state[pipeline.PIPELINE_NAME][table_name] for pipeline in subscribers}
+        watermarks = dict(zip(
+            table_states,
+            normalize_keyset_cursors(pg_conn, [
+                KeysetCursor(modified=table_state['last_modified_dt'], id=table_state.get('last_row_id') or MIN_UUID)
+                for table_state in table_states.values()
+            ]),
+        ))
+        # прерванные на середине страницы подписчиков: позиция enricher'а и конец страницы, к которой она относится
+        enricher_last_ids = {
+            pipeline_name: table_state.get('enricher_last_id') or MIN_UUID
+            for pipeline_name, table_state in table_states.items()
+        }
+        page_ends = {
+            pipeline_name: get_saved_page_end(pg_conn, table_state)
+            for pipeline_name, table_state in table_states.items()
+        }
+        active = list(subscribers)
+
+        while active:
+            started = time.monotonic()
+            scan_cursor = min(watermarks[pipeline.PIPELINE_NAME] for pipeline in active)
+            # страница дочитывается не дальше ближайшего конца прерванной страницы, чтобы с ним можно было совпасть
+            until = min(
+                (page_ends[i.PIPELINE_NAME] for i in active
+                 if watermarks[i.PIPELINE_NAME] == scan_cursor and page_ends[i.PIPELINE_NAME]),
+                default=None,
+            )
+            modified_row_ids, next_cursor = table_spec.get_modified_row_ids(
+                pg_conn,
+                last_modified_dt=scan_cursor.modified,
+                last_row_id=scan_cursor.id,
+                limit=batch_size,
+                until=until,
+            )
+            STAGE_SECONDS.observe(time.monotonic() - started, pipeline=SHARED_SCAN_NAME, table=table_name, stage='producer')
+            ROWS_SCANNED.inc(len(modified_row_ids), pipeline=SHARED_SCAN_NAME, table=table_name)
+
+            if not modified_row_ids and until is None:
+                logger.debug(f'Table {table_name} has no more changes for {len(active)} subscribers')
+                break
+
+            if not modified_row_ids:
+                # строк прерванной страницы уже нет на прежних местах, подписчики просто переходят за ее конец
+                for pipeline in [i for i in active if watermarks[i.PIPELINE_NAME] < until]:
+                    _commit_page(pipeline.PIPELINE_NAME, state, table_name, until)
+                    watermarks[pipeline.PIPELINE_NAME] = until
+                    page_ends[pipeline.PIPELINE_NAME] = None
+                pg_conn.commit()
+                continue
+
+            for pipeline in [i for i in active if watermarks[i.PIPELINE_NAME] < next_cursor]:
+                pipeline_name = pipeline.PIPELINE_NAME
+                # позиция enricher'а относится к странице, начатой с позиции подписчика и закончившейся там же
+                resumed = watermarks[pipeline_name] == scan_cursor and page_ends[pipeline_name] == next_cursor
+                enricher_last_id = enricher_last_ids[pipeline_name] if resumed else MIN_UUID
+                page_ends[pipeline_name] = None
+                try:
+                    _deliver_page(
+                        pipeline,
+                        pg_conn,
+                        state,
+                        table_spec,
+                        modified_row_ids,
+                        enricher_last_id,
+                        next_cursor,
+                        batch_size,
+                    )
+                except ELASTICSEARCH_UNAVAILABLE_ERRORS as e:
+                    logger.warning(f'{pipeline_name} skips the rest of {table_name} scan: {e!r}')
+                    active.remove(pipeline)
+                    continue
+
+                watermarks[pipeline_name] = next_cursor
+
+            processed_pages += 1
+            # страница обработана всеми подписчиками, следующая начнется с нового снимка
+            pg_conn.commit()
+
+    for pipeline in subscribers:
+        get_progress_log().maybe_log(pipeline.PIPELINE_NAME, table_name, force=True)
+
+    return processed_pages
+
+
+def _deliver_page(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    state: State,
+    table_spec: AbstractPostgresTableSpec,
+    modified_row_ids: Tuple[str],
+    enricher_last_id: str,
+    next_cursor: KeysetCursor,
+    batch_size: int,
+):
+    """Загружает одну страницу producer'а в пайплайн и подтверждает ее в разделе состояния пайплайна"""
+    pipeline_name = pipeline.PIPELINE_NAME
+    table_name = table_spec.table_name
+
+    page_checkpoint = get_page_end_checkpoint(next_cursor)
+    for batch in iter_target_batches(pipeline, pg_conn, table_spec, modified_row_ids, enricher_last_id, batch_size):
+        load_batch(pipeline, pg_conn, table_name, batch.target_ids, partial=batch.partial)
+        update_storage_data_in_pipeline_table(
+            state,
+            pipline_name=pipeline_name,
+            table_name=table_name,
+            data={**batch.checkpoint, **page_checkpoint},
+        )
+
+    _commit_page(pipeline_name, state, table_name, next_cursor)
+
+
+def _commit_page(pipeline_name: str, state: State, table_name: str, next_cursor: KeysetCursor):
+    """Сдвигает курсор сканирования подписчика за конец обработанной страницы"""
+    last_modified_dt, last_row_id = next_cursor
+    update_storage_data_in_pipeline_table(
+        state,
+        pipline_name=pipeline_name,
+        table_name=table_name,
+        data={
+            'last_modified_dt': last_modified_dt.isoformat(),
+            'last_row_id': last_row_id,
+            'enricher_last_id': None,
+            **get_page_end_checkpoint(None),
+        },
+    )
@@ -0,0 +1,171 @@
+"""
+Здесь описан конвейерный (staged) режим выполнения пайплайна.
+
+Стадии producer/enricher -> merger/transform -> loader работают одновременно в своих потоках
+и связаны ограниченными очередями, поэтому чтение из postgres и запись в Elastic перекрываются,
+а быстрая стадия не убегает дальше чем на queue_size батчей (backpressure).
+Merger передает батч loader'у порциями документов (см. use_cases.iter_merged_chunks), поэтому
+очередь loader'а держит не больше queue_size порций, а не queue_size батчей целиком.
+Чекпоинты применяются только в стадии loader, строго в порядке батчей и после подтверждения загрузки.
+"""
+import queue
+import threading
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+from psycopg2.extensions import connection
+
+from etl_components.constants import ChangeSourceEnum
+from etl_components.types import PipeLineType
+from etl_components.use_cases import (get_load_chunk_size, iter_merged_chunks, iter_pipeline_batches, load_actions,
+                                      load_dimension_patch, merge_dimension_batch)
+from lib.logger import logger
+from postgres_components.pool import get_connection_pool
+from postgres_components.table_spec import AbstractPostgresTableSpec
+from storage.state import State
+from storage.use_cases import update_storage_data_in_pipeline_table
+
+# Маркер конца потока данных в очереди
+STOP = object()
+
+# Как часто стадии, ожидающие очередь, проверяют не упала ли соседняя стадия
+QUEUE_POLL_TIMEOUT = 0.5
+
+
+def _put(stage_queue: queue.Queue, item, stop_event: threading.Event) -> bool:
+    """Кладет элемент в очередь, пока не будет установлен stop_event. Возвращает False если стадию остановили"""
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=QUEUE_POLL_TIMEOUT)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def _iter_queue(stage_queue: queue.Queue, stop_event: threading.Event) -> Iterator:
+    """Читает элементы из очереди до маркера STOP или до остановки конвейера"""
+    while not stop_event.is_set():
+        try:
+            item = stage_queue.get(timeout=QUEUE_POLL_TIMEOUT)
+        except queue.Empty:
+            continue
+
+        if item is STOP:
+            return
+        yield item
+
+
+def _start_stage(name: str, target: Callable, errors: List[Exception], stop_event: threading.Event):
+    """Запускает стадию в отдельном потоке. Ошибка стадии останавливает весь конвейер"""
+    def runner():
+        try:
+            target()
+        except Exception as e:  # ошибку пробросит поток, ожидающий конвейер
+            logger.exception(f'Stage {name} failed')
+            errors.append(e)
+            stop_event.set()
+
+    thread = threading.Thread(target=runner, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def process_pipeline_staged(
+    pipeline: PipeLineType,
+    dsl: dict,
+    state: State,
+    batch_size: int,
+    queue_size: int,
+    change_source: ChangeSourceEnum = ChangeSourceEnum.SCAN,
+    table_specs: Optional[Sequence[AbstractPostgresTableSpec]] = None,
+) -> Dict[str, int]:
+    """
+    Аналог process_pipeline, в котором стадии выполняются одновременно.
+    Producer и merger используют отдельные соединения с postgres, loader работает в вызывающем потоке.
+    Оба соединения берутся из пула сразу, чтобы producer'ы нескольких пайплайнов не заняли весь пул,
+    оставив своих merger'ов ждать соединения, пока сами ждут место в очереди.
+    Поэтому с DB_SNAPSHOT_BATCHES в одном снимке читается страница producer'а или батч merger'а, но не обе стадии вместе.
+    Возвращает число обработанных батчей по каждой таблице
+    """
+    table_specs = table_specs or pipeline.TARGET_TABLE_SPECS
+    processed_batches = {table_spec.table_name: 0 for table_spec in table_specs}
+    pipeline_name = pipeline.PIPELINE_NAME
+    ids_queue = queue.Queue(maxsize=queue_size)
+    load_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors = []
+    # состояние читается до старта стадий: дальше его пишет только loader
+    pipeline_state = state[pipeline_name]
+
+    def produce(pg_conn: connection):
+        for table_spec in table_specs:
+            batches = iter_pipeline_batches(
+                pipeline,
+                pg_conn,
+                table_spec,
+                table_state=pipeline_state[table_spec.table_name],
+                batch_size=batch_size,
+                change_source=change_source,
+            )
+            for batch in batches:
+                if not batch.target_ids:
+                    pg_conn.commit()
+                if not _put(ids_queue, batch, stop_event):
+                    return
+
+        _put(ids_queue, STOP, stop_event)
+
+    def merge(pg_conn: connection):
+        for batch in _iter_queue(ids_queue, stop_event):
+            if batch.partial:
+                # для частичного обновления вместо actions передаются новые имена строк справочника
+                chunks = [merge_dimension_batch(pipeline, pg_conn, batch.table_name, batch.target_ids)]
+            elif batch.target_ids:
+                chunks = iter_merged_chunks(pipeline, pg_conn, batch.table_name, batch.target_ids, get_load_chunk_size())
+            else:
+                chunks = []
+
+            # батч уходит в loader порциями, чекпоинт несет только последний элемент (actions is None)
+            for actions in chunks:
+                if not _put(load_queue, (batch, actions), stop_event):
+                    return
+            pg_conn.commit()
+
+            if not _put(load_queue, (batch, None), stop_event):
+                return
+
+        _put(load_queue, STOP, stop_event)
+
+    with get_connection_pool(dsl).connections(2) as (producer_conn, merger_conn):
+        threads = [
+            _start_stage(f'{pipeline_name}-producer', partial(produce, producer_conn), errors, stop_event),
+            _start_stage(f'{pipeline_name}-merger', partial(merge, merger_conn), errors, stop_event),
+        ]
+
+        try:
+            for batch, actions in _iter_queue(load_queue, stop_event):
+                if actions is not None:
+                    if batch.partial:
+                        load_dimension_patch(pipeline, batch.table_name, actions)
+                    else:
+                        load_actions(pipeline, batch.table_name, actions)
+                    continue
+
+                update_storage_data_in_pipeline_table(
+                    state,
+                    pipline_name=pipeline_name,
+                    table_name=batch.table_name,
+                    data=batch.checkpoint
+                )
+                processed_batches[batch.table_name] += 1
+        finally:
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return processed_batches
@@ -1,4 +1,4 @@
-from typing import Type, Union
+from typing import NamedTuple, Tuple, Type, Union
 
 from etl_components.etl_process import EtlFilmWorkProcess, EtlGenreProcess, EtlPersonProcess
 
@@ -9,3 +9,16 @@ PipeLineType = Type[
         EtlGenreProcess
     ]
 ]
+
+
+class PipelineBatch(NamedTuple):
+    """
+    Единица работы пайплайна: идентификаторы для загрузки в Elastic
+    и данные чекпоинта, которые можно сохранить только после успешной загрузки
+    """
+
+    table_name: str
+    target_ids: Tuple[str]
+    checkpoint: dict
+    # target_ids - идентификаторы строк справочника, документы обновляются частично (см. partial_updates)
+    partial: bool = False
@@ -1,96 +1,644 @@
-from datetime import datetime
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
-import psycopg2
-from psycopg2.extras import DictCursor
+from elasticsearch import ApiError, TransportError
+from psycopg2.extensions import connection
+from settings import settings
 
-from etl_components.types import PipeLineType
+from elastic_components.errors import (ElasticsearchUnavailableError, get_item_result, is_retryable_error,
+                                       is_retryable_item)
+from elastic_components.loader import get_action_id, get_action_source, get_elasticsearch_loader
+from etl_components.batching import estimate_payload_bytes, get_batch_size_controller, is_rejected_by_elasticsearch
+from etl_components.constants import BatchStageEnum, ChangeSourceEnum
+from etl_components.fingerprints import drop_unchanged, get_fingerprint_store
+from etl_components.metrics import (BULK_ERRORS, BYTES_SENT, DOCUMENTS_FAILED, DOCUMENTS_LOADED, DOCUMENTS_MERGED,
+                                    DOCUMENTS_PATCHED, DOCUMENTS_UNCHANGED, IDS_ENRICHED, ROWS_SCANNED, STAGE_SECONDS,
+                                    get_progress_log)
+from etl_components.partial_updates import apply_dimension_patch, fetch_dimension_names, iter_patched_doc_ids
+from etl_components.types import PipelineBatch, PipeLineType
 from lib.logger import logger
+from lib.utils import jittered_delay
+from postgres_components.constants import MIN_UUID
+from postgres_components.pool import get_connection_pool
+from postgres_components.table_spec import AbstractPostgresTableSpec, KeysetCursor, normalize_keyset_cursors
 from storage.state import State
-from storage.use_cases import update_storage_data_in_pipeline_table
+from storage.use_cases import get_dead_letter_file, update_storage_data_in_pipeline_table
 
 
-def process_pipeline(
+def current_batch_size(pipeline: PipeLineType, table_name: str, stage: BatchStageEnum, batch_size: int) -> int:
+    """Размер батча стадии: подобранный адаптивно, если ADAPTIVE_BATCHING включен, иначе batch_size"""
+    controller = get_batch_size_controller()
+    if not controller.enabled:
+        return batch_size
+
+    return controller.size(pipeline.PIPELINE_NAME, table_name, stage)
+
+
+def get_saved_page_end(pg_conn: connection, table_state: dict) -> Optional[KeysetCursor]:
+    """Конец страницы producer'а, обработка которой прервалась на середине, или None"""
+    if not table_state.get('enricher_last_id') or not table_state.get('enricher_page_end_id'):
+        return None
+
+    saved = KeysetCursor(modified=table_state['enricher_page_end_dt'], id=table_state['enricher_page_end_id'])
+    return normalize_keyset_cursors(pg_conn, [saved])[0]
+
+
+def get_page_end_checkpoint(page_end: Optional[KeysetCursor]) -> dict:
+    """Чекпоинт конца страницы producer'а, к которой относится enricher_last_id"""
+    if page_end is None:
+        return {'enricher_page_end_dt': None, 'enricher_page_end_id': None}
+
+    return {'enricher_page_end_dt': page_end.modified.isoformat(), 'enricher_page_end_id': page_end.id}
+
+
+def iter_enricher_batches(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_spec: AbstractPostgresTableSpec,
+    modified_row_ids: Tuple[str],
+    enricher_last_id: str,
+    batch_size: int,
+) -> Iterator[PipelineBatch]:
+    """
+    Постранично (keyset по id) обогащает одну страницу producer'а.
+    Каждый батч несет чекпоинт enricher_last_id, чтобы после падения продолжить с той же страницы.
+    Со стратегией temp_table затронутые документы находятся один раз, а страницы читаются из результата
+    """
+    pipeline_name = pipeline.PIPELINE_NAME
+    table_name = table_spec.table_name
+
+    started = time.monotonic()
+    resolved = pipeline.postgres_resolve_affected_ids(pg_conn, table_spec, modified_row_ids)
+    STAGE_SECONDS.observe(time.monotonic() - started, pipeline=pipeline_name, table=table_name, stage='enricher')
+
+    while True:
+        started = time.monotonic()
+        batch_limit = current_batch_size(pipeline, table_name, BatchStageEnum.ENRICHER, batch_size)
+        if resolved:
+            target_ids = pipeline.postgres_resolved_enricher(pg_conn, batch_limit=batch_limit, last_id=enricher_last_id)
+        else:
+            target_ids = pipeline.postgres_enricher(
+                pg_conn,
+                table_spec,
+                modified_row_ids,
+                batch_limit=batch_limit,
+                last_id=enricher_last_id,
+            )
+        STAGE_SECONDS.observe(time.monotonic() - started, pipeline=pipeline_name, table=table_name, stage='enricher')
+        IDS_ENRICHED.inc(len(target_ids), pipeline=pipeline_name, table=table_name)
+
+        if not target_ids:
+            return
+
+        enricher_last_id = target_ids[-1]
+        yield PipelineBatch(
+            table_name=table_name,
+            target_ids=target_ids,
+            checkpoint={'enricher_last_id': enricher_last_id},
+        )
+
+
+def iter_target_batches(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_spec: AbstractPostgresTableSpec,
+    modified_row_ids: Tuple[str],
+    enricher_last_id: str,
+    batch_size: int,
+) -> Iterator[PipelineBatch]:
+    """
+    Батчи одной страницы producer'а. Если изменения таблицы можно применить частичным обновлением,
+    страница целиком отдается одним батчем с идентификаторами строк справочника, иначе обогащается
+    """
+    if pipeline.get_dimension_patch(table_spec.table_name) is None:
+        yield from iter_enricher_batches(pipeline, pg_conn, table_spec, modified_row_ids, enricher_last_id, batch_size)
+        return
+
+    yield PipelineBatch(
+        table_name=table_spec.table_name,
+        target_ids=tuple(modified_row_ids),
+        checkpoint={'enricher_last_id': None},
+        partial=True,
+    )
+
+
+def iter_pipeline_batches(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_spec: AbstractPostgresTableSpec,
+    table_state: dict,
+    batch_size: int,
+    change_source: ChangeSourceEnum = ChangeSourceEnum.SCAN,
+) -> Iterator[PipelineBatch]:
+    """
+    Генератор батчей для одной таблицы пайплайна.
+    Курсоры ведутся локально, поэтому генератор может убегать вперед сохраненного состояния:
+    применять чекпоинты батчей нужно в порядке их выдачи и только после загрузки в Elastic.
+    После полностью обработанной страницы producer'а отдается батч без идентификаторов,
+    который сдвигает курсор producer'а таблицы: (last_modified_dt, last_row_id) при сканировании
+    или changelog_last_id при чтении журнала изменений.
+
+    Батчи enricher'а сохраняют и конец своей страницы producer'а. Прерванная на середине страница
+    перечитывается ровно до него: размер страницы мог с тех пор измениться (ADAPTIVE_BATCHING, BATCH_SIZE),
+    а enricher_last_id имеет смысл только для того же набора строк. Иначе документы с id не больше
+    enricher_last_id, связанные с добавившимися строками, были бы пропущены
+    """
+    if change_source is ChangeSourceEnum.CHANGELOG:
+        yield from _iter_changelog_batches(pipeline, pg_conn, table_spec, table_state, batch_size)
+        return
+
+    pipeline_name = pipeline.PIPELINE_NAME
+    table_name = table_spec.table_name
+    last_modified_dt = table_state['last_modified_dt']
+    last_row_id = table_state.get('last_row_id') or MIN_UUID
+    page_end = get_saved_page_end(pg_conn, table_state)
+    # без сохраненного конца страницы (состояние старой версии) страница обрабатывается заново
+    enricher_last_id = table_state['enricher_last_id'] if page_end else MIN_UUID
+
+    while True:
+        producer_batch_size = current_batch_size(pipeline, table_name, BatchStageEnum.PRODUCER, batch_size)
+        started = time.monotonic()
+        modified_row_ids, next_cursor = pipeline.postgres_producer(
+            pg_conn,
+            table_spec,
+            last_modified_dt=last_modified_dt,
+            last_row_id=last_row_id,
+            batch_limit=producer_batch_size,
+            until=page_end,
+        )
+        _observe_producer(pipeline, table_name, time.monotonic() - started, len(modified_row_ids))
+
+        if modified_row_ids:
+            page_checkpoint = get_page_end_checkpoint(next_cursor)
+            for batch in iter_target_batches(
+                pipeline, pg_conn, table_spec, modified_row_ids, enricher_last_id, batch_size
+            ):
+                yield batch._replace(checkpoint={**batch.checkpoint, **page_checkpoint})
+        elif page_end is not None:
+            # строки прерванной страницы с тех пор изменились, их прочитают следующие страницы
+            next_cursor = page_end
+        else:
+            logger.debug(f'Table {table_name} of {pipeline_name} has no more changes')
+            get_progress_log().maybe_log(pipeline_name, table_name, force=True)
+            return
+
+        last_modified_dt, last_row_id = next_cursor
+        enricher_last_id = MIN_UUID
+        page_end = None
+        yield PipelineBatch(
+            table_name=table_name,
+            target_ids=(),
+            checkpoint={
+                'last_modified_dt': last_modified_dt.isoformat(),
+                'last_row_id': last_row_id,
+                'enricher_last_id': None,
+                **get_page_end_checkpoint(None),
+            },
+        )
+
+
+def _observe_producer(pipeline: PipeLineType, table_name: str, seconds: float, rows: int):
+    """Учитывает одну страницу producer'а в метриках и в размере батча"""
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline.PIPELINE_NAME, table=table_name, stage='producer')
+    ROWS_SCANNED.inc(rows, pipeline=pipeline.PIPELINE_NAME, table=table_name)
+    get_batch_size_controller().observe(
+        pipeline.PIPELINE_NAME,
+        table_name,
+        BatchStageEnum.PRODUCER,
+        seconds=seconds,
+        items=rows,
+    )
+
+
+def _iter_changelog_batches(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_spec: AbstractPostgresTableSpec,
+    table_state: dict,
+    batch_size: int,
+) -> Iterator[PipelineBatch]:
+    """
+    То же, что iter_pipeline_batches, но изменившиеся записи берутся из журнала etl_changelog.
+    Курсор enricher'а и конец его страницы хранятся отдельно от сканирования, чтобы режимы не путали позиции друг друга.
+
+    Курсор changelog_last_id не видит записи транзакций, которые взяли меньший id, но закоммитились позже
+    уже прочитанных. Их id остаются пропусками страницы и хранятся в changelog_gap_ids: в начале каждого цикла
+    появившиеся в пропусках записи обрабатываются отдельной страницей. Такая транзакция подхватывается циклом,
+    который разбудило ее же уведомление, если к ее коммиту курсор ушел вперед меньше чем на CHANGE_CAPTURE_GAP_WINDOW
+    id журнала, иначе - сканированием по modified не позже чем через CHANGE_CAPTURE_CATCHUP_INTERVAL
+    """
+    table_name = table_spec.table_name
+    gap_window = settings.CHANGE_CAPTURE_GAP_WINDOW
+    last_change_id = table_state.get('changelog_last_id') or 0
+    gap_ids = table_state.get('changelog_gap_ids') or []
+    enricher_last_id = table_state.get('changelog_enricher_last_id')
+    page_end_id = table_state.get('changelog_page_end_id') if enricher_last_id else None
+    # без сохраненного конца страницы (состояние старой версии) страница обрабатывается заново
+    enricher_last_id = enricher_last_id if page_end_id else MIN_UUID
+
+    if gap_ids:
+        late_row_ids, filled_gap_ids = table_spec.get_changelog_gap_row_ids(pg_conn, gap_ids)
+        if late_row_ids:
+            # позиция страницы журнала не меняется: прерванная обработка поздних записей повторится целиком
+            for batch in iter_target_batches(pipeline, pg_conn, table_spec, late_row_ids, MIN_UUID, batch_size):
+                yield batch._replace(checkpoint={})
+        if filled_gap_ids:
+            filled_gap_ids = set(filled_gap_ids)
+            gap_ids = [i for i in gap_ids if i not in filled_gap_ids]
+            yield PipelineBatch(table_name=table_name, target_ids=(), checkpoint={'changelog_gap_ids': gap_ids})
+
+    while True:
+        producer_batch_size = current_batch_size(pipeline, table_name, BatchStageEnum.PRODUCER, batch_size)
+        started = time.monotonic()
+        modified_row_ids, next_change_id, page_gap_ids = table_spec.get_changelog_row_ids(
+            pg_conn,
+            last_change_id=last_change_id,
+            limit=producer_batch_size,
+            until_change_id=page_end_id,
+            gap_window=gap_window,
+        )
+        _observe_producer(pipeline, table_name, time.monotonic() - started, len(modified_row_ids))
+
+        if modified_row_ids:
+            for batch in iter_target_batches(
+                pipeline, pg_conn, table_spec, modified_row_ids, enricher_last_id, batch_size
+            ):
+                yield batch._replace(checkpoint={
+                    'changelog_enricher_last_id': batch.checkpoint['enricher_last_id'],
+                    'changelog_page_end_id': next_change_id,
+                })
+        elif page_end_id is not None:
+            # записи прерванной страницы успели удалить из журнала, их изменения подхватит сканирование по modified
+            next_change_id = page_end_id
+        else:
+            get_progress_log().maybe_log(pipeline.PIPELINE_NAME, table_name, force=True)
+            return
+
+        last_change_id = next_change_id
+        # пропуски дальше gap_window от курсора больше не перепроверяются (в том числе id откаченных транзакций)
+        gap_ids = [i for i in gap_ids if i > last_change_id - gap_window] + list(page_gap_ids)
+        enricher_last_id = MIN_UUID
+        page_end_id = None
+        yield PipelineBatch(
+            table_name=table_name,
+            target_ids=(),
+            checkpoint={
+                'changelog_last_id': last_change_id,
+                'changelog_gap_ids': gap_ids,
+                'changelog_enricher_last_id': None,
+                'changelog_page_end_id': None,
+            },
+        )
+
+
+def get_load_chunk_size() -> int:
+    """
+    Сколько документов мержится и отправляется за раз при загрузке батча порциями:
+    несколько bulk запросов, чтобы parallel_bulk было что отправлять одновременно
+    """
+    return settings.ES_BULK_CHUNK_SIZE * settings.ES_BULK_MAX_IN_FLIGHT
+
+
+def iter_merged_chunks(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_name: str,
+    target_ids: Tuple[str],
+    chunk_size: Optional[int] = None,
+    index_name: Optional[str] = None,
+) -> Iterator[list]:
+    """
+    Мержит и трансформирует один батч идентификаторов порциями до chunk_size документов (None - одной порцией).
+    Со стратегией merger'а streaming документы собираются по мере чтения строк, поэтому в памяти
+    держится одна порция документов, а не весь батч. Генератор нужно дочитать до commit соединения.
+    Время мержа без времени обработки порций учитывается в размере батча enricher'а.
+    index_name позволяет писать не в INDEX_NAME пайплайна (например в новый индекс при переиндексации)
+    """
+    seconds = 0
+    started = time.monotonic()
+    documents = iter(pipeline.postgres_merger(pg_conn, target_ids))
+
+    while True:
+        chunk = list(islice(documents, chunk_size))
+        actions = pipeline.transform(chunk, index_name or pipeline.INDEX_NAME) if chunk else []
+        seconds += time.monotonic() - started
+        if not actions:
+            break
+
+        DOCUMENTS_MERGED.inc(len(actions), pipeline=pipeline.PIPELINE_NAME, table=table_name)
+        yield actions
+        started = time.monotonic()
+
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline.PIPELINE_NAME, table=table_name, stage='merger')
+    get_batch_size_controller().observe(
+        pipeline.PIPELINE_NAME,
+        table_name,
+        BatchStageEnum.ENRICHER,
+        seconds=seconds,
+        items=len(target_ids),
+    )
+
+
+def merge_batch(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_name: str,
+    target_ids: Tuple[str],
+    index_name: Optional[str] = None,
+) -> List[dict]:
+    """Мержит и трансформирует один батч идентификаторов целиком, см. iter_merged_chunks"""
+    return [
+        action
+        for actions in iter_merged_chunks(pipeline, pg_conn, table_name, target_ids, index_name=index_name)
+        for action in actions
+    ]
+
+
+def load_actions(pipeline: PipeLineType, table_name: str, actions: List[dict], skip_unchanged: bool = True):
+    """
+    Отправляет actions в Elastic. Если включены FINGERPRINTS_ENABLED, документы, не изменившиеся
+    с прошлой загрузки, не отправляются, а отпечатки проиндексированных сохраняются после загрузки
+    :param skip_unchanged: False - отправить все документы, но отпечатки все равно сохранить
+    """
+    if not settings.FINGERPRINTS_ENABLED:
+        _send_actions(pipeline, table_name, actions)
+        return
+
+    store = get_fingerprint_store()
+    changed_actions, fingerprints = drop_unchanged(store, pipeline.INDEX_NAME, actions, skip_unchanged)
+    DOCUMENTS_UNCHANGED.inc(len(actions) - len(changed_actions), pipeline=pipeline.PIPELINE_NAME, table=table_name)
+
+    if changed_actions:
+        failed_ids = _send_actions(pipeline, table_name, changed_actions)
+        # у документов из dead letter в Elastic осталась прошлая версия, как и ее отпечаток
+        store.put_many(
+            pipeline.INDEX_NAME,
+            {doc_id: value for doc_id, value in fingerprints.items() if doc_id not in failed_ids},
+        )
+
+
+def _send_actions(pipeline: PipeLineType, table_name: str, actions: List[dict]) -> Set[str]:
+    """
+    Отправляет actions в Elastic чанками адаптивного размера и возвращает id документов, записанных в dead letter.
+    Документы, не принятые из-за временной проблемы Elastic (перегрузка, недоступность, таймаут), отправляются
+    повторно после случайной паузы. С ADAPTIVE_BATCHING при 429 повтор идет еще и меньшими батчами,
+    без него размер батча не меняется. Документы с постоянной ошибкой
+    пишутся в dead letter, чтобы один плохой документ не останавливал пайплайн и не заставлял повторять батч.
+    Если повторы закончились, поднимается ElasticsearchUnavailableError и чекпоинт батча не сдвигается
+    """
+    pipeline_name = pipeline.PIPELINE_NAME
+    controller = get_batch_size_controller()
+    pending = actions
+    failed_ids = set()
+
+    for attempt in range(settings.ES_REJECTION_RETRIES + 1):
+        if attempt:
+            time.sleep(jittered_delay(attempt - 1, settings.ES_RETRY_BACKOFF_START, settings.ES_RETRY_BACKOFF_MAX))
+
+        chunk_size = current_batch_size(pipeline, table_name, BatchStageEnum.LOADER, settings.ES_BULK_CHUNK_SIZE)
+        payload_bytes = estimate_payload_bytes(pending)
+        started = time.monotonic()
+        try:
+            result = pipeline.elasticsearch_loader(pending, chunk_size=chunk_size)
+        except (ApiError, TransportError) as e:
+            if not is_retryable_error(e):
+                BULK_ERRORS.inc(pipeline=pipeline_name, table=table_name, reason='error')
+                raise
+
+            rejected = is_rejected_by_elasticsearch(e)
+            BULK_ERRORS.inc(pipeline=pipeline_name, table=table_name, reason='rejected' if rejected else 'unavailable')
+            if rejected:
+                controller.reject(pipeline_name, table_name)
+            logger.warning(f'Bulk for {pipeline_name}.{table_name} failed: {e!r}, attempt {attempt + 1}')
+            continue
+
+        seconds = time.monotonic() - started
+        STAGE_SECONDS.observe(seconds, pipeline=pipeline_name, table=table_name, stage='loader')
+        DOCUMENTS_LOADED.inc(result.success, pipeline=pipeline_name, table=table_name)
+        BYTES_SENT.inc(payload_bytes, pipeline=pipeline_name, table=table_name)
+        get_progress_log().maybe_log(pipeline_name, table_name)
+
+        if controller.enabled and pending:
+            chunks = math.ceil(len(pending) / chunk_size)
+            controller.observe(
+                pipeline_name,
+                table_name,
+                BatchStageEnum.LOADER,
+                seconds=seconds / chunks,
+                items=min(len(pending), chunk_size),
+                payload_bytes=payload_bytes // chunks,
+            )
+
+        retry_items = [item for item in result.failed if is_retryable_item(item)]
+        dead_items = [item for item in result.failed if not is_retryable_item(item)]
+        if dead_items:
+            failed_ids.update(_write_dead_letter(pipeline, table_name, pending, dead_items))
+        if not retry_items:
+            return failed_ids
+
+        rejected = any(get_item_result(item).get('status') == 429 for item in retry_items)
+        BULK_ERRORS.inc(pipeline=pipeline_name, table=table_name, reason='rejected' if rejected else 'unavailable')
+        if rejected:
+            # без ADAPTIVE_BATCHING размер батча не меняется, документы просто повторяются после паузы
+            controller.reject(pipeline_name, table_name)
+
+        retry_ids = {str(get_item_result(item).get('_id')) for item in retry_items}
+        pending = [action for action in pending if get_action_id(action) in retry_ids]
+        logger.warning(f'{len(pending)} documents of {pipeline_name}.{table_name} were not accepted, attempt {attempt + 1}')
+
+    raise ElasticsearchUnavailableError(
+        f'Elastic did not accept {len(pending)} documents of {pipeline_name}.{table_name} '
+        f'after {settings.ES_REJECTION_RETRIES} retries'
+    )
+
+
+def _write_dead_letter(pipeline: PipeLineType, table_name: str, actions: List[dict], failed_items: List[dict]) -> Set[str]:
+    """Пишет документы, отклоненные Elastic без шансов на повтор, в dead letter и возвращает их id"""
+    results = {str(get_item_result(item).get('_id')): get_item_result(item) for item in failed_items}
+    records = []
+    for action in actions:
+        result = results.get(get_action_id(action))
+        if result is None:
+            continue
+
+        records.append({
+            'pipeline': pipeline.PIPELINE_NAME,
+            'table': table_name,
+            'index': result.get('_index'),
+            'id': get_action_id(action),
+            'status': result.get('status'),
+            'error': result.get('error'),
+            'document': get_action_source(action),
+        })
+
+    dead_letter = get_dead_letter_file()
+    dead_letter.write(records)
+    DOCUMENTS_FAILED.inc(len(records), pipeline=pipeline.PIPELINE_NAME, table=table_name)
+    logger.error(
+        f'{len(records)} documents of {pipeline.PIPELINE_NAME}.{table_name} were rejected by Elastic, '
+        f'see {dead_letter.file_path}'
+    )
+    return set(results)
+
+
+def merge_dimension_batch(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_name: str,
+    row_ids: Tuple[str],
+) -> Dict[str, str]:
+    """Читает актуальные имена изменившихся строк справочника для частичного обновления документов"""
+    started = time.monotonic()
+    names = fetch_dimension_names(pg_conn, pipeline.get_dimension_patch(table_name), row_ids)
+    STAGE_SECONDS.observe(time.monotonic() - started, pipeline=pipeline.PIPELINE_NAME, table=table_name, stage='merger')
+
+    return names
+
+
+def load_dimension_patch(pipeline: PipeLineType, table_name: str, names: Dict[str, str]):
+    """
+    Проставляет новые имена строк справочника во все документы индекса пайплайна, которые на них ссылаются.
+    Документы, которые Elastic обновить не смог, пишутся в dead letter
+    """
+    if not names:
+        return
+
+    started = time.monotonic()
+    client = get_elasticsearch_loader().client
+    patch = pipeline.get_dimension_patch(table_name)
+
+    if settings.FINGERPRINTS_ENABLED:
+        # до обновления: если оно прервется, лишние отпечатки удалены, а не устарели
+        get_fingerprint_store().delete_many(
+            pipeline.INDEX_NAME,
+            list(iter_patched_doc_ids(client, pipeline.INDEX_NAME, patch, list(names))),
+        )
+
+    patched, failures = apply_dimension_patch(client, pipeline.INDEX_NAME, patch, names)
+
+    STAGE_SECONDS.observe(time.monotonic() - started, pipeline=pipeline.PIPELINE_NAME, table=table_name, stage='loader')
+    DOCUMENTS_PATCHED.inc(patched, pipeline=pipeline.PIPELINE_NAME, table=table_name)
+    if failures:
+        _write_patch_dead_letter(pipeline, table_name, names, failures)
+    get_progress_log().maybe_log(pipeline.PIPELINE_NAME, table_name)
+
+
+def _write_patch_dead_letter(pipeline: PipeLineType, table_name: str, names: Dict[str, str], failures: List[dict]):
+    """Пишет документы, которые update_by_query не смог обновить, в dead letter вместе с новыми именами"""
+    dead_letter = get_dead_letter_file()
+    dead_letter.write(
+        {
+            'pipeline': pipeline.PIPELINE_NAME,
+            'table': table_name,
+            'index': failure.get('index'),
+            'id': failure.get('id'),
+            'status': failure.get('status'),
+            'error': failure.get('cause'),
+            'patch': names,
+        }
+        for failure in failures
+    )
+    DOCUMENTS_FAILED.inc(len(failures), pipeline=pipeline.PIPELINE_NAME, table=table_name)
+    logger.error(
+        f'{len(failures)} documents of {pipeline.PIPELINE_NAME}.{table_name} could not be patched, '
+        f'see {dead_letter.file_path}'
+    )
+
+
+def load_batch(
+    pipeline: PipeLineType,
+    pg_conn: connection,
+    table_name: str,
+    target_ids: Tuple[str],
+    partial: bool = False,
+):
+    """
+    Мержит, трансформирует и отправляет в Elastic один батч идентификаторов порциями (см. iter_merged_chunks).
+    partial - target_ids это строки справочника, документы обновляются частично
+    """
+    if partial:
+        load_dimension_patch(pipeline, table_name, merge_dimension_batch(pipeline, pg_conn, table_name, target_ids))
+        return
+
+    for actions in iter_merged_chunks(pipeline, pg_conn, table_name, target_ids, get_load_chunk_size()):
+        load_actions(pipeline, table_name, actions)
+
+
+def process_table(
     pipeline: PipeLineType,
     dsl: dict,
     state: State,
-    batch_size
-):
+    table_spec: AbstractPostgresTableSpec,
+    batch_size: int,
+    change_source: ChangeSourceEnum = ChangeSourceEnum.SCAN,
+) -> int:
+    """
+    Загружает в Elastic все изменения одной таблицы пайплайна через соединение из пула.
+    Каждая страница producer'а читается в своей транзакции (см. DB_SNAPSHOT_BATCHES).
+    Возвращает число обработанных батчей, 0 означает что изменений не было
+    """
     pipeline_name = pipeline.PIPELINE_NAME
+    processed_batches = 0
 
-    for table_spec in pipeline.TARGET_TABLE_SPECS:
-        with psycopg2.connect(**dsl, cursor_factory=DictCursor) as pg_conn:
-            while True:
-                current_table_name = table_spec.table_name
-                logger.info(f'Current table: {current_table_name}')
-
-                modified_row_ids = pipeline.postgres_producer(
-                    pg_conn,
-                    table_spec,
-                    last_modified_dt=state[pipeline_name][current_table_name]['last_modified_dt'],
-                    batch_limit=batch_size,
-                    batch_offset=state[pipeline_name][current_table_name]['producer_offset']
-                )
-                logger.info(f'modified_row_ids: {modified_row_ids}')
-
-                if not modified_row_ids:
-                    logger.info(f'Table {current_table_name} has been loaded to elastic')
-
-                    update_storage_data_in_pipeline_table(
-                        state,
-                        pipline_name=pipeline_name,
-                        table_name=current_table_name,
-                        data={
-                            'last_modified_dt': datetime.now().isoformat(),
-                            'producer_offset': 0
-                        }
-                    )
-                    break
-
-                while True:
-                    film_work_ids = pipeline.postgres_enricher(
-                        pg_conn,
-                        table_spec,
-                        modified_row_ids,
-                        batch_limit=batch_size,
-                        batch_offset=state[pipeline_name][current_table_name]['enricher_offset']
-                    )
-                    logger.info(f'film_work_ids: {film_work_ids}')
-
-                    if not film_work_ids:
-                        update_storage_data_in_pipeline_table(
-                            state,
-                            pipline_name=pipeline_name,
-                            table_name=current_table_name,
-                            data={'enricher_offset': 0}
-                        )
-                        break
-
-                    merged_data = pipeline.postgres_merger(pg_conn, film_work_ids)
-                    transformed_data = pipeline.transform(merged_data, pipeline.INDEX_NAME)
-                    pipeline.elasticsearch_loader(transformed_data)
-
-                    update_storage_data_in_pipeline_table(
-                        state,
-                        pipline_name=pipeline_name,
-                        table_name=current_table_name,
-                        data={
-                            'enricher_offset': state[pipeline_name][current_table_name]['enricher_offset'] + batch_size
-                        }
-                    )
-                    continue
-
-                update_storage_data_in_pipeline_table(
-                    state,
-                    pipline_name=pipeline_name,
-                    table_name=current_table_name,
-                    data={
-                        'producer_offset': state[pipeline_name][current_table_name]['producer_offset'] + batch_size
-                    }
-                )
-
-        update_storage_data_in_pipeline_table(
-            state,
-            pipline_name=pipeline_name,
-            table_name=current_table_name,
-            data={'producer_offset': 0}
+    with get_connection_pool(dsl).connection() as pg_conn:
+        batches = iter_pipeline_batches(
+            pipeline,
+            pg_conn,
+            table_spec,
+            table_state=state[pipeline_name][table_spec.table_name],
+            batch_size=batch_size,
+            change_source=change_source,
         )
+        for batch in batches:
+            if batch.target_ids:
+                load_batch(pipeline, pg_conn, batch.table_name, batch.target_ids, partial=batch.partial)
+
+            update_storage_data_in_pipeline_table(
+                state,
+                pipline_name=pipeline_name,
+                table_name=batch.table_name,
+                data=batch.checkpoint
+            )
+            processed_batches += 1
+
+            if not batch.target_ids:
+                # страница producer'а обработана целиком, следующая начнется с нового снимка
+                pg_conn.commit()
+
+    return processed_batches
+
+
+def process_pipeline(
+    pipeline: PipeLineType,
+    dsl: dict,
+    state: State,
+    batch_size,
+    concurrency: int = 1,
+    change_source: ChangeSourceEnum = ChangeSourceEnum.SCAN,
+    table_specs: Optional[Sequence[AbstractPostgresTableSpec]] = None,
+) -> Dict[str, int]:
+    """
+    Загружает изменения таблиц пайплайна (по умолчанию всех из TARGET_TABLE_SPECS).
+    concurrency ограничивает число таблиц пайплайна, обрабатываемых одновременно:
+    у каждой таблицы свой раздел состояния и свое соединение, поэтому они не мешают друг другу.
+    Возвращает число обработанных батчей по каждой таблице
+    """
+    table_specs = table_specs or pipeline.TARGET_TABLE_SPECS
+
+    if concurrency <= 1:
+        return {
+            table_spec.table_name: process_table(pipeline, dsl, state, table_spec, batch_size, change_source)
+            for table_spec in table_specs
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=pipeline.PIPELINE_NAME) as executor:
+        futures = {
+            table_spec.table_name: executor.submit(
+                process_table, pipeline, dsl, state, table_spec, batch_size, change_source
+            )
+            for table_spec in table_specs
+        }
+        return {table_name: future.result() for table_name, future in futures.items()}
@@ -1,3 +1,4 @@
+import random
 import time
 from functools import wraps
 from typing import Tuple, Type, Union
@@ -47,3 +48,11 @@ def backoff(
         return inner
 
     return func_wrapper
+
+
+def jittered_delay(attempt: int, start_sleep_time: float = 0.5, border_sleep_time: float = 30) -> float:
+    """
+    Пауза перед повтором номер attempt (с нуля): случайная в пределах [0, min(start_sleep_time * 2^attempt, border)].
+    Случайность не дает потокам и процессам, упершимся в одну перегрузку, повторять запросы одновременно
+    """
+    return random.uniform(0, min(start_sleep_time * 2 ** attempt, border_sleep_time))
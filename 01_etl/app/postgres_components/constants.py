@@ -7,3 +7,8 @@ class PersonRoleEnum(Enum):
     ACTOR = 'actor'
     DIRECTOR = 'director'
     WRITER = 'writer'
+
+
+# Минимально возможный uuid. Используется как начальное значение keyset-курсора,
+# чтобы условие (modified, id) > (%s, %s) работало и при первом запуске
+MIN_UUID = '00000000-0000-0000-0000-000000000000'
@@ -0,0 +1,52 @@
+"""
+Здесь описано ожидание уведомлений postgres (LISTEN/NOTIFY) о новых записях в журнале изменений.
+"""
+import select
+from typing import Set
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from lib.logger import logger
+
+# канал триггеров из migrations/001_change_capture.sql, если в базе не задан etl.change_capture_channel
+DEFAULT_TRIGGER_CHANNEL = 'etl_changes'
+
+
+class ChangeListener:
+    """Держит отдельное соединение с подпиской на канал и блокируется до прихода уведомлений"""
+
+    def __init__(self, dsl: dict, channel: str):
+        self.channel = channel
+        self.pg_conn = psycopg2.connect(**dsl)
+        self.pg_conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+
+        with self.pg_conn.cursor() as cur:
+            cur.execute("SELECT nullif(current_setting('etl.change_capture_channel', true), '');")
+            trigger_channel = cur.fetchone()[0] or DEFAULT_TRIGGER_CHANNEL
+            if trigger_channel != channel:
+                logger.warning(
+                    f'Change capture triggers notify {trigger_channel}, but ETL listens on {channel}: '
+                    f'set etl.change_capture_channel in the database to {channel}'
+                )
+
+            cur.execute(f'LISTEN {channel};')
+
+    def wait(self, timeout: float) -> Set[str]:
+        """
+        Ждет уведомлений не дольше timeout секунд.
+        Возвращает payload'ы (имена таблиц журнала) всех накопившихся уведомлений, пустое множество по таймауту
+        """
+        if not self.pg_conn.notifies:
+            readable, _, _ = select.select([self.pg_conn], [], [], timeout)
+            if readable:
+                self.pg_conn.poll()
+        else:
+            self.pg_conn.poll()
+
+        payloads = {notify.payload for notify in self.pg_conn.notifies}
+        self.pg_conn.notifies.clear()
+        return payloads
+
+    def close(self):
+        self.pg_conn.close()
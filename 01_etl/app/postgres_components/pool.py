@@ -0,0 +1,229 @@
+"""
+Здесь описан пул долгоживущих соединений с postgres.
+
+Соединения открываются один раз и переиспользуются между циклами пайплайнов, вместо соединения на каждую таблицу.
+Все соединения пула только читают (readonly). Транзакции на соединениях завершает тот, кто их использует:
+commit на границе страницы producer'а. С snapshot=True транзакция идет в REPEATABLE READ,
+и producer, enricher и merger одной страницы видят один и тот же снимок БД.
+С temp_id_tables в сессии каждого соединения создаются временные таблицы enricher'а (см. postgres_components.temp_ids).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import psycopg2
+from psycopg2.extensions import (ISOLATION_LEVEL_READ_COMMITTED, ISOLATION_LEVEL_REPEATABLE_READ,
+                                 TRANSACTION_STATUS_IDLE, connection)
+from psycopg2.extras import DictCursor
+from settings import settings
+
+from etl_components.constants import EnricherStrategyEnum
+from lib.logger import logger
+from lib.utils import backoff
+from postgres_components.statements import PreparingConnection
+from postgres_components.temp_ids import create_temp_id_tables
+
+# ошибки, после которых соединение считается сломанным и в пул не возвращается
+BROKEN_CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PooledConnection(PreparingConnection):
+    """Соединение пула, помнит, что подготовлено в его сессии postgres"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # None - запросы выполняются без PREPARE
+        self.prepared_statements: Optional[Set[str]] = None
+        self.temp_id_tables = False
+
+
+class PostgresConnectionPool:
+    """Потокобезопасный пул соединений. Если все max_size соединений заняты, поток ждет освобождения"""
+
+    def __init__(
+        self,
+        dsl: dict,
+        max_size: int = 8,
+        snapshot: bool = False,
+        health_check_interval: float = 30,
+        prepared_statements: bool = False,
+        temp_id_tables: bool = False,
+    ):
+        """
+        :param dsl: параметры подключения psycopg2.connect
+        :param max_size: максимальное число открытых соединений
+        :param snapshot: транзакции в REPEATABLE READ вместо READ COMMITTED
+        :param health_check_interval: соединение, простоявшее дольше стольких секунд, проверяется перед выдачей
+        :param prepared_statements: выполнять частые запросы через PREPARE / EXECUTE, см. postgres_components.statements
+        :param temp_id_tables: создавать временные таблицы enricher'а, см. postgres_components.temp_ids
+        """
+        self.dsl = dsl
+        self.max_size = max_size
+        self.snapshot = snapshot
+        self.health_check_interval = health_check_interval
+        self.prepared_statements = prepared_statements
+        self.temp_id_tables = temp_id_tables
+
+        self._condition = threading.Condition()
+        # свободные соединения и время их возврата в пул
+        self._idle: List[Tuple[connection, float]] = []
+        self._size = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[connection]:
+        """
+        Выдает соединение на время блока with. После блока незавершенная транзакция откатывается,
+        а соединение возвращается в пул. Если соединение сломалось, оно закрывается и пул откроет новое
+        """
+        pg_conn, = self._acquire(1)
+        try:
+            yield pg_conn
+        except BROKEN_CONNECTION_ERRORS:
+            self._discard(pg_conn)
+            raise
+        except BaseException:
+            self._release(pg_conn)
+            raise
+        else:
+            self._release(pg_conn)
+
+    @contextmanager
+    def connections(self, count: int) -> Iterator[List[connection]]:
+        """
+        Выдает сразу count соединений на время блока with. Соединения берутся из пула одновременно:
+        если брать их по одному, потоки, каждый из которых уже держит часть соединений, могут ждать друг друга вечно.
+        После блока соединения возвращаются в пул, как в connection
+        """
+        pg_conns = self._acquire(count)
+        try:
+            yield pg_conns
+        finally:
+            for pg_conn in pg_conns:
+                self._release(pg_conn)
+
+    def close(self):
+        """Закрывает свободные соединения, занятые закроются при возврате"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for pg_conn, _ in idle:
+            pg_conn.close()
+
+    def _acquire(self, count: int) -> List[connection]:
+        if count > self.max_size:
+            raise ValueError(f'Cannot take {count} connections from a pool of {self.max_size}, increase DB_POOL_SIZE')
+
+        with self._condition:
+            while len(self._idle) + self.max_size - self._size < count:
+                self._condition.wait()
+
+            idle = [self._idle.pop() for _ in range(min(count, len(self._idle)))]
+            self._size += count - len(idle)
+
+        # все count мест в пуле уже заняты, сломанные соединения переоткрываются на своем месте
+        pg_conns = []
+        try:
+            for pg_conn, released_at in idle:
+                if self._is_healthy(pg_conn, released_at):
+                    pg_conns.append(pg_conn)
+                else:
+                    logger.warning('Postgres connection from the pool is broken, reconnecting')
+                    pg_conn.close()
+
+            while len(pg_conns) < count:
+                pg_conns.append(self._connect())
+        except BaseException:
+            for pg_conn in pg_conns:
+                self._release(pg_conn)
+            for _ in range(count - len(pg_conns)):
+                self._forget()
+            raise
+
+        return pg_conns
+
+    def _release(self, pg_conn: connection):
+        if pg_conn.closed:
+            self._forget()
+            return
+
+        try:
+            if pg_conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                pg_conn.rollback()
+        except BROKEN_CONNECTION_ERRORS:
+            self._discard(pg_conn)
+            return
+
+        with self._condition:
+            self._idle.append((pg_conn, time.monotonic()))
+            self._condition.notify_all()
+
+    def _discard(self, pg_conn: connection):
+        try:
+            pg_conn.close()
+        finally:
+            self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify_all()
+
+    def _is_healthy(self, pg_conn: connection, released_at: float) -> bool:
+        """Проверяет соединение запросом, если оно долго простаивало: PgBouncer или postgres могли его закрыть"""
+        if pg_conn.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+
+        try:
+            with pg_conn.cursor() as cur:
+                cur.execute('SELECT 1;')
+            pg_conn.rollback()
+        except BROKEN_CONNECTION_ERRORS:
+            return False
+        return True
+
+    @backoff(psycopg2.OperationalError)
+    def _connect(self) -> connection:
+        pg_conn = psycopg2.connect(**self.dsl, cursor_factory=DictCursor, connection_factory=PooledConnection)
+        if self.prepared_statements:
+            pg_conn.prepared_statements = set()
+        if self.temp_id_tables:
+            # до перевода сессии в readonly: в readonly транзакции CREATE запрещен
+            with pg_conn.cursor() as cur:
+                create_temp_id_tables(cur)
+            pg_conn.commit()
+            pg_conn.temp_id_tables = True
+
+        pg_conn.set_session(
+            isolation_level=ISOLATION_LEVEL_REPEATABLE_READ if self.snapshot else ISOLATION_LEVEL_READ_COMMITTED,
+            readonly=True,
+        )
+        return pg_conn
+
+
+_pools: Dict[tuple, PostgresConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(dsl: Optional[dict] = None) -> PostgresConnectionPool:
+    """Возвращает единственный на процесс пул для dsl (по умолчанию settings.dsl), настроенный из settings"""
+    dsl = dsl or settings.dsl
+    key = tuple(sorted(dsl.items()))
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = PostgresConnectionPool(
+                dsl,
+                max_size=settings.DB_POOL_SIZE,
+                snapshot=settings.DB_SNAPSHOT_BATCHES,
+                health_check_interval=settings.DB_HEALTH_CHECK_INTERVAL,
+                prepared_statements=settings.DB_PREPARED_STATEMENTS,
+                temp_id_tables=EnricherStrategyEnum.TEMP_TABLE.value in settings.ENRICHER_STRATEGY.values(),
+            )
+
+    return pool
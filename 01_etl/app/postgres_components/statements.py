@@ -0,0 +1,67 @@
+"""
+Здесь описано выполнение частых запросов через серверные подготовленные запросы (PREPARE / EXECUTE).
+
+Запросы пишутся как обычно, с именованными параметрами %(name)s. Если соединение создано с PreparingConnection,
+текст запроса разбирается и планируется postgres один раз на соединение, а дальше по сети уходят только параметры.
+Списки идентификаторов передаются одним параметром-массивом (= ANY(%(ids)s::uuid[])), поэтому текст запроса
+не зависит от размера батча. На обычном соединении запрос просто выполняется с теми же параметрами.
+
+PREPARE живет в сессии postgres, поэтому с PgBouncer в режиме pool_mode=transaction его включать нельзя.
+"""
+import hashlib
+import re
+from functools import lru_cache
+from typing import Sequence, Set
+
+from psycopg2.extensions import connection, cursor
+
+# параметр запроса и необязательное приведение типа после него: %(ids)s::uuid[]
+PARAM_PATTERN = re.compile(r'%\((\w+)\)s(::[\w\[\]]+)?')
+
+
+class PreparingConnection(connection):
+    """Соединение, которое помнит запросы, уже подготовленные в его сессии"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements: Set[str] = set()
+
+
+class Statement:
+    """Запрос с именованными параметрами и его вид для PREPARE ($1, $2, ...)"""
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.param_names: Sequence[str] = tuple(dict.fromkeys(match[0] for match in PARAM_PATTERN.findall(sql)))
+        # параметр может встречаться несколько раз, и приведение есть не у каждого вхождения
+        self.param_casts = {name: '' for name in self.param_names}
+        for name, cast in PARAM_PATTERN.findall(sql):
+            self.param_casts[name] = self.param_casts[name] or cast
+        self.name = f'etl_{hashlib.md5(sql.encode()).hexdigest()[:16]}'
+        self.prepared_sql = PARAM_PATTERN.sub(
+            lambda match: f'${self.param_names.index(match[1]) + 1}{match[2] or ""}',
+            sql.strip().rstrip(';'),
+        ).replace('%%', '%')
+        # приведение нужно и в EXECUTE: массив строк в uuid[] неявно не приводится
+        arguments = ', '.join(f'%s{self.param_casts[name]}' for name in self.param_names)
+        self.execute_sql = f'EXECUTE {self.name} ({arguments});' if arguments else f'EXECUTE {self.name};'
+
+
+@lru_cache(maxsize=256)
+def get_statement(sql: str) -> Statement:
+    return Statement(sql)
+
+
+def execute(cur: cursor, sql: str, params: dict):
+    """Выполняет sql с параметрами params, на PreparingConnection через PREPARE / EXECUTE"""
+    prepared_statements = getattr(cur.connection, 'prepared_statements', None)
+    if prepared_statements is None:
+        cur.execute(sql, params)
+        return
+
+    statement = get_statement(sql)
+    if statement.name not in prepared_statements:
+        cur.execute(f'PREPARE {statement.name} AS {statement.prepared_sql};')
+        prepared_statements.add(statement.name)
+
+    cur.execute(statement.execute_sql, [params[name] for name in statement.param_names])
@@ -1,13 +1,62 @@
 """
 Здесь описаны спецификации таблиц из БД movies_database.
 В них описаны методы для получения изменившихся записей из таблиц.
+
+Пагинация везде keyset (seek): вместо OFFSET/LIMIT запоминается последняя отданная запись
+и следующая страница начинается строго после неё. Поэтому стоимость страницы не зависит от глубины сканирования.
 """
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Tuple
+from itertools import chain
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
 
 from psycopg2.extensions import connection
 
+from postgres_components.statements import execute
+from postgres_components.temp_ids import MODIFIED_IDS_TABLE
+
+
+class KeysetCursor(NamedTuple):
+    """Позиция сканирования таблицы: последняя обработанная пара (modified, id)"""
+
+    modified: Union[datetime, str]
+    id: str
+
+
+class ChangelogPage(NamedTuple):
+    """Страница журнала etl_changelog одной таблицы"""
+
+    row_ids: Tuple[str, ...]  # идентификаторы изменившихся строк без повторов
+    last_change_id: Optional[int]  # id последней прочитанной записи журнала или None для пустой страницы
+    gap_ids: Tuple[int, ...]  # id журнала внутри страницы, которых не было в снимке (см. CHANGELOG_PAGE_SQL)
+
+
+# Страница журнала и пропуски id внутри нее читаются одним запросом, т.е. в одном снимке.
+# bigserial выдает id в момент вставки, а видна запись становится после коммита: транзакция, взявшая меньший id,
+# может закоммититься позже той, чью запись уже прочитали. Ее id в снимке отсутствует (как и id откаченных
+# транзакций), такие пропуски запоминаются и перепроверяются отдельно (get_changelog_gap_row_ids).
+# Пропуски ищутся среди записей всех таблиц и только в последних gap_window id до конца страницы.
+CHANGELOG_PAGE_SQL = """
+    WITH page AS (
+        {page_sql}
+    ),
+    bounds AS (
+        SELECT GREATEST(%(last_change_id)s, max(id) - %(gap_window)s) AS after_id, max(id) AS until_id
+        FROM page
+    )
+    SELECT id, row_id, NULL::bigint AS gap_start, NULL::bigint AS gap_end
+    FROM page
+    UNION ALL
+    SELECT NULL, NULL, prev_id + 1, id - 1
+    FROM (
+        SELECT journal.id, lag(journal.id, 1, bounds.after_id) OVER (ORDER BY journal.id) AS prev_id
+        FROM etl_changelog journal, bounds
+        WHERE journal.id > bounds.after_id AND journal.id <= bounds.until_id
+    ) journal_ids
+    WHERE id - prev_id > 1
+    ORDER BY id;
+"""
+
 
 class AbstractPostgresTableSpec(ABC):
 
@@ -21,17 +70,49 @@ class AbstractPostgresTableSpec(ABC):
     def get_modified_row_ids(
         cls,
         pg_conn: connection,
-        last_modified_dt: datetime,
+        last_modified_dt: Union[datetime, str],
+        last_row_id: str,
         limit: int,
-        offset: int
-    ) -> Tuple[str]:
+        until: Optional[KeysetCursor] = None,
+    ) -> Tuple[Tuple[str], Optional[KeysetCursor]]:
         """
         Находит изменившиеся записи и возвращает их идентификаторы
         :param pg_conn: коннект к бд
-        :param last_modified_dt: дата с которой надо начать смотреть обновления
+        :param last_modified_dt: modified последней обработанной записи
+        :param last_row_id: id последней обработанной записи
         :param limit: ограничение по числу записей
-        :param offset: смещение
-        :return: Tuple с идентификаторами изменившихся строк
+        :param until: конец уже начатой страницы: отдаются все записи до него включительно, limit не применяется
+        :return: Tuple с идентификаторами изменившихся строк и курсор для запроса следующей страницы
+        """
+
+    @classmethod
+    @abstractmethod
+    def get_changelog_row_ids(
+        cls,
+        pg_conn: connection,
+        last_change_id: int,
+        limit: int,
+        until_change_id: Optional[int] = None,
+        gap_window: int = 0,
+    ) -> ChangelogPage:
+        """
+        Вычитывает идентификаторы изменившихся записей из журнала etl_changelog (см. migrations)
+        :param pg_conn: коннект к бд
+        :param last_change_id: id последней обработанной записи журнала
+        :param limit: ограничение по числу записей журнала
+        :param until_change_id: конец уже начатой страницы журнала, как until в get_modified_row_ids
+        :param gap_window: сколько последних id страницы проверять на пропуски, 0 - не проверять
+        :return: идентификаторы строк, id последней прочитанной записи и пропуски id журнала внутри страницы
+        """
+
+    @classmethod
+    @abstractmethod
+    def get_changelog_gap_row_ids(cls, pg_conn: connection, gap_ids: Sequence[int]) -> Tuple[Tuple[str], Tuple[int]]:
+        """
+        Перечитывает записи журнала, которых не было в снимке при чтении страницы (ChangelogPage.gap_ids)
+        :param pg_conn: коннект к бд
+        :param gap_ids: id пропущенных записей журнала
+        :return: идентификаторы строк таблицы из появившихся записей и id всех появившихся записей (любых таблиц)
         """
 
     @classmethod
@@ -40,17 +121,70 @@ class AbstractPostgresTableSpec(ABC):
         cls,
         pg_conn: connection,
         modified_row_ids: Tuple[str],
+        last_id: str,
         limit: int,
-        offset: int
     ) -> Tuple[str]:
         """
         По изменившимся идентификаторам находит идентификаторы кинопроизведений
         :param pg_conn: коннект к бд
         :param modified_row_ids: список идентификаторов изменившихся строк
+        :param last_id: последний уже отданный идентификатор кинопроизведения
         :param limit: ограничение по числу записей
-        :param offset: смещение
-        :return: Tuple с идентификаторами кинопроизведений, связанных с modified_row_ids
+        :return: Tuple с идентификаторами кинопроизведений, связанных с modified_row_ids, упорядоченный по id
+        """
+
+    @classmethod
+    @abstractmethod
+    def get_affected_film_work_ids_sql(cls) -> Optional[str]:
+        """
+        Запрос без параметров, который выбирает идентификаторы кинопроизведений, связанных со строками
+        временной таблицы etl_modified_ids (см. postgres_components.temp_ids)
+        :return: текст запроса или None, если идентификаторы строк таблицы и есть идентификаторы кинопроизведений
+        """
+
+    @classmethod
+    @abstractmethod
+    def get_watermark(cls, pg_conn: connection) -> Optional[KeysetCursor]:
+        """
+        Позиция последней записи таблицы в текущем снимке: максимальная пара (modified, id)
+        :param pg_conn: коннект к бд
+        :return: курсор последней записи или None для пустой таблицы
+        """
+
+    @classmethod
+    @abstractmethod
+    def iter_all_ids(cls, pg_conn: connection, itersize: int) -> Iterator[Tuple[str]]:
         """
+        Отдает все идентификаторы таблицы по возрастанию пачками через серверный курсор,
+        не загружая таблицу в память целиком
+        :param pg_conn: коннект к бд
+        :param itersize: размер пачки
+        """
+
+
+def normalize_keyset_cursors(pg_conn: connection, cursors: Sequence[KeysetCursor]) -> List[KeysetCursor]:
+    """
+    Приводит modified курсоров к datetime с часовым поясом средствами postgres, как их вернул бы producer.
+    В состоянии modified хранится строкой, возможно без часового пояса, и напрямую такие курсоры не сравнить
+    """
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT modified
+            FROM unnest(%(modified)s::timestamptz[]) WITH ORDINALITY AS cursors(modified, position)
+            ORDER BY position;
+            """,
+            {'modified': [i.modified for i in cursors]}
+        )
+        return [KeysetCursor(modified=row[0], id=cursor.id) for row, cursor in zip(cur.fetchall(), cursors)]
+
+
+def slice_ids_after(ids: Tuple[str], last_id: str, limit: int) -> Tuple[str]:
+    """
+    Keyset-срез по уже известным идентификаторам: отдает до limit идентификаторов больше last_id.
+    Порядок строк uuid в каноническом виде совпадает с порядком uuid в postgres.
+    """
+    return tuple(sorted(i for i in set(ids) if i > last_id)[:limit])
 
 
 class PostgresTableSpecMixin(AbstractPostgresTableSpec):
@@ -62,53 +196,175 @@ class PostgresTableSpecMixin(AbstractPostgresTableSpec):
     def get_modified_row_ids(
         cls,
         pg_conn: connection,
-        last_modified_dt: datetime,
+        last_modified_dt: Union[datetime, str],
+        last_row_id: str,
         limit: int,
-        offset: int
-    ) -> Tuple[str]:
+        until: Optional[KeysetCursor] = None,
+    ) -> Tuple[Tuple[str], Optional[KeysetCursor]]:
         with pg_conn.cursor() as cur:
-            query = cur.mogrify(
+            if until is None:
+                execute(
+                    cur,
+                    f"""
+                    SELECT id, modified
+                    FROM {cls.table_name}
+                    WHERE (modified, id) > (%(modified)s::timestamptz, %(last_row_id)s::uuid)
+                    ORDER BY modified, id
+                    LIMIT %(limit)s;
+                    """,
+                    {'modified': last_modified_dt, 'last_row_id': last_row_id, 'limit': limit}
+                )
+            else:
+                execute(
+                    cur,
+                    f"""
+                    SELECT id, modified
+                    FROM {cls.table_name}
+                    WHERE (modified, id) > (%(modified)s::timestamptz, %(last_row_id)s::uuid)
+                        AND (modified, id) <= (%(until_modified)s::timestamptz, %(until_row_id)s::uuid)
+                    ORDER BY modified, id;
+                    """,
+                    {
+                        'modified': last_modified_dt,
+                        'last_row_id': last_row_id,
+                        'until_modified': until.modified,
+                        'until_row_id': until.id,
+                    }
+                )
+            rows = cur.fetchall()
+
+            if not rows:
+                return (), None
+
+            return tuple(i[0] for i in rows), KeysetCursor(modified=rows[-1][1], id=rows[-1][0])
+
+    @classmethod
+    def get_watermark(cls, pg_conn: connection) -> Optional[KeysetCursor]:
+        with pg_conn.cursor() as cur:
+            cur.execute(
                 f"""
-                SELECT id
+                SELECT modified, id
                 FROM {cls.table_name}
-                WHERE modified >= %(modified)s
-                ORDER BY modified, id
-                OFFSET %(offset)s
-                LIMIT %(limit)s;
+                ORDER BY modified DESC, id DESC
+                LIMIT 1;
+                """
+            )
+            row = cur.fetchone()
+
+            return KeysetCursor(modified=row[0], id=row[1]) if row else None
+
+    @classmethod
+    def iter_all_ids(cls, pg_conn: connection, itersize: int) -> Iterator[Tuple[str]]:
+        with pg_conn.cursor(name=f'{cls.table_name}_all_ids') as cur:
+            cur.itersize = itersize
+            cur.execute(f'SELECT id FROM {cls.table_name} ORDER BY id;')
+
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    return
+                yield tuple(i[0] for i in rows)
+
+    @classmethod
+    def get_changelog_row_ids(
+        cls,
+        pg_conn: connection,
+        last_change_id: int,
+        limit: int,
+        until_change_id: Optional[int] = None,
+        gap_window: int = 0,
+    ) -> ChangelogPage:
+        params = {'table_name': cls.table_name, 'last_change_id': last_change_id, 'gap_window': gap_window}
+        with pg_conn.cursor() as cur:
+            if until_change_id is None:
+                execute(
+                    cur,
+                    CHANGELOG_PAGE_SQL.format(page_sql="""
+                        SELECT id, row_id
+                        FROM etl_changelog
+                        WHERE table_name = %(table_name)s AND id > %(last_change_id)s
+                        ORDER BY id
+                        LIMIT %(limit)s
+                    """),
+                    {**params, 'limit': limit}
+                )
+            else:
+                execute(
+                    cur,
+                    CHANGELOG_PAGE_SQL.format(page_sql="""
+                        SELECT id, row_id
+                        FROM etl_changelog
+                        WHERE table_name = %(table_name)s AND id > %(last_change_id)s AND id <= %(until_change_id)s
+                    """),
+                    {**params, 'until_change_id': until_change_id}
+                )
+            rows = cur.fetchall()
+
+        # строки страницы идут по id, пропуски (с пустым id) - после них
+        page_rows = [i for i in rows if i[0] is not None]
+        if not page_rows:
+            return ChangelogPage(row_ids=(), last_change_id=None, gap_ids=())
+
+        return ChangelogPage(
+            # одна и та же строка могла поменяться несколько раз, порядок первого появления сохраняется
+            row_ids=tuple(dict.fromkeys(i[1] for i in page_rows)),
+            last_change_id=page_rows[-1][0],
+            gap_ids=tuple(chain.from_iterable(range(i[2], i[3] + 1) for i in rows if i[0] is None)),
+        )
+
+    @classmethod
+    def get_changelog_gap_row_ids(cls, pg_conn: connection, gap_ids: Sequence[int]) -> Tuple[Tuple[str], Tuple[int]]:
+        with pg_conn.cursor() as cur:
+            execute(
+                cur,
+                """
+                SELECT id, table_name, row_id
+                FROM etl_changelog
+                WHERE id = ANY(%(gap_ids)s::bigint[])
+                ORDER BY id;
                 """,
-                {'modified': last_modified_dt, 'limit': limit, 'offset': offset}
+                {'gap_ids': list(gap_ids)}
             )
-            cur.execute(query)
+            rows = cur.fetchall()
 
-            return tuple(i[0] for i in cur.fetchall())
+        row_ids = tuple(dict.fromkeys(i[2] for i in rows if i[1] == cls.table_name))
+        return row_ids, tuple(i[0] for i in rows)
 
     @classmethod
     def get_film_work_ids_by_modified_row_ids(
         cls,
         pg_conn: connection,
         modified_row_ids: Tuple[str],
+        last_id: str,
         limit: int,
-        offset: int
     ) -> Tuple[str]:
         with pg_conn.cursor() as cur:
-            query = cur.mogrify(
+            execute(
+                cur,
                 f"""
-                SELECT {cls.film_work_id_field}
+                SELECT DISTINCT {cls.film_work_id_field}
                 FROM {cls.table_name}
                 """
                 + cls.join_clause * bool(cls.join_clause) +
                 f"""
-                WHERE {cls.table_name}.id in %(modified)s
-                ORDER BY {cls.table_name}.modified, {cls.table_name}.id
-                OFFSET %(offset)s
+                WHERE {cls.table_name}.id = ANY(%(modified)s::uuid[])
+                    AND {cls.film_work_id_field} > %(last_id)s::uuid
+                ORDER BY {cls.film_work_id_field}
                 LIMIT %(limit)s;
                     """,
-                {'modified': modified_row_ids, 'limit': limit, 'offset': offset}
+                {'modified': list(modified_row_ids), 'last_id': last_id, 'limit': limit}
             )
-            cur.execute(query)
 
             return tuple(i[0] for i in cur.fetchall())
 
+    @classmethod
+    def get_affected_film_work_ids_sql(cls) -> Optional[str]:
+        return (
+            f'SELECT DISTINCT {cls.film_work_id_field} FROM {cls.table_name} '
+            + (cls.join_clause or '')
+            + f' JOIN {MODIFIED_IDS_TABLE} ON {MODIFIED_IDS_TABLE}.id = {cls.table_name}.id'
+        )
+
 
 class FilmWorkSpec(PostgresTableSpecMixin):
     table_name = 'film_work'
@@ -120,10 +376,14 @@ class FilmWorkSpec(PostgresTableSpecMixin):
         cls,
         pg_conn: connection,
         modified_row_ids: Tuple[str],
+        last_id: str,
         limit: int,
-        offset: int
     ) -> Tuple[str]:
-        return modified_row_ids[offset:offset + limit]
+        return slice_ids_after(modified_row_ids, last_id, limit)
+
+    @classmethod
+    def get_affected_film_work_ids_sql(cls) -> Optional[str]:
+        return None
 
 
 class PersonFilmWorkSpec(PostgresTableSpecMixin):
@@ -136,22 +396,22 @@ class PersonFilmWorkSpec(PostgresTableSpecMixin):
         cls,
         pg_conn: connection,
         modified_row_ids: Tuple[str],
+        last_id: str,
         limit: int,
-        offset: int
     ) -> Tuple[str]:
         with pg_conn.cursor() as cur:
-            query = cur.mogrify(
+            execute(
+                cur,
                 f"""
-                SELECT {cls.film_work_id_field}
+                SELECT DISTINCT {cls.film_work_id_field}
                 FROM {cls.table_name}
-                WHERE {cls.table_name}.id in %(modified)s
-                ORDER BY {cls.table_name}.modified, {cls.table_name}.id
-                OFFSET %(offset)s
+                WHERE {cls.table_name}.id = ANY(%(modified)s::uuid[])
+                    AND {cls.film_work_id_field} > %(last_id)s::uuid
+                ORDER BY {cls.film_work_id_field}
                 LIMIT %(limit)s;
                 """,
-                {'modified': modified_row_ids, 'limit': limit, 'offset': offset}
+                {'modified': list(modified_row_ids), 'last_id': last_id, 'limit': limit}
             )
-            cur.execute(query)
 
             return tuple(i[0] for i in cur.fetchall())
 
@@ -160,25 +420,33 @@ class PersonFilmWorkSpec(PostgresTableSpecMixin):
         cls,
         pg_conn: connection,
         modified_row_ids: Tuple[str],
+        last_id: str,
         limit: int,
-        offset: int
     ):
         with pg_conn.cursor() as cur:
-            query = cur.mogrify(
+            execute(
+                cur,
                 f"""
-                SELECT {cls.person_id_field}
+                SELECT DISTINCT {cls.person_id_field}
                 FROM {cls.table_name}
-                WHERE {cls.table_name}.id in %(modified)s
-                ORDER BY {cls.table_name}.modified, {cls.table_name}.id
-                OFFSET %(offset)s
+                WHERE {cls.table_name}.id = ANY(%(modified)s::uuid[])
+                    AND {cls.person_id_field} > %(last_id)s::uuid
+                ORDER BY {cls.person_id_field}
                 LIMIT %(limit)s;
                 """,
-                {'modified': modified_row_ids, 'limit': limit, 'offset': offset}
+                {'modified': list(modified_row_ids), 'last_id': last_id, 'limit': limit}
             )
-            cur.execute(query)
 
             return tuple(i[0] for i in cur.fetchall())
 
+    @classmethod
+    def get_affected_person_ids_sql(cls) -> Optional[str]:
+        """Аналог get_affected_film_work_ids_sql для идентификаторов персон"""
+        return (
+            f'SELECT DISTINCT {cls.person_id_field} FROM {cls.table_name}'
+            f' JOIN {MODIFIED_IDS_TABLE} ON {MODIFIED_IDS_TABLE}.id = {cls.table_name}.id'
+        )
+
 
 class PersonSpec(PostgresTableSpecMixin):
     table_name = 'person'
@@ -190,10 +458,14 @@ class PersonSpec(PostgresTableSpecMixin):
         cls,
         pg_conn: connection,
         modified_row_ids: Tuple[str],
+        last_id: str,
         limit: int,
-        offset: int
     ):
-        return modified_row_ids[offset:offset + limit]
+        return slice_ids_after(modified_row_ids, last_id, limit)
+
+    @classmethod
+    def get_affected_person_ids_sql(cls) -> Optional[str]:
+        return None
 
 
 class GenreSpec(PostgresTableSpecMixin):
@@ -206,7 +478,7 @@ class GenreSpec(PostgresTableSpecMixin):
         cls,
         pg_conn: connection,
         modified_row_ids: Tuple[str],
+        last_id: str,
         limit: int,
-        offset: int
     ):
-        return modified_row_ids[offset:offset + limit]
+        return slice_ids_after(modified_row_ids, last_id, limit)
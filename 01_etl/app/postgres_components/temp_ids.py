@@ -0,0 +1,65 @@
+"""
+Здесь описано нахождение затронутых документов через временные таблицы сессии (стратегия enricher'а temp_table).
+
+Идентификаторы страницы producer'а один раз загружаются через COPY в etl_modified_ids, затем один join
+находит все затронутые документы и складывает их в etl_affected_ids. Дальше enricher читает etl_affected_ids
+keyset-страницами по первичному ключу, не отправляя идентификаторы страницы повторно и не повторяя join.
+
+Таблицы создаются пулом при открытии соединения (см. postgres_components.pool): в readonly транзакции
+CREATE и TRUNCATE запрещены, а запись во временные таблицы разрешена. Строки удаляются при каждом commit
+(ON COMMIT DELETE ROWS), поэтому временные таблицы, которые autovacuum не обслуживает, не разрастаются.
+Как и PREPARE, временные таблицы живут в сессии postgres и несовместимы с PgBouncer в режиме pool_mode=transaction.
+"""
+import io
+from typing import Iterable, Tuple
+
+from psycopg2.extensions import connection, cursor
+
+from postgres_components.statements import execute
+
+MODIFIED_IDS_TABLE = 'etl_modified_ids'
+AFFECTED_IDS_TABLE = 'etl_affected_ids'
+
+
+def create_temp_id_tables(cur: cursor):
+    """Создает временные таблицы в сессии соединения, транзакция должна быть не readonly"""
+    for table_name in (MODIFIED_IDS_TABLE, AFFECTED_IDS_TABLE):
+        cur.execute(f'CREATE TEMP TABLE IF NOT EXISTS {table_name} (id uuid PRIMARY KEY) ON COMMIT DELETE ROWS;')
+
+
+def has_temp_id_tables(pg_conn: connection) -> bool:
+    """В сессии соединения созданы временные таблицы (соединение из пула с temp_id_tables)"""
+    return getattr(pg_conn, 'temp_id_tables', False)
+
+
+def resolve_affected_ids(pg_conn: connection, modified_row_ids: Iterable[str], affected_ids_sql: str) -> int:
+    """
+    Загружает modified_row_ids в etl_modified_ids и складывает в etl_affected_ids результат affected_ids_sql:
+    запроса без параметров, который выбирает идентификаторы документов через join с etl_modified_ids.
+    Возвращает число затронутых документов
+    """
+    # страницы producer'а в одной транзакции (coalesced режим) не видят идентификаторов друг друга
+    rows = ''.join(f'{row_id}\n' for row_id in dict.fromkeys(modified_row_ids))
+
+    with pg_conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {MODIFIED_IDS_TABLE}; DELETE FROM {AFFECTED_IDS_TABLE};')
+        cur.copy_expert(f'COPY {MODIFIED_IDS_TABLE} (id) FROM STDIN;', io.StringIO(rows))
+        cur.execute(f'INSERT INTO {AFFECTED_IDS_TABLE} (id) {affected_ids_sql};')
+        return cur.rowcount
+
+
+def get_affected_ids(pg_conn: connection, last_id: str, limit: int) -> Tuple[str]:
+    """Keyset-страница etl_affected_ids: до limit идентификаторов больше last_id по возрастанию"""
+    with pg_conn.cursor() as cur:
+        execute(
+            cur,
+            f"""
+            SELECT id
+            FROM {AFFECTED_IDS_TABLE}
+            WHERE id > %(last_id)s::uuid
+            ORDER BY id
+            LIMIT %(limit)s;
+            """,
+            {'last_id': last_id, 'limit': limit}
+        )
+        return tuple(i[0] for i in cur.fetchall())
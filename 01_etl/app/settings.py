@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Dict, Union
 
 from pydantic import BaseSettings
 
@@ -9,11 +9,95 @@ class Settings(BaseSettings):
     DB_PASSWORD: str
     DB_HOST: str = '127.0.0.1'
     DB_PORT: Union[int, str] = 5432
+    # пул долгоживущих readonly соединений, см. postgres_components.pool
+    DB_POOL_SIZE = 8
+    DB_HEALTH_CHECK_INTERVAL: float = 30
+    # страница producer'а со всеми ее батчами читается в одной транзакции REPEATABLE READ (одном снимке БД)
+    DB_SNAPSHOT_BATCHES = False
+    # частые запросы через PREPARE / EXECUTE, несовместимо с PgBouncer в pool_mode=transaction
+    DB_PREPARED_STATEMENTS = False
 
     ES_HOST: str = '127.0.0.1'
     ES_PORT: Union[int, str] = 9200
+    ES_BULK_MODE: str = 'streaming'  # bulk | streaming | parallel | ndjson
+    ES_JSON_ENCODER: str = 'auto'  # auto | orjson | json, auto - orjson если он установлен
+    ES_BULK_THREAD_COUNT = 4
+    ES_BULK_CHUNK_SIZE = 500
+    ES_BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+    ES_BULK_MAX_IN_FLIGHT = 4
+    ES_CONNECTIONS_PER_NODE = 10
+    # сколько раз повторять документы, не принятые из-за перегрузки, недоступности или таймаута Elastic,
+    # пауза между повторами случайная в пределах [0, min(ES_RETRY_BACKOFF_START * 2^n, ES_RETRY_BACKOFF_MAX)]
+    ES_REJECTION_RETRIES = 5
+    ES_RETRY_BACKOFF_START: float = 0.5
+    ES_RETRY_BACKOFF_MAX: float = 30
+    # документы, отклоненные Elastic без шансов на успешный повтор, см. storage.dead_letter
+    DEAD_LETTER_PATH = './dead_letter.jsonl'
 
     BATCH_SIZE = 500
+    # адаптивный подбор размеров батчей по времени стадий, см. etl_components.batching
+    ADAPTIVE_BATCHING = False
+    BATCH_SIZE_MIN = 50
+    BATCH_SIZE_MAX = 5000
+    BATCH_TARGET_LATENCY: Dict[str, float] = {'producer': 0.5, 'enricher': 2.0, 'loader': 2.0}
+
+    PIPELINE_EXECUTION_MODE: str = 'sequential'  # sequential | staged | coalesced
+    # таблица читается один раз для всех пайплайнов, которые ее объявили (см. etl_components.shared_scan)
+    SHARED_SCAN_ENABLED: bool = False
+    STAGE_QUEUE_SIZE = 4
+    COALESCE_MAX_IDS_IN_MEMORY = 100_000
+    COALESCE_MAX_IDS_PER_CYCLE = 0  # 0 - без ограничения
+    # сколько таблиц пайплайна обрабатывать одновременно, например {"film_work_pipeline": 2}
+    PIPELINE_CONCURRENCY: Dict[str, int] = {}
+    # стратегия сборки документов для пайплайна: python | sql | streaming, например {"film_work_pipeline": "sql"}
+    MERGER_STRATEGY: Dict[str, str] = {}
+    # сколько строк за раз получает серверный курсор потокового merger'а
+    MERGER_STREAM_ITERSIZE = 2000
+    # строки python и streaming merger'ов читаются кортежами и проверяются без pydantic (см. etl_components.rows)
+    MERGER_COMPACT_ROWS: bool = False
+    # поиск затронутых документов: keyset | temp_table, например {"film_work_pipeline": "temp_table"}
+    ENRICHER_STRATEGY: Dict[str, str] = {}
+    # обработка изменений справочников: full | partial, например {"film_work_pipeline": "partial"}
+    DIMENSION_UPDATE_STRATEGY: Dict[str, str] = {}
+
+    # адаптивный опрос таблиц: пустое сканирование увеличивает интервал в POLL_BACKOFF_FACTOR раз
+    POLL_MIN_INTERVAL: float = 0
+    POLL_IDLE_INTERVAL: float = 0.5
+    POLL_MAX_INTERVAL: float = 30
+    POLL_BACKOFF_FACTOR: float = 2
+    # целевая свежесть индекса в секундах, ограничивает интервал опроса, например {"genres": 5}
+    FRESHNESS_SLO: Dict[str, float] = {}
+
+    # требует установленных триггеров из migrations/001_change_capture.sql
+    CHANGE_CAPTURE_ENABLED = False
+    # должен совпадать с параметром базы etl.change_capture_channel, в который пишут триггеры
+    CHANGE_CAPTURE_CHANNEL = 'etl_changes'
+    CHANGE_CAPTURE_CATCHUP_INTERVAL: float = 600
+    # сколько последних id журнала перепроверяется на записи транзакций, закоммиченных позже следующих за ними:
+    # изменение транзакции, за время которой журнал ушел дальше, подхватит только сканирование раз в CATCHUP_INTERVAL
+    CHANGE_CAPTURE_GAP_WINDOW: int = 10000
+
+    # на сколько секунд курсоры сканирования после переиндексации отстают от снимка, см. etl_components.reindex
+    REINDEX_WATERMARK_OVERLAP: float = 60
+
+    # не отправлять документы, _source которых не изменился с прошлой загрузки, см. etl_components.fingerprints.
+    # Если индекс удалили или пересоздали в обход reindex, отпечатки нужно пересобрать
+    FINGERPRINTS_ENABLED = False
+    FINGERPRINTS_PATH = './fingerprints.sqlite3'
+
+    STATE_BACKEND: str = 'json'  # json | sqlite
+    STATE_FILE_PATH = './storage.json'
+    STATE_SQLITE_PATH = './storage.sqlite3'
+    STATE_FLUSH_INTERVAL: float = 0  # секунды, 0 - сбрасывать только по STATE_FLUSH_EVERY
+    STATE_FLUSH_EVERY = 1
+    STATE_FSYNC = False
+
+    # метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics, 0 - не поднимать сервер.
+    # В контейнере сервер должен слушать 0.0.0.0, иначе Prometheus до него не достучится (см. docker-compose.yml)
+    METRICS_HOST = '127.0.0.1'
+    METRICS_PORT = 0
+    # как часто писать в лог сводку прогресса по каждой таблице, секунды
+    LOG_SUMMARY_INTERVAL: float = 10
 
     @property
     def dsl(self):
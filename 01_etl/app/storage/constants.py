@@ -0,0 +1,8 @@
+from enum import Enum
+
+
+class StorageBackendEnum(Enum):
+    """Доступные хранилища состояния"""
+
+    JSON = 'json'
+    SQLITE = 'sqlite'
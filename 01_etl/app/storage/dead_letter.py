@@ -0,0 +1,28 @@
+"""
+Здесь описан локальный файл недоставленных документов (dead letter).
+
+Документы, которые Elastic отклонил без шансов на успешный повтор, дописываются в него строками JSON,
+чтобы пайплайн мог идти дальше, а документы можно было разобрать и отправить вручную.
+"""
+import json
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+
+class DeadLetterFile:
+    """Файл JSON Lines, в который потоки процесса дописывают недоставленные документы"""
+
+    def __init__(self, file_path: Optional[str] = None):
+        self.file_path = file_path or './dead_letter.jsonl'
+        self._lock = threading.Lock()
+
+    def write(self, records: Iterable[dict]):
+        """Дописывает записи в конец файла, к каждой добавляется время записи"""
+        now = datetime.now(timezone.utc).isoformat()
+        lines = [json.dumps({'time': now, **record}, ensure_ascii=False, default=str) + '\n' for record in records]
+        if not lines:
+            return
+
+        with self._lock, open(self.file_path, 'a', encoding='utf-8') as dead_letter:
+            dead_letter.writelines(lines)
@@ -0,0 +1,96 @@
+"""
+Здесь описано локальное хранилище отпечатков документов Elastic: (индекс, id документа) -> хеш _source.
+
+По нему можно понять, что собранный документ не изменился с прошлой загрузки, и не отправлять его повторно.
+"""
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# ограничение SQLite на число параметров в одном запросе (SQLITE_MAX_VARIABLE_NUMBER в старых сборках)
+MAX_QUERY_PARAMS = 900
+
+
+class FingerprintStore:
+    """Отпечатки документов в локальном файле SQLite (WAL), разделяемом потоками процесса"""
+
+    def __init__(self, file_path: Optional[str] = None, busy_timeout: float = 30):
+        """
+        :param file_path: путь до файла базы
+        :param busy_timeout: сколько секунд ждать, если базу заблокировал другой писатель
+        """
+        self.file_path = file_path or './fingerprints.sqlite3'
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.file_path, timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # потеря последних отпечатков при сбое питания приведет лишь к повторной отправке документов
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                index_name TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                PRIMARY KEY (index_name, doc_id)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def get_many(self, index_name: str, doc_ids: Iterable[str]) -> Dict[str, bytes]:
+        """Известные отпечатки для doc_ids, документов без отпечатка в результате нет"""
+        doc_ids = list(doc_ids)
+        result = {}
+
+        with self._lock:
+            for i in range(0, len(doc_ids), MAX_QUERY_PARAMS):
+                chunk = doc_ids[i:i + MAX_QUERY_PARAMS]
+                rows = self._conn.execute(
+                    f'SELECT doc_id, hash FROM fingerprints '
+                    f'WHERE index_name = ? AND doc_id IN ({", ".join("?" * len(chunk))})',
+                    (index_name, *chunk)
+                )
+                result.update(rows)
+
+        return result
+
+    def put_many(self, index_name: str, fingerprints: Dict[str, bytes]):
+        if not fingerprints:
+            return
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO fingerprints (index_name, doc_id, hash) VALUES (?, ?, ?)',
+                ((index_name, doc_id, fingerprint) for doc_id, fingerprint in fingerprints.items())
+            )
+
+    def delete_many(self, index_name: str, doc_ids: Iterable[str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'DELETE FROM fingerprints WHERE index_name = ? AND doc_id = ?',
+                ((index_name, doc_id) for doc_id in doc_ids)
+            )
+
+    def clear(self, index_name: str):
+        """Забывает все отпечатки индекса"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM fingerprints WHERE index_name = ?', (index_name,))
+
+    def iter_index(self, index_name: str, batch_size: int = 10_000) -> Iterator[Tuple[str, bytes]]:
+        """Все отпечатки индекса по возрастанию id"""
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT doc_id, hash FROM fingerprints WHERE index_name = ? AND doc_id > ? ORDER BY doc_id LIMIT ?',
+                    (index_name, last_id, batch_size)
+                ).fetchall()
+
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
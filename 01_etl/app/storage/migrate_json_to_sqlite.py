@@ -0,0 +1,34 @@
+"""
+Переносит состояние из storage.json в SQLite хранилище.
+
+Пример запуска из папки app:
+    python -m storage.migrate_json_to_sqlite --json ./storage.json --sqlite ./storage.sqlite3
+"""
+import argparse
+
+from lib.logger import logger
+from storage.storage import JsonFileStorage, SqliteStorage
+
+
+def migrate(json_path: str, sqlite_path: str) -> int:
+    """Импортирует все разделы json файла в SQLite и возвращает число перенесенных таблиц пайплайнов"""
+    state = JsonFileStorage(json_path).retrieve_state()
+
+    sqlite_storage = SqliteStorage(sqlite_path)
+    try:
+        sqlite_storage.retrieve_state()
+        sqlite_storage.save_state(state)
+    finally:
+        sqlite_storage.close()
+
+    return sum(len(tables) for tables in state.values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Импорт storage.json в SQLite хранилище состояния')
+    parser.add_argument('--json', default='./storage.json', help='путь до storage.json')
+    parser.add_argument('--sqlite', default='./storage.sqlite3', help='путь до файла SQLite')
+    args = parser.parse_args()
+
+    migrated = migrate(args.json, args.sqlite)
+    logger.info(f'Migrated {migrated} pipeline tables from {args.json} to {args.sqlite}')
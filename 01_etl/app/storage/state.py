@@ -1,3 +1,6 @@
+import threading
+import time
+
 from storage.storage import BaseStorage
 
 
@@ -6,26 +9,62 @@ class State:
     Класс для хранения состояния при работе с данными, чтобы постоянно не перечитывать данные с начала.
     Здесь представлена реализация с сохранением состояния в файл.
     В целом ничего не мешает поменять это поведение на работу с БД или распределённым хранилищем.
+
+    Состояние читается из хранилища один раз и дальше живет в памяти.
+    Изменения сбрасываются в хранилище отложенно: после flush_every изменений
+    или если с прошлого сброса прошло больше flush_interval секунд (см. flush).
+
+    Объект можно разделять между потоками: чтение и запись идут под общей блокировкой,
+    а для составных операций чтение-изменение-запись блокировку можно взять явно через state.lock
     """
 
-    def __init__(self, storage: BaseStorage):
+    def __init__(self, storage: BaseStorage, flush_interval: float = 0, flush_every: int = 1):
+        """
+        :param storage: постоянное хранилище состояния
+        :param flush_interval: максимальное время в секундах, которое изменения могут жить только в памяти
+        :param flush_every: через сколько изменений сбрасывать состояние в хранилище
+        """
         self.storage = storage
+        self.lock = threading.RLock()
+        self.flush_interval = flush_interval
+        self.flush_every = max(flush_every, 1)
+
+        self._state = storage.retrieve_state()
+        self._dirty_keys = set()
+        self._dirty_count = 0
+        self._last_flush_time = time.monotonic()
 
     def __getitem__(self, item):
-        return self.storage.retrieve_state()[item]
+        with self.lock:
+            return self._state[item]
 
     def __setitem__(self, key, value):
-        self.storage.save_state({
-            key: value
-        })
+        self.set_state(key, value)
 
     def set_state(self, key: str, value) -> None:
         """Установить состояние для определённого ключа"""
-        self.storage.save_state({
-            key: value
-        })
+        with self.lock:
+            self._state[key] = value
+            self._dirty_keys.add(key)
+            self._dirty_count += 1
+
+            if self._dirty_count >= self.flush_every or self._flush_interval_expired():
+                self.flush()
 
     def get_state(self, key: str, default=None):
         """Получить состояние по определённому ключу"""
-        current_state = self.storage.retrieve_state()
-        return current_state.get(key, default)
+        with self.lock:
+            return self._state.get(key, default)
+
+    def flush(self) -> None:
+        """Сбросить накопленные изменения в постоянное хранилище"""
+        with self.lock:
+            if self._dirty_keys:
+                self.storage.save_state({key: self._state[key] for key in self._dirty_keys})
+
+            self._dirty_keys = set()
+            self._dirty_count = 0
+            self._last_flush_time = time.monotonic()
+
+    def _flush_interval_expired(self) -> bool:
+        return bool(self.flush_interval) and time.monotonic() - self._last_flush_time >= self.flush_interval
@@ -1,5 +1,9 @@
 import abc
 import json
+import os
+import sqlite3
+import tempfile
+import threading
 from typing import Optional
 
 from lib.logger import logger
@@ -18,24 +22,147 @@ class BaseStorage:
 
 
 class JsonFileStorage(BaseStorage):
-    def __init__(self, file_path: Optional[str] = None):
+    """
+    Хранит состояние в json файле.
+    Запись атомарная: данные пишутся во временный файл рядом и подменяют старый через rename,
+    поэтому падение посреди записи не оставит наполовину записанный файл
+    """
+
+    def __init__(self, file_path: Optional[str] = None, fsync: bool = False):
+        """
+        :param file_path: путь до файла с состоянием
+        :param fsync: дожидаться сброса файла на диск при каждой записи
+        """
         self.file_path = file_path or './storage.json'
+        self.fsync = fsync
+        self._state = None
 
     def retrieve_state(self) -> dict:
         try:
             with open(self.file_path) as storage_file:
                 raw_data = storage_file.read()
-                return json.loads(raw_data) if raw_data else {}
+                self._state = json.loads(raw_data) if raw_data else {}
         except FileNotFoundError:
             logger.warning(
                 f'Не найден файл по пути {self.file_path}. '
                 'В качестве данных возвращен пустой словарь. Файл создастся при записи.'
             )
-            return {}
+            self._state = {}
+
+        return dict(self._state)
 
     def save_state(self, state: dict) -> None:
-        old_state = self.retrieve_state()
+        # файлом владеет только этот объект, поэтому перечитывать его перед записью не нужно
+        old_state = self._state if self._state is not None else self.retrieve_state()
+        new_state = {**old_state, **state}
+
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.storage-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as storage_file:
+                json.dump(new_state, storage_file, indent=2)
+                if self.fsync:
+                    storage_file.flush()
+                    os.fsync(storage_file.fileno())
+
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self._state = new_state
+
+
+class SqliteStorage(BaseStorage):
+    """
+    Хранит состояние в локальном файле SQLite в режиме WAL.
+    Ожидается состояние вида {pipeline: {table: {key: value}}}: на каждую пару (pipeline, table) одна строка,
+    а при сохранении в одной транзакции обновляются только изменившиеся ключи.
+    Поэтому чекпоинт стоит O(1) и несколько воркеров (в том числе из разных процессов) не затирают чужие данные
+    """
+
+    def __init__(self, file_path: Optional[str] = None, fsync: bool = False, busy_timeout: float = 30):
+        """
+        :param file_path: путь до файла базы
+        :param fsync: synchronous=FULL вместо NORMAL, т.е. дожидаться сброса на диск при каждом коммите
+        :param busy_timeout: сколько секунд ждать, если базу заблокировал другой писатель
+        """
+        self.file_path = file_path or './storage.sqlite3'
+        self._lock = threading.Lock()
+        self._known = {}
+
+        self._conn = sqlite3.connect(
+            self.file_path,
+            timeout=busy_timeout,
+            isolation_level=None,  # транзакциями управляем явно
+            check_same_thread=False,
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(f'PRAGMA synchronous={"FULL" if fsync else "NORMAL"}')
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pipeline_state (
+                pipeline TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                data TEXT NOT NULL DEFAULT '{}',
+                PRIMARY KEY (pipeline, table_name)
+            )
+            """
+        )
+
+    def retrieve_state(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute('SELECT pipeline, table_name, data FROM pipeline_state').fetchall()
+
+        state = {}
+        for pipeline, table_name, data in rows:
+            state.setdefault(pipeline, {})[table_name] = json.loads(data)
+            self._known[(pipeline, table_name)] = json.loads(data)
+
+        return state
+
+    def save_state(self, state: dict) -> None:
+        changes = {}
+        for pipeline, tables in state.items():
+            for table_name, data in tables.items():
+                known = self._known.get((pipeline, table_name), {})
+                changed = {key: value for key, value in data.items() if key not in known or known[key] != value}
+                if changed:
+                    changes[(pipeline, table_name)] = changed
+
+        if not changes:
+            return
+
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for (pipeline, table_name), changed in changes.items():
+                    self._upsert(pipeline, table_name, changed)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+        for key, changed in changes.items():
+            self._known.setdefault(key, {}).update(changed)
+
+    def _upsert(self, pipeline: str, table_name: str, changed: dict):
+        """Обновляет только переданные ключи строки (pipeline, table_name), создавая строку при необходимости"""
+        self._conn.execute(
+            'INSERT OR IGNORE INTO pipeline_state (pipeline, table_name) VALUES (?, ?)',
+            (pipeline, table_name)
+        )
+
+        set_args = ', '.join('?, json(?)' for _ in changed)
+        params = []
+        for key, value in changed.items():
+            params.extend((f'$."{key}"', json.dumps(value)))
+
+        self._conn.execute(
+            f'UPDATE pipeline_state SET data = json_set(data, {set_args}) WHERE pipeline = ? AND table_name = ?',
+            (*params, pipeline, table_name)
+        )
 
-        with open(self.file_path, 'w') as storage_file:
-            new_state = {**old_state, **state}
-            json.dump(new_state, storage_file, indent=2)
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,4 +1,11 @@
+from functools import lru_cache
+
+from settings import settings
+
+from storage.constants import StorageBackendEnum
+from storage.dead_letter import DeadLetterFile
 from storage.state import State
+from storage.storage import BaseStorage, JsonFileStorage, SqliteStorage
 
 
 def update_storage_data_in_pipeline_table(
@@ -8,7 +15,7 @@ def update_storage_data_in_pipeline_table(
     data: dict
 ):
     """
-    Обертка для удобного сохранения данных в storage.json
+    Обертка для удобного сохранения данных пайплайна в хранилище состояния
 
     :param state: Объект для доступа к состоянию
     :param pipline_name: имя пайплайна в котором нужно что то изменить
@@ -16,10 +23,28 @@ def update_storage_data_in_pipeline_table(
     :param data: dict с полями которые будут обновлены в таблице пайплайна
     :return: None
     """
-    state[pipline_name] = {
-        **state[pipline_name],
-        table_name: {
-            **state[pipline_name][table_name],
-            **data
+    # пайплайны могут работать в разных потоках, поэтому чтение и запись раздела делаются атомарно
+    with state.lock:
+        state[pipline_name] = {
+            **state[pipline_name],
+            table_name: {
+                **state[pipline_name][table_name],
+                **data
+            }
         }
-    }
+
+
+def get_storage() -> BaseStorage:
+    """Создает хранилище состояния, выбранное в settings.STATE_BACKEND"""
+    backend = StorageBackendEnum(settings.STATE_BACKEND)
+
+    if backend is StorageBackendEnum.SQLITE:
+        return SqliteStorage(settings.STATE_SQLITE_PATH, fsync=settings.STATE_FSYNC)
+
+    return JsonFileStorage(settings.STATE_FILE_PATH, fsync=settings.STATE_FSYNC)
+
+
+@lru_cache(maxsize=None)
+def get_dead_letter_file() -> DeadLetterFile:
+    """Возвращает единственный на процесс файл недоставленных документов, настроенный из settings"""
+    return DeadLetterFile(settings.DEAD_LETTER_PATH)
@@ -0,0 +1,132 @@
+"""
+Микробенчмарк сборки документов в postgres_merger.
+
+Сравнивает процессорное время на батч у прежней реализации (проверка дубликатов через списки)
+и у аккумуляторов из etl_components.mergers на синтетических строках join'а.
+Заодно проверяет, что обе реализации выдают одинаковые документы.
+
+Запуск из папки 01_etl:
+    python benchmarks/bench_merger.py --films 50 --cast 200 --genres 10
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+os.environ.setdefault('DB_USER', 'bench')
+os.environ.setdefault('DB_PASSWORD', 'bench')
+
+from etl_components.mergers import (FilmWorkDocumentAccumulator, merge_film_work_rows,  # noqa: E402
+                                    sort_film_work_document, validate_rows)
+from etl_components.models import FilmWorkMergedData  # noqa: E402
+from etl_components.utils import merged_fw_data_template_factory  # noqa: E402
+from postgres_components.constants import PersonRoleEnum  # noqa: E402
+
+ROLES = [role.value for role in PersonRoleEnum]
+
+
+def generate_film_rows(films: int, cast: int, genres: int) -> list:
+    """Строки join'а film_work x person_film_work x genre_film_work: cast * genres строк на фильм"""
+    genre_ids = [(str(uuid.uuid4()), f'genre {i}') for i in range(genres)]
+    rows = []
+    for film_number in range(films):
+        fw_id = str(uuid.uuid4())
+        persons = [(str(uuid.uuid4()), f'person {i}', ROLES[i % len(ROLES)]) for i in range(cast)]
+        for person_id, full_name, role in persons:
+            for genre_id, genre_name in genre_ids:
+                rows.append({
+                    'fw_id': fw_id,
+                    'title': f'film {film_number}',
+                    'description': 'description',
+                    'rating': 7.5,
+                    'type': 'movie',
+                    'role': role,
+                    'id': person_id,
+                    'full_name': full_name,
+                    'genre_id': genre_id,
+                    'genre_name': genre_name,
+                })
+    return rows
+
+
+def legacy_accumulate(valid_items: list) -> list:
+    """Прежняя реализация: для каждой строки пересобирает списки id и ищет в них линейно"""
+    merged_data = defaultdict(merged_fw_data_template_factory)
+    for fw_id, valid_item in valid_items:
+        merged_data[fw_id]['id'] = fw_id
+        merged_data[fw_id]['imdb_rating'] = valid_item.rating
+        merged_data[fw_id]['title'] = valid_item.title
+        merged_data[fw_id]['description'] = valid_item.description
+
+        if valid_item.genre_id not in [i['id'] for i in merged_data[fw_id]['genres']]:
+            merged_data[fw_id]['genres'].append({'id': valid_item.genre_id, 'name': valid_item.genre_name})
+
+        for role, persons_field, names_field in (
+            (PersonRoleEnum.ACTOR.value, 'actors', 'actors_names'),
+            (PersonRoleEnum.WRITER.value, 'writers', 'writers_names'),
+            (PersonRoleEnum.DIRECTOR.value, 'directors', 'director'),
+        ):
+            if valid_item.role == role and valid_item.id not in [i['id'] for i in merged_data[fw_id][persons_field]]:
+                merged_data[fw_id][persons_field].append({'id': valid_item.id, 'name': valid_item.full_name})
+                merged_data[fw_id][names_field].append(valid_item.full_name)
+
+    # порядок жанров и персон в документе общий для всех merger'ов
+    return [sort_film_work_document(document) for document in merged_data.values()]
+
+
+def accumulate(valid_items: list) -> list:
+    accumulator = FilmWorkDocumentAccumulator()
+    for fw_id, valid_item in valid_items:
+        accumulator.add(fw_id, valid_item)
+    return accumulator.values()
+
+
+def legacy_merge_film_work_rows(rows: list) -> list:
+    return legacy_accumulate(list(validate_rows(rows, FilmWorkMergedData, 'fw_id')))
+
+
+def measure(func, rows: list, repeat: int):
+    """Возвращает минимальное процессорное время из repeat прогонов и результат последнего"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = func(rows)
+        best = min(best, time.process_time() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=50, help='фильмов в батче')
+    parser.add_argument('--cast', type=int, default=200, help='персон у каждого фильма')
+    parser.add_argument('--genres', type=int, default=10, help='жанров у каждого фильма')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = generate_film_rows(args.films, args.cast, args.genres)
+    print(f'batch: {args.films} films x {args.cast} persons x {args.genres} genres = {len(rows)} rows')
+
+    valid_items = list(validate_rows(rows, FilmWorkMergedData, 'fw_id'))
+    legacy_time, legacy_docs = measure(legacy_accumulate, valid_items, args.repeat)
+    current_time, current_docs = measure(accumulate, valid_items, args.repeat)
+    assert legacy_docs == current_docs, 'implementations produce different documents'
+
+    print('accumulation only (rows already validated):')
+    print(f'  legacy (list scans):   {legacy_time * 1000:9.1f} ms/batch')
+    print(f'  accumulator (sets):    {current_time * 1000:9.1f} ms/batch')
+    print(f'  speedup:               {legacy_time / current_time:9.1f}x')
+
+    legacy_time, _ = measure(legacy_merge_film_work_rows, rows, args.repeat)
+    current_time, _ = measure(merge_film_work_rows, rows, args.repeat)
+    print('full merger step (validation + accumulation):')
+    print(f'  legacy (list scans):   {legacy_time * 1000:9.1f} ms/batch')
+    print(f'  accumulator (sets):    {current_time * 1000:9.1f} ms/batch')
+    print(f'  speedup:               {legacy_time / current_time:9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Микробенчмарк представления строк в postgres_merger: DictCursor + pydantic против кортежей + etl_components.rows.
+
+Прежний путь: каждая строка - DictRow, затем dict, затем модель pydantic.
+Компактный путь (MERGER_COMPACT_ROWS): строка - кортеж обычного курсора, затем namedtuple из скомпилированной проверки.
+Кортежи в обоих случаях создает psycopg2, поэтому в прежний путь входит только сборка DictRow поверх них.
+
+Печатает строки в секунду и пиковую память (tracemalloc) на батч для проверки строк и для шага merger'а целиком.
+Заодно проверяет, что оба пути выдают одинаковые документы.
+
+Запуск из папки 01_etl:
+    python benchmarks/bench_rows.py --films 50 --cast 200 --genres 10
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+os.environ.setdefault('DB_USER', 'bench')
+os.environ.setdefault('DB_PASSWORD', 'bench')
+
+from bench_merger import generate_film_rows  # noqa: E402
+from psycopg2.extras import DictRow  # noqa: E402
+
+from etl_components.mergers import ROW_SCHEMAS, merge_film_work_rows, validate_rows  # noqa: E402
+from etl_components.models import FilmWorkMergedData  # noqa: E402
+
+
+class FakeDictCursor:
+    """Ровно то, что DictRow берет у DictCursor: индекс колонок и описание"""
+
+    def __init__(self, columns: list):
+        self.index = {name: position for position, name in enumerate(columns)}
+        self.description = columns
+
+
+def build_dict_rows(cursor: FakeDictCursor, rows: list) -> list:
+    """Как DictCursor: DictRow поверх значений каждой строки"""
+    dict_rows = []
+    for values in rows:
+        row = DictRow(cursor)
+        list.__setitem__(row, slice(None), values)
+        dict_rows.append(row)
+    return dict_rows
+
+
+def pydantic_validate(cursor: FakeDictCursor, rows: list) -> list:
+    raw_data = tuple(dict(i) for i in build_dict_rows(cursor, rows))
+    return list(validate_rows(raw_data, FilmWorkMergedData, 'fw_id'))
+
+
+def pydantic_merge(cursor: FakeDictCursor, rows: list) -> list:
+    raw_data = tuple(dict(i) for i in build_dict_rows(cursor, rows))
+    return merge_film_work_rows(raw_data)
+
+
+def measure(func, repeat: int, *args):
+    """Возвращает минимальное процессорное время из repeat прогонов и результат последнего"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = func(*args)
+        best = min(best, time.process_time() - started)
+    return best, result
+
+
+def peak_memory(func, *args) -> int:
+    """Пиковая память, выделенная за вызов func, в байтах"""
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def report(title: str, rows_count: int, legacy: tuple, compact: tuple):
+    (legacy_time, legacy_peak), (compact_time, compact_peak) = legacy, compact
+    print(title)
+    print(f'  dict + pydantic:   {rows_count / legacy_time:12,.0f} rows/s  {legacy_peak / 2 ** 20:8.1f} MiB peak')
+    print(f'  compact rows:      {rows_count / compact_time:12,.0f} rows/s  {compact_peak / 2 ** 20:8.1f} MiB peak')
+    print(f'  speedup: {legacy_time / compact_time:.1f}x, peak memory: {compact_peak / legacy_peak:.0%} of dict + pydantic')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=50, help='фильмов в батче')
+    parser.add_argument('--cast', type=int, default=200, help='персон у каждого фильма')
+    parser.add_argument('--genres', type=int, default=10, help='жанров у каждого фильма')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    dict_rows = generate_film_rows(args.films, args.cast, args.genres)
+    columns = list(dict_rows[0])
+    rows = [tuple(row.values()) for row in dict_rows]
+    cursor = FakeDictCursor(columns)
+    schema = ROW_SCHEMAS[FilmWorkMergedData]
+    print(f'batch: {args.films} films x {args.cast} persons x {args.genres} genres = {len(rows)} rows')
+
+    def compact_validate():
+        return list(schema.validate_rows(rows, columns))
+
+    legacy_time, legacy_items = measure(pydantic_validate, args.repeat, cursor, rows)
+    compact_time, compact_items = measure(compact_validate, args.repeat)
+    assert [(doc_id, item.dict()) for doc_id, item in legacy_items] == \
+        [(doc_id, item._asdict()) for doc_id, item in compact_items], 'validated rows differ'
+    report(
+        'row validation:',
+        len(rows),
+        (legacy_time, peak_memory(pydantic_validate, cursor, rows)),
+        (compact_time, peak_memory(compact_validate)),
+    )
+
+    legacy_time, legacy_docs = measure(pydantic_merge, args.repeat, cursor, rows)
+    compact_time, compact_docs = measure(merge_film_work_rows, args.repeat, rows, columns)
+    assert legacy_docs == compact_docs, 'implementations produce different documents'
+    report(
+        'full merger step (rows -> documents):',
+        len(rows),
+        (legacy_time, peak_memory(pydantic_merge, cursor, rows)),
+        (compact_time, peak_memory(merge_film_work_rows, rows, columns)),
+    )
+
+
+if __name__ == '__main__':
+    main()
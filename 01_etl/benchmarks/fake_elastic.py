@@ -0,0 +1,222 @@
+"""
+Легкая замена Elasticsearch для бенчмарков: HTTP сервер, который принимает _bulk запросы,
+ничего не индексирует и записывает число запросов, документов, байт и время ответа.
+
+Отвечает ровно так, как ожидает клиент elasticsearch-py 8: с заголовком X-Elastic-Product
+и статусом для каждого документа. Через --latency можно добавить задержку на запрос,
+через --reject-every - отвечать 429 на каждый N-й документ, чтобы проверить ретраи.
+
+Запуск отдельным процессом из папки 01_etl:
+    python benchmarks/fake_elastic.py --port 9201 --latency 0.01
+Статистика: GET /_bench/stats, сброс: POST /_bench/reset
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+ROOT_INFO = {
+    'name': 'fake-elastic',
+    'cluster_name': 'benchmark',
+    'version': {'number': '8.6.0', 'build_flavor': 'default', 'lucene_version': '9.4.2'},
+    'tagline': 'You Know, for Search',
+}
+
+
+class BulkStats:
+    """Счетчики принятых _bulk запросов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.documents = 0
+            self.rejected = 0
+            self.bytes_received = 0
+            self.latencies = []
+
+    def record(self, body_bytes: int, documents: int, rejected: int, latency: float):
+        with self._lock:
+            self.requests += 1
+            self.documents += documents
+            self.rejected += rejected
+            self.bytes_received += body_bytes
+            self.latencies.append(latency)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0
+            return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+        return {
+            'requests': self.requests,
+            'documents': self.documents,
+            'rejected': self.rejected,
+            'bytes_received': self.bytes_received,
+            'latency_total': sum(latencies),
+            'latency_p50': percentile(0.5),
+            'latency_p99': percentile(0.99),
+        }
+
+
+class FakeElasticsearch:
+    """Сервер, который можно поднять в фоне внутри бенчмарка или отдельным процессом"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0, reject_every: int = 0):
+        """
+        :param port: 0 - выбрать свободный порт
+        :param latency: искусственная задержка ответа на _bulk в секундах
+        :param reject_every: отвечать 429 на каждый N-й документ (0 - никогда)
+        """
+        self.latency = latency
+        self.reject_every = reject_every
+        self.stats = BulkStats()
+        self._documents_seen = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self.server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> 'FakeElasticsearch':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-elastic', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def bulk_items(self, body: bytes) -> list:
+        """Разбирает NDJSON тело _bulk запроса и формирует ответ для каждого документа"""
+        items = []
+        lines = iter(body.splitlines())
+        for line in lines:
+            if not line.strip():
+                continue
+
+            action = json.loads(line)
+            op_type, meta = next(iter(action.items()))
+            if op_type != 'delete':
+                next(lines, None)  # строка с документом
+
+            with self._lock:
+                self._documents_seen += 1
+                rejected = self.reject_every and self._documents_seen % self.reject_every == 0
+
+            if rejected:
+                items.append({op_type: {
+                    '_index': meta.get('_index'),
+                    '_id': meta.get('_id'),
+                    'status': 429,
+                    'error': {'type': 'es_rejected_execution_exception', 'reason': 'rejected by fake-elastic'},
+                }})
+            else:
+                items.append({op_type: {
+                    '_index': meta.get('_index'),
+                    '_id': meta.get('_id'),
+                    '_version': 1,
+                    'result': 'created',
+                    'status': 201,
+                }})
+        return items
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send_json(self, status: int, payload: Optional[dict]):
+                body = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('X-Elastic-Product', 'Elasticsearch')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+            def do_HEAD(self):
+                self._send_json(200, None)
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/':
+                    self._send_json(200, ROOT_INFO)
+                elif path == '/_bench/stats':
+                    self._send_json(200, fake.stats.snapshot())
+                else:
+                    self._send_json(200, {})
+
+            def do_DELETE(self):
+                self._send_json(200, {'acknowledged': True})
+
+            def do_POST(self):
+                path = self.path.split('?', 1)[0]
+                body = self._read_body()
+
+                if path == '/_bench/reset':
+                    fake.stats.reset()
+                    self._send_json(200, {'acknowledged': True})
+                    return
+
+                if not path.endswith('/_bulk'):
+                    self._send_json(200, {'acknowledged': True})
+                    return
+
+                started = time.perf_counter()
+                items = fake.bulk_items(body)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                rejected = sum(1 for item in items if next(iter(item.values()))['status'] == 429)
+
+                self._send_json(200, {'took': 1, 'errors': bool(rejected), 'items': items})
+                fake.stats.record(len(body), len(items) - rejected, rejected, time.perf_counter() - started)
+
+            # клиент отправляет _bulk через PUT, создание индексов и настроек тоже PUT
+            do_PUT = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9201)
+    parser.add_argument('--latency', type=float, default=0, help='задержка ответа на _bulk, секунды')
+    parser.add_argument('--reject-every', type=int, default=0, help='отвечать 429 на каждый N-й документ')
+    args = parser.parse_args()
+
+    fake = FakeElasticsearch(args.host, args.port, args.latency, args.reject_every)
+    print(f'fake elastic is listening on http://{fake.host}:{fake.port}')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(fake.stats.snapshot(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
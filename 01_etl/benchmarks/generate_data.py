@@ -0,0 +1,253 @@
+"""
+Генератор синтетических данных для схемы content.
+
+Создает таблицы film_work, person, genre, person_film_work и genre_film_work (если их нет)
+и заливает в них данные через COPY. Число персон у фильма и жанров у фильма задается средним,
+а выбор персон подчиняется распределению Ципфа: при --skew > 0 небольшая группа "звезд"
+снимается в большой доле фильмов, как в реальных каталогах. Именно такие персоны дают
+самые тяжелые батчи enricher'а и merger'а.
+
+Запуск из папки 01_etl (подключение берется из app/.env или переменных DB_*):
+    python benchmarks/generate_data.py --films 20000 --persons 50000 --genres 30 --cast 15 --skew 1.1 --truncate
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Iterable, List
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from settings import settings  # noqa: E402
+
+from postgres_components.constants import PersonRoleEnum  # noqa: E402
+
+SCHEMA_SQL = """
+CREATE SCHEMA IF NOT EXISTS content;
+
+CREATE TABLE IF NOT EXISTS content.film_work (
+    id uuid PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    creation_date DATE,
+    rating FLOAT,
+    type TEXT NOT NULL,
+    created timestamp with time zone,
+    modified timestamp with time zone
+);
+
+CREATE TABLE IF NOT EXISTS content.genre (
+    id uuid PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    created timestamp with time zone,
+    modified timestamp with time zone
+);
+
+CREATE TABLE IF NOT EXISTS content.person (
+    id uuid PRIMARY KEY,
+    full_name TEXT NOT NULL,
+    created timestamp with time zone,
+    modified timestamp with time zone
+);
+
+CREATE TABLE IF NOT EXISTS content.genre_film_work (
+    id uuid PRIMARY KEY,
+    genre_id uuid NOT NULL REFERENCES content.genre (id) ON DELETE CASCADE,
+    film_work_id uuid NOT NULL REFERENCES content.film_work (id) ON DELETE CASCADE,
+    created timestamp with time zone,
+    modified timestamp with time zone
+);
+
+CREATE TABLE IF NOT EXISTS content.person_film_work (
+    id uuid PRIMARY KEY,
+    person_id uuid NOT NULL REFERENCES content.person (id) ON DELETE CASCADE,
+    film_work_id uuid NOT NULL REFERENCES content.film_work (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    created timestamp with time zone,
+    modified timestamp with time zone
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS genre_film_work_idx ON content.genre_film_work (film_work_id, genre_id);
+CREATE UNIQUE INDEX IF NOT EXISTS person_film_work_idx ON content.person_film_work (film_work_id, person_id, role);
+CREATE INDEX IF NOT EXISTS person_film_work_person_idx ON content.person_film_work (person_id);
+CREATE INDEX IF NOT EXISTS genre_film_work_genre_idx ON content.genre_film_work (genre_id);
+
+CREATE INDEX IF NOT EXISTS film_work_modified_idx ON content.film_work (modified, id);
+CREATE INDEX IF NOT EXISTS person_modified_idx ON content.person (modified, id);
+CREATE INDEX IF NOT EXISTS genre_modified_idx ON content.genre (modified, id);
+CREATE INDEX IF NOT EXISTS person_film_work_modified_idx ON content.person_film_work (modified, id);
+CREATE INDEX IF NOT EXISTS genre_film_work_modified_idx ON content.genre_film_work (modified, id);
+"""
+
+TABLES = ('person_film_work', 'genre_film_work', 'film_work', 'person', 'genre')
+
+ROLES = [role.value for role in PersonRoleEnum]
+# актеров в фильмах заметно больше, чем сценаристов и режиссеров
+ROLE_WEIGHTS = {PersonRoleEnum.ACTOR.value: 8, PersonRoleEnum.WRITER.value: 2, PersonRoleEnum.DIRECTOR.value: 1}
+
+
+def zipf_cum_weights(size: int, skew: float) -> List[float]:
+    """Накопленные веса распределения Ципфа: вес i-го элемента 1 / (i + 1) ** skew, skew=0 - равномерное"""
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(size)))
+
+
+def sample_distinct(rng: random.Random, population: list, cum_weights: List[float], k: int) -> set:
+    """Выбирает k разных элементов с весами (для больших population дешевле, чем random.sample без повторов)"""
+    k = min(k, len(population))
+    chosen = set()
+    while len(chosen) < k:
+        chosen.update(rng.choices(population, cum_weights=cum_weights, k=k - len(chosen)))
+    return chosen
+
+
+class CopyBuffer:
+    """Собирает строки для COPY ... FROM STDIN в формате text и отправляет их пачками"""
+
+    def __init__(self, cursor, table: str, columns: Iterable[str], depends_on=(), flush_rows: int = 50_000):
+        """
+        :param depends_on: буферы таблиц, на которые ссылаются внешние ключи, они сбрасываются раньше
+        """
+        self.cursor = cursor
+        self.depends_on = tuple(depends_on)
+        self.table = table
+        self.columns = tuple(columns)
+        self.flush_rows = flush_rows
+        self.rows = 0
+        self._buffer = io.StringIO()
+        self._pending = 0
+
+    def add(self, *values):
+        self._buffer.write('\t'.join('\\N' if value is None else str(value) for value in values))
+        self._buffer.write('\n')
+        self._pending += 1
+        if self._pending >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        for dependency in self.depends_on:
+            dependency.flush()
+
+        self._buffer.seek(0)
+        self.cursor.copy_expert(
+            f'COPY content.{self.table} ({", ".join(self.columns)}) FROM STDIN',
+            self._buffer,
+        )
+        self.rows += self._pending
+        self._buffer = io.StringIO()
+        self._pending = 0
+
+
+def generate(pg_conn, args) -> dict:
+    """Заливает данные и возвращает число строк по таблицам"""
+    rng = random.Random(args.seed)
+    base_time = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    # modified растет вместе с номером строки, чтобы сканирование по modified шло как по реальному журналу правок
+    tick = timedelta(milliseconds=1)
+
+    def new_id() -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    with pg_conn.cursor() as cur:
+        genre_ids = [new_id() for _ in range(args.genres)]
+        genres = CopyBuffer(cur, 'genre', ('id', 'name', 'description', 'created', 'modified'))
+        for number, genre_id in enumerate(genre_ids):
+            modified = base_time + number * tick
+            genres.add(genre_id, f'Genre {number}', f'Synthetic genre {number}', modified, modified)
+        genres.flush()
+
+        person_ids = [new_id() for _ in range(args.persons)]
+        persons = CopyBuffer(cur, 'person', ('id', 'full_name', 'created', 'modified'))
+        for number, person_id in enumerate(person_ids):
+            modified = base_time + number * tick
+            persons.add(person_id, f'Person {number}', modified, modified)
+        persons.flush()
+
+        films = CopyBuffer(cur, 'film_work', ('id', 'title', 'description', 'creation_date', 'rating', 'type',
+                                              'created', 'modified'))
+        genre_links = CopyBuffer(cur, 'genre_film_work', ('id', 'genre_id', 'film_work_id', 'created', 'modified'),
+                                 depends_on=(films,))
+        person_links = CopyBuffer(cur, 'person_film_work', ('id', 'person_id', 'film_work_id', 'role',
+                                                            'created', 'modified'), depends_on=(films,))
+
+        person_cum_weights = zipf_cum_weights(len(person_ids), args.skew)
+        genre_cum_weights = zipf_cum_weights(len(genre_ids), args.genre_skew)
+        roles_cum_weights = list(accumulate(ROLE_WEIGHTS[role] for role in ROLES))
+
+        for number in range(args.films):
+            film_id = new_id()
+            modified = base_time + number * tick
+            films.add(
+                film_id,
+                f'Film {number}',
+                f'Synthetic description of film {number}',
+                (base_time - timedelta(days=rng.randrange(365 * 50))).date(),
+                round(rng.uniform(1, 10), 1),
+                rng.choice(('movie', 'tv_show')),
+                modified,
+                modified,
+            )
+
+            genres_count = max(1, round(rng.expovariate(1 / args.genres_per_film))) if args.genres_per_film else 0
+            for genre_id in sample_distinct(rng, genre_ids, genre_cum_weights, genres_count):
+                genre_links.add(new_id(), genre_id, film_id, modified, modified)
+
+            cast_count = max(1, round(rng.expovariate(1 / args.cast))) if args.cast else 0
+            for person_id in sample_distinct(rng, person_ids, person_cum_weights, cast_count):
+                role = rng.choices(ROLES, cum_weights=roles_cum_weights)[0]
+                person_links.add(new_id(), person_id, film_id, role, modified, modified)
+
+        genre_links.flush()
+        person_links.flush()
+
+    return {
+        'genre': genres.rows,
+        'person': persons.rows,
+        'film_work': films.rows,
+        'genre_film_work': genre_links.rows,
+        'person_film_work': person_links.rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=10_000)
+    parser.add_argument('--persons', type=int, default=20_000)
+    parser.add_argument('--genres', type=int, default=30)
+    parser.add_argument('--cast', type=float, default=10, help='среднее число персон у фильма')
+    parser.add_argument('--genres-per-film', type=float, default=2, help='среднее число жанров у фильма')
+    parser.add_argument('--skew', type=float, default=1.0, help='показатель Ципфа для персон, 0 - без звезд')
+    parser.add_argument('--genre-skew', type=float, default=0.8, help='показатель Ципфа для жанров')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--truncate', action='store_true', help='очистить таблицы перед заливкой')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with psycopg2.connect(**settings.dsl) as pg_conn:
+        with pg_conn.cursor() as cur:
+            cur.execute(SCHEMA_SQL)
+            if args.truncate:
+                cur.execute(f'TRUNCATE {", ".join(f"content.{table}" for table in TABLES)}')
+
+        rows = generate(pg_conn, args)
+
+        with pg_conn.cursor() as cur:
+            cur.execute(f'ANALYZE {", ".join(f"content.{table}" for table in TABLES)}')
+
+    for table, count in rows.items():
+        print(f'{table:>18}: {count} rows')
+    print(f'generated in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Сквозной бенчмарк пайплайнов: полная загрузка из postgres в Elastic с нулевого состояния.
+
+Каждый пайплайн прогоняется в отдельном процессе (чтобы peak RSS не смешивался между пайплайнами)
+против локального postgres и fake_elastic.FakeElasticsearch (или настоящего Elastic через --es-url).
+По каждому пайплайну выводятся docs/sec, rows/sec, peak RSS, объем bulk запросов
+и суммарное время стадий из метрик etl_stage_seconds.
+
+Данные можно подготовить через generate_data.py. Запуск из папки 01_etl:
+    python benchmarks/run_benchmark.py --mode staged --batch-size 1000 --es-latency 0.005
+    python benchmarks/run_benchmark.py --pipelines film_work_pipeline --merger sql --json result.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCHMARKS_DIR, '..', 'app')
+sys.path.insert(0, APP_DIR)
+
+from fake_elastic import FakeElasticsearch  # noqa: E402
+
+PIPELINE_NAMES = ('film_work_pipeline', 'person_pipeline', 'genre_pipeline')
+STAGES = ('producer', 'enricher', 'merger', 'loader')
+INITIAL_MODIFIED_DT = '1970-01-01T00:00:00+00:00'
+
+
+def fetch_es_stats(es_url: str) -> Optional[dict]:
+    """Статистика fake_elastic, у настоящего Elastic ее нет"""
+    try:
+        with urllib.request.urlopen(f'{es_url}/_bench/stats') as response:
+            stats = json.loads(response.read())
+    except OSError:
+        return None
+    return stats if 'bytes_received' in stats else None
+
+
+def reset_es_stats(es_url: str):
+    request = urllib.request.Request(f'{es_url}/_bench/reset', method='POST', data=b'')
+    try:
+        urllib.request.urlopen(request).close()
+    except OSError:
+        pass
+
+
+def run_pipeline(pipeline_name: str, state_dir: str, results: multiprocessing.Queue):
+    """Тело дочернего процесса: прогоняет пайплайн до исчерпания изменений и отправляет результат в results"""
+    # импорт внутри процесса: settings читает окружение, подготовленное в main
+    from etl_components.constants import ChangeSourceEnum
+    from etl_components.metrics import DOCUMENTS_LOADED, ROWS_SCANNED, STAGE_SECONDS
+    from etl_components.pipelines import PIPELINES, run_pipeline_cycle
+    from storage.state import State
+    from storage.storage import JsonFileStorage
+
+    pipeline = next(i for i in PIPELINES if i.PIPELINE_NAME == pipeline_name)
+    state_path = os.path.join(state_dir, f'{pipeline_name}.json')
+    with open(state_path, 'w') as state_file:
+        json.dump({
+            pipeline_name: {
+                table_spec.table_name: {'last_modified_dt': INITIAL_MODIFIED_DT}
+                for table_spec in pipeline.TARGET_TABLE_SPECS
+            }
+        }, state_file)
+    state = State(JsonFileStorage(state_path), flush_every=100)
+
+    cycles = 0
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    while True:
+        cycles += 1
+        processed_batches = run_pipeline_cycle(pipeline, state, ChangeSourceEnum.SCAN)
+        if not any(processed_batches.values()):
+            break
+    wall_time = time.perf_counter() - started
+
+    def pipeline_total(values: Dict[tuple, float]) -> float:
+        return sum(value for key, value in values.items() if key[0] == pipeline_name)
+
+    stage_seconds = {stage: 0.0 for stage in STAGES}
+    for (name, _, stage), (seconds, _) in STAGE_SECONDS.values().items():
+        if name == pipeline_name:
+            stage_seconds[stage] = stage_seconds.get(stage, 0) + seconds
+
+    results.put({
+        'pipeline': pipeline_name,
+        'cycles': cycles,
+        'wall_seconds': wall_time,
+        'cpu_seconds': time.process_time() - cpu_started,
+        'rows_scanned': pipeline_total(ROWS_SCANNED.values()),
+        'documents_loaded': pipeline_total(DOCUMENTS_LOADED.values()),
+        # ru_maxrss в Linux в килобайтах
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stage_seconds': stage_seconds,
+    })
+
+
+def run(pipeline_name: str, es_url: str) -> dict:
+    reset_es_stats(es_url)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+
+    with tempfile.TemporaryDirectory(prefix='etl-bench-') as state_dir:
+        process = context.Process(target=run_pipeline, args=(pipeline_name, state_dir, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f'{pipeline_name} benchmark failed with exit code {process.exitcode}')
+
+    result = results.get()
+    result['es'] = fetch_es_stats(es_url)
+    return result
+
+
+def print_report(results: List[dict]):
+    for result in results:
+        wall = result['wall_seconds'] or float('inf')
+        print(f"\n{result['pipeline']} ({result['cycles']} cycles)")
+        print(f"  documents:   {int(result['documents_loaded']):>10}  {result['documents_loaded'] / wall:10.0f} docs/sec")
+        print(f"  rows:        {int(result['rows_scanned']):>10}  {result['rows_scanned'] / wall:10.0f} rows/sec")
+        print(f"  wall / cpu:  {result['wall_seconds']:9.2f}s  {result['cpu_seconds']:9.2f}s")
+        print(f"  peak RSS:    {result['peak_rss_mb']:9.1f} MB")
+        for stage, seconds in result['stage_seconds'].items():
+            print(f'  {stage + ":":<12} {seconds:9.2f}s  {seconds / wall * 100:5.1f}% of wall')
+
+        es = result['es']
+        if es:
+            print(f"  bulk:        {es['requests']:>10} requests  {es['bytes_received'] / 1024 / 1024:9.1f} MB"
+                  f"  p50 {es['latency_p50'] * 1000:.1f} ms  p99 {es['latency_p99'] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pipelines', nargs='+', choices=PIPELINE_NAMES, default=PIPELINE_NAMES)
+    parser.add_argument('--mode', choices=('sequential', 'staged', 'coalesced'), default='sequential')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--merger', choices=('python', 'sql'), default='python')
+    parser.add_argument('--es-url', help='настоящий Elastic вместо fake_elastic, например http://127.0.0.1:9200')
+    parser.add_argument('--es-latency', type=float, default=0, help='задержка fake_elastic на bulk запрос, секунды')
+    parser.add_argument('--json', help='куда сохранить результаты для сравнения прогонов')
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    fake = None
+    es_url = args.es_url
+    if not es_url:
+        fake = FakeElasticsearch(latency=args.es_latency).start()
+        es_url = f'http://{fake.host}:{fake.port}'
+
+    host, port = es_url.rsplit('://', 1)[-1].rsplit(':', 1)
+    os.environ.update({
+        'ES_HOST': host,
+        'ES_PORT': port,
+        'PIPELINE_EXECUTION_MODE': args.mode,
+        'BATCH_SIZE': str(args.batch_size),
+        'MERGER_STRATEGY': json.dumps({name: args.merger for name in PIPELINE_NAMES}),
+        'METRICS_PORT': '0',
+        'LOG_SUMMARY_INTERVAL': '60',
+    })
+    # без .env подключение к локальному postgres задается через DB_*
+    os.chdir(APP_DIR)
+
+    print(f'mode={args.mode} batch_size={args.batch_size} merger={args.merger} elastic={es_url}')
+    try:
+        results = [run(pipeline_name, es_url) for pipeline_name in args.pipelines]
+    finally:
+        if fake is not None:
+            fake.stop()
+
+    print_report(results)
+    if json_path:
+        with open(json_path, 'w') as result_file:
+            json.dump({'args': vars(args), 'results': results}, result_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+-- Change capture для ETL: триггеры пишут идентификаторы изменившихся строк в компактный журнал
+-- content.etl_changelog и отправляют NOTIFY в канал (payload - имя таблицы из журнала).
+-- ETL просыпается по уведомлению и вычитывает только новые записи журнала.
+-- id журнала выдаются при вставке, а не при коммите, поэтому пропуски id за курсором ETL перепроверяет
+-- (CHANGE_CAPTURE_GAP_WINDOW): запись транзакции, закоммиченной позже следующих за ней, не теряется.
+--
+-- Канал берется из параметра etl.change_capture_channel, по умолчанию etl_changes.
+-- Если в ETL задан другой CHANGE_CAPTURE_CHANNEL, его нужно выставить и в базе:
+--     ALTER DATABASE movies_database SET etl.change_capture_channel = 'etl_changes_staging';
+-- Параметр базы действует в новых сессиях, поэтому после изменения пишущие приложения нужно переподключить.
+--
+-- Изменения связки genre_film_work записываются в журнал как изменения film_work,
+-- т.к. они влияют только на документы фильмов.
+--
+-- Журнал не чистится автоматически, старые записи можно удалять по расписанию:
+--     DELETE FROM content.etl_changelog WHERE changed_at < now() - interval '7 days';
+-- При этом ETL должен успеть их вычитать, иначе изменения подхватит только сканирование по modified.
+
+CREATE TABLE IF NOT EXISTS content.etl_changelog (
+    id bigserial PRIMARY KEY,
+    table_name text NOT NULL,
+    row_id uuid NOT NULL,
+    changed_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS etl_changelog_table_name_id_idx ON content.etl_changelog (table_name, id);
+
+-- Аргументы триггера: имя таблицы для журнала и колонка с идентификатором для журнала
+CREATE OR REPLACE FUNCTION content.etl_capture_change() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO content.etl_changelog (table_name, row_id)
+    VALUES (TG_ARGV[0], (to_jsonb(NEW) ->> TG_ARGV[1])::uuid);
+
+    PERFORM pg_notify(
+        coalesce(nullif(current_setting('etl.change_capture_channel', true), ''), 'etl_changes'),
+        TG_ARGV[0]
+    );
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS etl_capture_change ON content.film_work;
+CREATE TRIGGER etl_capture_change AFTER INSERT OR UPDATE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_capture_change('film_work', 'id');
+
+DROP TRIGGER IF EXISTS etl_capture_change ON content.person;
+CREATE TRIGGER etl_capture_change AFTER INSERT OR UPDATE ON content.person
+    FOR EACH ROW EXECUTE FUNCTION content.etl_capture_change('person', 'id');
+
+DROP TRIGGER IF EXISTS etl_capture_change ON content.genre;
+CREATE TRIGGER etl_capture_change AFTER INSERT OR UPDATE ON content.genre
+    FOR EACH ROW EXECUTE FUNCTION content.etl_capture_change('genre', 'id');
+
+DROP TRIGGER IF EXISTS etl_capture_change ON content.person_film_work;
+CREATE TRIGGER etl_capture_change AFTER INSERT OR UPDATE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_capture_change('person_film_work', 'id');
+
+DROP TRIGGER IF EXISTS etl_capture_change ON content.genre_film_work;
+CREATE TRIGGER etl_capture_change AFTER INSERT OR UPDATE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_capture_change('film_work', 'film_work_id');
@@ -0,0 +1,80 @@
+"""
+Общие фикстуры тестов ETL.
+
+Модули приложения импортируются из папки app, как при запуске main.py.
+Тесты, которым нужен postgres, получают соединение из фикстуры pg_conn: таблицы создаются во временной схеме
+базы из settings (app/.env или переменные DB_*), а если postgres недоступен, тест пропускается.
+
+Запуск из папки 01_etl:
+    python -m pytest tests
+"""
+import os
+import sys
+import uuid
+
+import psycopg2
+import pytest
+from psycopg2.extras import DictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+os.environ.setdefault('DB_USER', 'test')
+os.environ.setdefault('DB_PASSWORD', 'test')
+
+from settings import settings  # noqa: E402
+
+SCHEMA_SQL = """
+CREATE TABLE film_work (
+    id uuid PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    rating FLOAT,
+    type TEXT NOT NULL,
+    modified timestamp with time zone DEFAULT now()
+);
+CREATE TABLE genre (
+    id uuid PRIMARY KEY,
+    name TEXT NOT NULL,
+    modified timestamp with time zone DEFAULT now()
+);
+CREATE TABLE person (
+    id uuid PRIMARY KEY,
+    full_name TEXT NOT NULL,
+    modified timestamp with time zone DEFAULT now()
+);
+CREATE TABLE genre_film_work (
+    id uuid PRIMARY KEY,
+    genre_id uuid NOT NULL REFERENCES genre (id) ON DELETE CASCADE,
+    film_work_id uuid NOT NULL REFERENCES film_work (id) ON DELETE CASCADE
+);
+CREATE TABLE person_film_work (
+    id uuid PRIMARY KEY,
+    person_id uuid NOT NULL REFERENCES person (id) ON DELETE CASCADE,
+    film_work_id uuid NOT NULL REFERENCES film_work (id) ON DELETE CASCADE,
+    role TEXT NOT NULL
+);
+"""
+
+
+@pytest.fixture
+def pg_conn():
+    """Соединение с search_path на пустую временную схему с таблицами content, схема удаляется после теста"""
+    schema = f'etl_test_{uuid.uuid4().hex[:12]}'
+    dsl = {**settings.dsl, 'options': f'-c search_path={schema}', 'connect_timeout': 3}
+    try:
+        conn = psycopg2.connect(**dsl, cursor_factory=DictCursor)
+    except psycopg2.OperationalError as error:
+        pytest.skip(f'postgres is not available: {error}')
+
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE SCHEMA {schema};')
+        cur.execute(SCHEMA_SQL)
+    conn.commit()
+
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA {schema} CASCADE;')
+        conn.commit()
+        conn.close()
@@ -0,0 +1,140 @@
+"""
+Заглушки пайплайна и таблиц для тестов use_cases без postgres и Elastic.
+
+Заглушки повторяют контракты EtlProcess и AbstractPostgresTableSpec в памяти:
+строки таблицы и журнал изменений задаются списками, а документы совпадают с изменившимися строками.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from postgres_components.table_spec import ChangelogPage, KeysetCursor
+
+
+class FakePipeline:
+    """Пайплайн без справочников: идентификаторы изменившихся строк и есть идентификаторы документов"""
+
+    PIPELINE_NAME = 'fake_pipeline'
+
+    @staticmethod
+    def postgres_producer(
+        pg_conn,
+        table_spec,
+        last_modified_dt: Union[datetime, str],
+        last_row_id: str,
+        batch_limit: int,
+        until: Optional[KeysetCursor] = None,
+    ) -> Tuple[Tuple[str], Optional[KeysetCursor]]:
+        return table_spec.get_modified_row_ids(pg_conn, last_modified_dt, last_row_id, batch_limit, until)
+
+    @staticmethod
+    def get_dimension_patch(table_name: str):
+        return None
+
+    @staticmethod
+    def postgres_resolve_affected_ids(pg_conn, table_spec, modified_row_ids: Tuple[str]) -> bool:
+        return False
+
+    @staticmethod
+    def postgres_enricher(pg_conn, table_spec, modified_row_ids: Tuple[str], batch_limit: int, last_id: str):
+        return tuple(sorted(i for i in set(modified_row_ids) if i > last_id)[:batch_limit])
+
+
+def parse_keyset_cursor(cursor: KeysetCursor) -> KeysetCursor:
+    """Курсор с modified-datetime, как normalize_keyset_cursors, но без postgres"""
+    modified = cursor.modified
+    if isinstance(modified, str):
+        modified = datetime.fromisoformat(modified)
+    return KeysetCursor(modified=modified, id=cursor.id)
+
+
+class FakeScanTableSpec:
+    """Таблица в памяти для сканирования по (modified, id), строки можно менять между чтениями"""
+
+    table_name = 'film_work'
+
+    def __init__(self):
+        self.rows: Dict[str, datetime] = {}
+
+    def get_modified_row_ids(
+        self,
+        pg_conn,
+        last_modified_dt: Union[datetime, str],
+        last_row_id: str,
+        limit: int,
+        until: Optional[KeysetCursor] = None,
+    ) -> Tuple[Tuple[str], Optional[KeysetCursor]]:
+        last = parse_keyset_cursor(KeysetCursor(modified=last_modified_dt, id=last_row_id))
+        page = sorted(KeysetCursor(modified=modified, id=row_id) for row_id, modified in self.rows.items())
+        page = [i for i in page if i > last]
+        if until is None:
+            page = page[:limit]
+        else:
+            until = parse_keyset_cursor(until)
+            page = [i for i in page if i <= until]
+        if not page:
+            return (), None
+
+        return tuple(i.id for i in page), page[-1]
+
+
+class FakeChangelogTableSpec:
+    """
+    Журнал etl_changelog в памяти: записи получают id при вставке, а видны становятся после commit,
+    как записи транзакций с bigserial
+    """
+
+    table_name = 'film_work'
+
+    def __init__(self):
+        self.journal: Dict[int, Tuple[str, str]] = {}
+        self.committed: List[int] = []
+        self.next_id = 1
+
+    def insert(self, row_id: str, table_name: Optional[str] = None, commit: bool = True) -> int:
+        change_id = self.next_id
+        self.next_id += 1
+        self.journal[change_id] = (table_name or self.table_name, row_id)
+        if commit:
+            self.commit(change_id)
+        return change_id
+
+    def commit(self, change_id: int):
+        self.committed.append(change_id)
+
+    def get_changelog_row_ids(
+        self,
+        pg_conn,
+        last_change_id: int,
+        limit: int,
+        until_change_id: Optional[int] = None,
+        gap_window: int = 0,
+    ) -> ChangelogPage:
+        visible = sorted(self.committed)
+        page = [
+            i for i in visible
+            if i > last_change_id and self.journal[i][0] == self.table_name
+            and (until_change_id is None or i <= until_change_id)
+        ]
+        if until_change_id is None:
+            page = page[:limit]
+        if not page:
+            return ChangelogPage(row_ids=(), last_change_id=None, gap_ids=())
+
+        after_id = max(last_change_id, page[-1] - gap_window)
+        gap_ids = tuple(i for i in range(after_id + 1, page[-1]) if i not in visible)
+        row_ids = tuple(dict.fromkeys(self.journal[i][1] for i in page))
+        return ChangelogPage(row_ids=row_ids, last_change_id=page[-1], gap_ids=gap_ids)
+
+    def get_changelog_gap_row_ids(self, pg_conn, gap_ids: Sequence[int]) -> Tuple[Tuple[str], Tuple[int]]:
+        filled = [i for i in sorted(gap_ids) if i in self.committed]
+        row_ids = tuple(dict.fromkeys(self.journal[i][1] for i in filled if self.journal[i][0] == self.table_name))
+        return row_ids, tuple(filled)
+
+
+def run_batches(batches, table_state: dict) -> List[str]:
+    """Применяет чекпоинты батчей к состоянию таблицы, как process_table, и возвращает загруженные идентификаторы"""
+    loaded = []
+    for batch in batches:
+        loaded.extend(batch.target_ids)
+        table_state.update(batch.checkpoint)
+    return loaded
@@ -0,0 +1,86 @@
+"""Чтение журнала etl_changelog: записи транзакций, закоммиченных позже следующих за ними, не теряются"""
+import pytest
+from fakes import FakeChangelogTableSpec, FakePipeline, run_batches
+from settings import settings
+
+from etl_components.constants import ChangeSourceEnum
+from etl_components.use_cases import iter_pipeline_batches
+
+
+@pytest.fixture
+def table_spec():
+    return FakeChangelogTableSpec()
+
+
+def read_changelog(table_spec: FakeChangelogTableSpec, table_state: dict, batch_size: int = 10) -> list:
+    batches = iter_pipeline_batches(
+        FakePipeline, None, table_spec, table_state, batch_size, change_source=ChangeSourceEnum.CHANGELOG
+    )
+    return run_batches(batches, table_state)
+
+
+def test_late_commit_is_read_from_gap(table_spec):
+    table_spec.insert('a')
+    late_change_id = table_spec.insert('b', commit=False)
+    table_spec.insert('c')
+    table_spec.insert('x', table_name='person')
+    table_state = {}
+
+    assert read_changelog(table_spec, table_state) == ['a', 'c']
+    assert table_state['changelog_last_id'] == 3
+    assert table_state['changelog_gap_ids'] == [late_change_id]
+
+    table_spec.commit(late_change_id)
+
+    assert read_changelog(table_spec, table_state) == ['b']
+    assert table_state['changelog_gap_ids'] == []
+    assert read_changelog(table_spec, table_state) == []
+
+
+def test_gap_filled_by_other_table_is_dropped(table_spec):
+    other_change_id = table_spec.insert('x', table_name='person', commit=False)
+    table_spec.insert('a')
+    table_state = {}
+
+    assert read_changelog(table_spec, table_state) == ['a']
+    assert table_state['changelog_gap_ids'] == [other_change_id]
+
+    table_spec.commit(other_change_id)
+
+    assert read_changelog(table_spec, table_state) == []
+    assert table_state['changelog_gap_ids'] == []
+
+
+def test_gaps_expire_behind_window(monkeypatch, table_spec):
+    monkeypatch.setattr(settings, 'CHANGE_CAPTURE_GAP_WINDOW', 3)
+    rolled_back_change_id = table_spec.insert('rolled back', commit=False)
+    table_spec.insert('a')
+    table_state = {}
+
+    read_changelog(table_spec, table_state)
+    assert table_state['changelog_gap_ids'] == [rolled_back_change_id]
+
+    for row_id in ('b', 'c', 'd'):
+        table_spec.insert(row_id)
+
+    assert read_changelog(table_spec, table_state) == ['b', 'c', 'd']
+    assert table_state['changelog_gap_ids'] == []
+
+
+def test_interrupted_late_page_is_read_again(table_spec):
+    table_spec.insert('a')
+    late_change_id = table_spec.insert('b', commit=False)
+    table_spec.insert('c')
+    table_state = {}
+    read_changelog(table_spec, table_state)
+    table_spec.commit(late_change_id)
+
+    batches = iter_pipeline_batches(
+        FakePipeline, None, table_spec, table_state, 10, change_source=ChangeSourceEnum.CHANGELOG
+    )
+    first_batch = next(batches)
+    assert first_batch.target_ids == ('b',)
+    table_state.update(first_batch.checkpoint)
+    batches.close()
+
+    assert read_changelog(table_spec, table_state) == ['b']
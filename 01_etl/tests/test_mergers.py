@@ -0,0 +1,209 @@
+"""
+Равенство документов всех стратегий merger'а на одном наборе данных.
+
+Документы python merger'а (в любом порядке строк, словарями и кортежами), потокового merger'а
+и ожидаемые документы postgres_sql_merger сравниваются после json-сериализации, как их видит Elastic.
+Сами запросы postgres_sql_merger проверяются на временной схеме, если доступен postgres (см. conftest.pg_conn).
+"""
+import json
+import random
+from itertools import product
+
+import pytest
+from settings import settings
+
+from etl_components.constants import MergerStrategyEnum
+from etl_components.etl_process import EtlFilmWorkProcess, EtlGenreProcess, EtlPersonProcess
+
+DRAMA = '10000000-0000-0000-0000-000000000001'
+COMEDY = '10000000-0000-0000-0000-000000000002'
+HORROR = '10000000-0000-0000-0000-000000000003'
+
+ANN = '20000000-0000-0000-0000-000000000001'
+BOB = '20000000-0000-0000-0000-000000000002'
+CID = '20000000-0000-0000-0000-000000000003'
+DEE = '20000000-0000-0000-0000-000000000004'
+
+ALPHA = '30000000-0000-0000-0000-000000000001'
+BETA = '30000000-0000-0000-0000-000000000002'
+GAMMA = '30000000-0000-0000-0000-000000000003'
+
+GENRES = {DRAMA: 'Drama', COMEDY: 'Comedy', HORROR: 'Horror'}
+PERSONS = {ANN: 'Ann', BOB: 'Bob', CID: 'Cid', DEE: 'Dee'}
+# id -> (title, description, rating)
+FILMS = {
+    ALPHA: ('Alpha', 'first', 8.1),
+    BETA: ('Beta', None, None),
+    GAMMA: ('Gamma', 'third', 5.0),
+}
+# строки связей перечислены не по порядку id: порядок в документе от них зависеть не должен
+GENRE_FILM_WORK = [(COMEDY, ALPHA), (DRAMA, ALPHA), (DRAMA, GAMMA)]
+PERSON_FILM_WORK = [
+    (BOB, ALPHA, 'actor'),
+    (ANN, ALPHA, 'director'),
+    (ANN, ALPHA, 'actor'),
+    (CID, ALPHA, 'writer'),
+    (CID, BETA, 'actor'),
+]
+
+EXPECTED_FILM_WORKS = [
+    {
+        'id': ALPHA,
+        'imdb_rating': 8.1,
+        'genres': [{'id': DRAMA, 'name': 'Drama'}, {'id': COMEDY, 'name': 'Comedy'}],
+        'title': 'Alpha',
+        'description': 'first',
+        'director': ['Ann'],
+        'actors_names': ['Ann', 'Bob'],
+        'writers_names': ['Cid'],
+        'actors': [{'id': ANN, 'name': 'Ann'}, {'id': BOB, 'name': 'Bob'}],
+        'writers': [{'id': CID, 'name': 'Cid'}],
+        'directors': [{'id': ANN, 'name': 'Ann'}],
+    },
+    {
+        'id': BETA,
+        'imdb_rating': None,
+        'genres': [],
+        'title': 'Beta',
+        'description': None,
+        'director': [],
+        'actors_names': ['Cid'],
+        'writers_names': [],
+        'actors': [{'id': CID, 'name': 'Cid'}],
+        'writers': [],
+        'directors': [],
+    },
+    {
+        'id': GAMMA,
+        'imdb_rating': 5.0,
+        'genres': [{'id': DRAMA, 'name': 'Drama'}],
+        'title': 'Gamma',
+        'description': 'third',
+        'director': [],
+        'actors_names': [],
+        'writers_names': [],
+        'actors': [],
+        'writers': [],
+        'directors': [],
+    },
+]
+EXPECTED_PERSONS = [
+    {'id': ANN, 'full_name': 'Ann', 'roles': ['actor', 'director'], 'film_ids': [ALPHA]},
+    {'id': BOB, 'full_name': 'Bob', 'roles': ['actor'], 'film_ids': [ALPHA]},
+    {'id': CID, 'full_name': 'Cid', 'roles': ['actor', 'writer'], 'film_ids': [ALPHA, BETA]},
+    {'id': DEE, 'full_name': 'Dee', 'roles': [], 'film_ids': []},
+]
+EXPECTED_GENRES = [{'id': genre_id, 'name': name} for genre_id, name in GENRES.items()]
+
+PROCESSES = [
+    (EtlFilmWorkProcess, EXPECTED_FILM_WORKS),
+    (EtlPersonProcess, EXPECTED_PERSONS),
+    (EtlGenreProcess, EXPECTED_GENRES),
+]
+
+
+def film_work_rows() -> list:
+    """Строки FLAT_MERGER_QUERY фильмов: LEFT JOIN дает None вместо отсутствующих персон и жанров"""
+    rows = []
+    for fw_id, (title, description, rating) in FILMS.items():
+        persons = [(person_id, role) for person_id, film_id, role in PERSON_FILM_WORK if film_id == fw_id]
+        genres = [genre_id for genre_id, film_id in GENRE_FILM_WORK if film_id == fw_id]
+        for (person_id, role), genre_id in product(persons or [(None, None)], genres or [None]):
+            rows.append({
+                'fw_id': fw_id,
+                'title': title,
+                'description': description,
+                'rating': rating,
+                'type': 'movie',
+                'role': role,
+                'id': person_id,
+                'full_name': PERSONS.get(person_id),
+                'genre_id': genre_id,
+                'genre_name': GENRES.get(genre_id),
+            })
+    return rows
+
+
+def person_rows() -> list:
+    """Строки FLAT_MERGER_QUERY персон"""
+    rows = []
+    for person_id, full_name in PERSONS.items():
+        films = [(film_id, role) for film_person_id, film_id, role in PERSON_FILM_WORK if film_person_id == person_id]
+        for film_id, role in films or [(None, None)]:
+            rows.append({'id': person_id, 'role': role, 'full_name': full_name, 'film_id': film_id})
+    return rows
+
+
+def genre_rows() -> list:
+    """Строки FLAT_MERGER_QUERY жанров"""
+    return [{'id': genre_id, 'name': name} for genre_id, name in GENRES.items()]
+
+
+# процесс -> (строки FLAT_MERGER_QUERY, колонка с id документа)
+FLAT_ROWS = {
+    EtlFilmWorkProcess: (film_work_rows, 'fw_id'),
+    EtlPersonProcess: (person_rows, 'id'),
+    EtlGenreProcess: (genre_rows, 'id'),
+}
+
+
+def as_json(documents) -> list:
+    """Документы в том виде, в каком они уходят в Elastic, упорядоченные по id"""
+    return sorted(json.loads(json.dumps(list(documents), default=str)), key=lambda document: document['id'])
+
+
+@pytest.mark.parametrize('process, expected', PROCESSES)
+@pytest.mark.parametrize('seed', [None, 1, 2, 3])
+def test_python_merger_ignores_row_order(process, expected, seed):
+    rows = FLAT_ROWS[process][0]()
+    if seed is not None:
+        random.Random(seed).shuffle(rows)
+
+    assert as_json(process.merge_rows(rows)) == expected
+
+
+@pytest.mark.parametrize('process, expected', PROCESSES)
+def test_compact_rows_match_dict_rows(process, expected):
+    rows = FLAT_ROWS[process][0]()
+    columns = list(rows[0])
+
+    assert as_json(process.merge_rows([tuple(row.values()) for row in rows], columns)) == expected
+
+
+@pytest.mark.parametrize('process, expected', PROCESSES)
+def test_streaming_merger_matches_python_merger(process, expected):
+    get_rows, id_column = FLAT_ROWS[process]
+    rows = sorted(get_rows(), key=lambda row: row[id_column])
+
+    assert as_json(process.iter_documents(rows)) == expected
+
+
+def insert_dataset(pg_conn):
+    with pg_conn.cursor() as cur:
+        cur.executemany('INSERT INTO genre (id, name) VALUES (%s, %s);', list(GENRES.items()))
+        cur.executemany('INSERT INTO person (id, full_name) VALUES (%s, %s);', list(PERSONS.items()))
+        cur.executemany(
+            "INSERT INTO film_work (id, title, description, rating, type) VALUES (%s, %s, %s, %s, 'movie');",
+            [(fw_id, *film) for fw_id, film in FILMS.items()],
+        )
+        cur.executemany(
+            'INSERT INTO genre_film_work (id, genre_id, film_work_id) VALUES (gen_random_uuid(), %s, %s);',
+            GENRE_FILM_WORK,
+        )
+        cur.executemany(
+            'INSERT INTO person_film_work (id, person_id, film_work_id, role) VALUES (gen_random_uuid(), %s, %s, %s);',
+            PERSON_FILM_WORK,
+        )
+    pg_conn.commit()
+
+
+@pytest.mark.parametrize('process, expected', PROCESSES)
+@pytest.mark.parametrize('strategy', list(MergerStrategyEnum))
+@pytest.mark.parametrize('compact_rows', [False, True])
+def test_merger_strategies_on_postgres(monkeypatch, pg_conn, process, expected, strategy, compact_rows):
+    insert_dataset(pg_conn)
+    monkeypatch.setattr(settings, 'MERGER_STRATEGY', {process.PIPELINE_NAME: strategy.value})
+    monkeypatch.setattr(settings, 'MERGER_COMPACT_ROWS', compact_rows)
+    target_ids = tuple(document['id'] for document in expected)
+
+    assert as_json(process.postgres_merger(pg_conn, target_ids)) == expected
@@ -0,0 +1,94 @@
+"""Продолжение сканирования таблицы с чекпоинта, сохраненного на середине страницы producer'а"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fakes import FakePipeline, FakeScanTableSpec, parse_keyset_cursor, run_batches
+
+from etl_components import use_cases
+from etl_components.use_cases import iter_pipeline_batches
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+ALL_IDS = ['a', 'b', 'c', 'd', 'e', 'f']
+
+
+class OneByOnePipeline(FakePipeline):
+    """Enricher отдает по одному документу, чтобы страницу producer'а можно было прервать на середине"""
+
+    @staticmethod
+    def postgres_enricher(pg_conn, table_spec, modified_row_ids, batch_limit: int, last_id: str):
+        return FakePipeline.postgres_enricher(pg_conn, table_spec, modified_row_ids, 1, last_id)
+
+
+@pytest.fixture(autouse=True)
+def keyset_cursors_without_postgres(monkeypatch):
+    monkeypatch.setattr(
+        use_cases, 'normalize_keyset_cursors', lambda pg_conn, cursors: [parse_keyset_cursor(i) for i in cursors]
+    )
+
+
+@pytest.fixture
+def table_spec():
+    """Порядок строк по modified не совпадает с порядком id, в котором идет enricher"""
+    spec = FakeScanTableSpec()
+    for minutes, row_id in enumerate(('c', 'e', 'a', 'f', 'b', 'd')):
+        spec.rows[row_id] = START + timedelta(minutes=minutes)
+    return spec
+
+
+@pytest.fixture
+def interrupted_state(table_spec):
+    """
+    Состояние после падения на середине первой страницы (c, e, a при размере 3):
+    enricher идет по id и успел загрузить a и c, но не e
+    """
+    table_state = {'last_modified_dt': (START - timedelta(days=1)).isoformat(), 'last_row_id': None}
+    loaded = []
+    for batch in iter_pipeline_batches(OneByOnePipeline, None, table_spec, table_state, batch_size=3):
+        table_state.update(batch.checkpoint)
+        loaded.extend(batch.target_ids)
+        if 'c' in batch.target_ids:
+            break
+
+    assert loaded == ['a', 'c']
+    assert table_state['enricher_last_id'] == 'c'
+    assert table_state['enricher_page_end_id'] == 'a'
+    return table_state
+
+
+def scan(table_spec: FakeScanTableSpec, table_state: dict, batch_size: int) -> list:
+    return run_batches(iter_pipeline_batches(OneByOnePipeline, None, table_spec, table_state, batch_size), table_state)
+
+
+@pytest.mark.parametrize('resumed_batch_size', [1, 3, 5, 100])
+def test_resumed_page_is_read_up_to_its_saved_end(table_spec, interrupted_state, resumed_batch_size):
+    resumed = scan(table_spec, interrupted_state, batch_size=resumed_batch_size)
+
+    # размер страницы изменился, но прерванная страница дочитывается до сохраненного конца (только e),
+    # а b и d со следующих страниц не теряются, хотя их id меньше enricher_last_id
+    assert resumed[0] == 'e'
+    assert sorted(resumed) == ['b', 'd', 'e', 'f']
+    assert interrupted_state['enricher_last_id'] is None
+    assert interrupted_state['enricher_page_end_id'] is None
+
+
+def test_rows_of_resumed_page_modified_since_are_read_by_later_pages(table_spec, interrupted_state):
+    # строка e прерванной страницы изменилась: теперь ее прочитает последняя страница
+    table_spec.rows['e'] = START + timedelta(hours=1)
+
+    resumed = scan(table_spec, interrupted_state, batch_size=3)
+
+    assert sorted(resumed) == ['b', 'd', 'e', 'f']
+    assert resumed[-1] == 'e'
+
+
+def test_state_without_page_end_restarts_the_page(table_spec, interrupted_state):
+    interrupted_state['enricher_page_end_dt'] = interrupted_state['enricher_page_end_id'] = None
+
+    assert sorted(scan(table_spec, interrupted_state, batch_size=5)) == ALL_IDS
+
+
+def test_scan_without_interruption_loads_every_row_once(table_spec):
+    table_state = {'last_modified_dt': (START - timedelta(days=1)).isoformat(), 'last_row_id': None}
+
+    assert sorted(scan(table_spec, table_state, batch_size=4)) == ALL_IDS
+    assert table_state['last_row_id'] == 'd'
@@ -0,0 +1,137 @@
+"""Выдача соединений PostgresConnectionPool из нескольких потоков"""
+import threading
+import time
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from postgres_components.pool import PostgresConnectionPool
+
+
+class FakeInfo:
+    transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    """Соединение без postgres: пулу нужны только closed, info и close"""
+
+    info = FakeInfo()
+
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(PostgresConnectionPool):
+    """Пул, который вместо postgres открывает FakeConnection и считает выданные соединения"""
+
+    def __init__(self, max_size: int, failing_connect: int = 0):
+        """:param failing_connect: номер открытия соединения (с 1), которое завершится ошибкой"""
+        super().__init__({}, max_size=max_size, health_check_interval=3600)
+        self.opened = []
+        self.connects = 0
+        self.failing_connect = failing_connect
+        self.in_use = 0
+        self.max_in_use = 0
+        self._counter_lock = threading.Lock()
+
+    def _connect(self):
+        self.connects += 1
+        if self.connects == self.failing_connect:
+            raise RuntimeError('connect failed')
+        pg_conn = FakeConnection()
+        self.opened.append(pg_conn)
+        return pg_conn
+
+    def use(self, pg_conns: list, seconds: float):
+        """Держит соединения seconds секунд и запоминает, сколько их было выдано одновременно"""
+        with self._counter_lock:
+            self.in_use += len(pg_conns)
+            self.max_in_use = max(self.max_in_use, self.in_use)
+        time.sleep(seconds)
+        with self._counter_lock:
+            self.in_use -= len(pg_conns)
+
+
+def run_threads(targets, timeout: float = 10):
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout)
+    return [thread for thread in threads if thread.is_alive()]
+
+
+def test_acquire_under_contention_never_exceeds_pool_size():
+    pool = FakePool(max_size=3)
+    errors = []
+
+    def take(count: int):
+        def target():
+            try:
+                for _ in range(20):
+                    if count == 1:
+                        with pool.connection() as pg_conn:
+                            pool.use([pg_conn], 0.001)
+                    else:
+                        with pool.connections(count) as pg_conns:
+                            assert len(set(map(id, pg_conns))) == count
+                            pool.use(pg_conns, 0.001)
+            except Exception as error:  # noqa: B902
+                errors.append(error)
+        return target
+
+    alive = run_threads([take(count) for count in (1, 2, 3, 2, 1, 2, 3, 1)])
+
+    assert not alive, 'threads are stuck waiting for connections'
+    assert not errors
+    assert pool.max_in_use <= 3
+    assert len(pool.opened) <= 3
+
+
+def test_partial_holders_do_not_deadlock():
+    """Два потока по 2 соединения из пула на 3: по одному за раз каждый мог бы взять одно и ждать вечно"""
+    pool = FakePool(max_size=3)
+    both_waiting = threading.Barrier(2)
+
+    def target():
+        both_waiting.wait()
+        for _ in range(50):
+            with pool.connections(2) as pg_conns:
+                pool.use(pg_conns, 0)
+
+    assert not run_threads([target, target])
+    assert pool.max_in_use <= 3
+
+
+def test_waiting_thread_gets_released_connection():
+    pool = FakePool(max_size=2)
+    acquired = threading.Event()
+
+    with pool.connections(2):
+        waiter = threading.Thread(target=lambda: pool._acquire(1) and acquired.set(), daemon=True)
+        waiter.start()
+        time.sleep(0.05)
+        assert not acquired.is_set()
+
+    assert acquired.wait(5)
+    assert len(pool.opened) == 2
+
+
+def test_failed_connect_frees_reserved_slots():
+    """Если второе из двух соединений не открылось, первое возвращается в пул, а место второго освобождается"""
+    pool = FakePool(max_size=2, failing_connect=2)
+
+    with pytest.raises(RuntimeError):
+        pool._acquire(2)
+
+    with pool.connections(2) as pg_conns:
+        assert pool.opened[0] in pg_conns
+    assert len(pool.opened) == 2
+
+
+def test_count_over_pool_size_is_rejected():
+    with pytest.raises(ValueError):
+        FakePool(max_size=2)._acquire(3)
@@ -0,0 +1,87 @@
+"""Переписывание запросов с именованными параметрами в PREPARE / EXECUTE"""
+from postgres_components.statements import Statement, execute, get_statement
+
+
+class FakeCursor:
+    """Курсор, который только запоминает выполненные запросы"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+
+class FakePreparingConnection:
+    """Соединение, которое помнит подготовленные запросы, как PreparingConnection"""
+
+    def __init__(self):
+        self.prepared_statements = set()
+
+
+def test_params_are_numbered_in_order_of_first_use():
+    statement = Statement(
+        'SELECT id FROM person WHERE id = ANY(%(ids)s::uuid[]) AND modified > %(modified)s AND id <> ALL(%(ids)s::uuid[]);'
+    )
+
+    assert statement.param_names == ('ids', 'modified')
+    assert statement.prepared_sql == (
+        'SELECT id FROM person WHERE id = ANY($1::uuid[]) AND modified > $2 AND id <> ALL($1::uuid[])'
+    )
+    assert statement.execute_sql == f'EXECUTE {statement.name} (%s::uuid[], %s);'
+
+
+def test_cast_of_any_occurrence_is_kept_for_execute():
+    statement = Statement('SELECT id FROM genre WHERE id > %(last_id)s::uuid AND id <> %(last_id)s')
+
+    assert statement.prepared_sql == 'SELECT id FROM genre WHERE id > $1::uuid AND id <> $1'
+    assert statement.execute_sql == f'EXECUTE {statement.name} (%s::uuid);'
+
+
+def test_escaped_percent_is_unescaped_for_prepare():
+    statement = Statement("SELECT id FROM film_work WHERE title LIKE 'Star%%' AND rating > %(rating)s;")
+
+    assert statement.prepared_sql == "SELECT id FROM film_work WHERE title LIKE 'Star%' AND rating > $1"
+
+
+def test_statement_without_params():
+    statement = Statement('SELECT 1;')
+
+    assert statement.param_names == ()
+    assert statement.prepared_sql == 'SELECT 1'
+    assert statement.execute_sql == f'EXECUTE {statement.name};'
+
+
+def test_statement_name_depends_only_on_sql():
+    sql = 'SELECT id FROM genre WHERE id = ANY(%(ids)s::uuid[])'
+
+    assert Statement(sql).name == Statement(sql).name
+    assert Statement(sql).name != Statement(f'{sql} ORDER BY id').name
+    assert get_statement(sql) is get_statement(sql)
+
+
+def test_execute_prepares_once_per_connection():
+    connection = FakePreparingConnection()
+    sql = 'SELECT id FROM genre WHERE id = ANY(%(ids)s::uuid[]) LIMIT %(limit)s'
+    statement = get_statement(sql)
+
+    cur = FakeCursor(connection)
+    execute(cur, sql, {'limit': 10, 'ids': ['a']})
+    execute(cur, sql, {'limit': 20, 'ids': ['b']})
+
+    assert cur.executed == [
+        (f'PREPARE {statement.name} AS {statement.prepared_sql};', None),
+        (statement.execute_sql, [['a'], 10]),
+        (statement.execute_sql, [['b'], 20]),
+    ]
+    assert connection.prepared_statements == {statement.name}
+
+
+def test_execute_without_prepared_statements_runs_sql_as_is():
+    cur = FakeCursor(object())
+    sql = 'SELECT id FROM genre WHERE id = ANY(%(ids)s::uuid[])'
+
+    execute(cur, sql, {'ids': ['a']})
+
+    assert cur.executed == [(sql, {'ids': ['a']})]